@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# Write synthetic workflow results shaped like the real inputs, at any scale:
+#
+#   <output>/data/results/qc_basic_stats.tsv
+#   <output>/data/results/qc_quality_base_stats.tsv
+#   <output>/data/results/kraken_reports_merged.tsv.gz (or .tsv)
+#   <output>/data/fastq/{sample}-part-{1,2}_{1,2}.fastq.gz
+#   <output>/workflow_results/<dataset>/output/results/qc/qc_basic_stats.tsv.gz
+#   <output>/delivery_metadata/<dataset>.tsv
+#
+# Usage (from benchmarks/):
+#   ./generate_data.py --samples 500 --taxa 100000 -o /scratch/bench_500
+
+import argparse
+import gzip
+import os
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+# Samples end on the last real sampling date and go back one day at a time
+LAST_SAMPLE_DATE = date(2024, 4, 14)
+STAGES = ["raw_concat", "cleaned"]
+DOMAIN_TAX_IDS = [0, 1, 2, 10239, 2157, 2759]
+N_DATASETS = 6
+
+
+def sample_names(n_samples):
+    dates = [LAST_SAMPLE_DATE - timedelta(days=i) for i in range(n_samples)][::-1]
+    return [f"HTP-{d:%Y-%m-%d}" for d in dates]
+
+
+def write_qc_basic_stats(results_dir, samples, rng):
+    n = len(samples)
+    raw_pairs = rng.integers(1_400_000_000, 2_800_000_000, n)
+    cleaned_pairs = (raw_pairs * rng.uniform(0.85, 0.98, n)).astype(np.int64)
+    basic_stats = pd.DataFrame(
+        {
+            "sample": np.repeat(samples, 2),
+            "stage": np.tile(STAGES, n),
+            "n_read_pairs": np.column_stack([raw_pairs, cleaned_pairs]).ravel(),
+            "percent_gc": rng.normal(48.5, 1.0, 2 * n).round(2),
+            "mean_seq_len": np.tile([150.0, 146.0], n),
+            "percent_duplicates": rng.uniform(5, 30, 2 * n).round(2),
+        }
+    )
+    basic_stats["n_bases_approx"] = (
+        2 * basic_stats["n_read_pairs"] * basic_stats["mean_seq_len"]
+    ).astype(np.int64)
+    basic_stats.to_csv(f"{results_dir}/qc_basic_stats.tsv", sep="\t", index=False)
+    return basic_stats
+
+
+def write_quality_base_stats(results_dir, samples, rng, read_length=150):
+    positions = np.arange(1, read_length + 1)
+    n_rows = len(samples) * len(STAGES) * 2 * read_length
+    # Quality decays towards the end of the read
+    decay = np.tile(np.linspace(0, 4, read_length), n_rows // read_length)
+    quality = pd.DataFrame(
+        {
+            "sample": np.repeat(samples, len(STAGES) * 2 * read_length),
+            "file": np.repeat(
+                [f"{s}_{read}" for s in samples for _ in STAGES for read in (1, 2)],
+                read_length,
+            ),
+            "stage": np.tile(np.repeat(STAGES, 2 * read_length), len(samples)),
+            "position": np.tile(positions, n_rows // read_length),
+            "mean_phred_score": (36 - decay + rng.normal(0, 0.3, n_rows)).round(2),
+        }
+    )
+    quality.to_csv(f"{results_dir}/qc_quality_base_stats.tsv", sep="\t", index=False)
+
+
+def write_kraken_reports(results_dir, samples, n_taxa, taxa_per_sample, rng, gz):
+    path = f"{results_dir}/kraken_reports_merged.tsv" + (".gz" if gz else "")
+    opener = gzip.open if gz else open
+    # Above every domain taxid, so no sample gets a second row for one
+    other_taxa = np.arange(n_taxa) + max(DOMAIN_TAX_IDS) + 1
+    header = True
+    with opener(path, "wt") as outf:
+        for sample in samples:
+            total = int(rng.integers(1_000_000_000, 2_000_000_000))
+            classified = int(total * rng.uniform(0.2, 0.7))
+            domains = [
+                total - classified,
+                classified,
+                int(classified * 0.8),
+                int(classified * 0.05),
+                int(classified * 0.01),
+                int(classified * 0.03),
+            ]
+            taxids = np.concatenate(
+                [
+                    DOMAIN_TAX_IDS,
+                    rng.choice(other_taxa, taxa_per_sample, replace=False),
+                ]
+            )
+            counts = np.concatenate(
+                [domains, rng.zipf(1.5, taxa_per_sample).clip(max=classified)]
+            )
+            report = pd.DataFrame(
+                {
+                    "pc_reads_total": (100 * counts / total).round(4),
+                    "n_reads_clade": counts,
+                    "n_reads_direct": counts // 2,
+                    "n_minimizers_total": counts * 3,
+                    "n_minimizers_distinct": counts,
+                    "rank": "S",
+                    "taxid": taxids,
+                    "name": [f"taxon {t}" for t in taxids],
+                    "sample": sample,
+                }
+            )
+            report.to_csv(outf, sep="\t", index=False, header=header)
+            header = False
+
+
+def write_fastq(fastq_dir, samples, n_reads, rng, read_length=150):
+    os.makedirs(fastq_dir, exist_ok=True)
+    bases = np.frombuffer(b"ACGT", dtype=np.uint8)
+    for sample in samples:
+        for part in (1, 2):
+            seqs = bases[rng.integers(0, 4, (n_reads, read_length))]
+            for read in (1, 2):
+                quals = rng.integers(35, 74, (n_reads, read_length), dtype=np.uint8)
+                with gzip.open(
+                    f"{fastq_dir}/{sample}-part-{part}_{read}.fastq.gz", "wb", 1
+                ) as outf:
+                    for i in range(n_reads):
+                        outf.write(
+                            b"@%s.%d/%d\n%s\n+\n%s\n"
+                            % (
+                                sample.encode(),
+                                i,
+                                read,
+                                seqs[i].tobytes(),
+                                quals[i].tobytes(),
+                            )
+                        )
+
+
+def write_workflow_results(output_dir, basic_stats, samples):
+    # Split samples across deliveries the way new_table_1 expects them
+    datasets = [f"JR-2024-{i + 1:02d}-01" for i in range(N_DATASETS)]
+    os.makedirs(f"{output_dir}/delivery_metadata", exist_ok=True)
+    for dataset, dataset_samples in zip(
+        datasets, np.array_split(np.array(samples), N_DATASETS)
+    ):
+        qc_dir = f"{output_dir}/workflow_results/{dataset}/output/results/qc"
+        os.makedirs(qc_dir, exist_ok=True)
+        basic_stats[basic_stats["sample"].isin(dataset_samples)].to_csv(
+            f"{qc_dir}/qc_basic_stats.tsv.gz", sep="\t", index=False
+        )
+        pd.DataFrame(
+            {
+                "sample": dataset_samples,
+                "date": [s.removeprefix("HTP-") for s in dataset_samples],
+            }
+        ).to_csv(f"{output_dir}/delivery_metadata/{dataset}.tsv", sep="\t", index=False)
+
+
+def generate(
+    output_dir,
+    n_samples,
+    n_taxa,
+    taxa_per_sample,
+    fastq_samples,
+    fastq_reads,
+    gz=True,
+    seed=0,
+):
+    rng = np.random.default_rng(seed)
+    results_dir = f"{output_dir}/data/results"
+    os.makedirs(results_dir, exist_ok=True)
+    os.makedirs(f"{output_dir}/tables", exist_ok=True)
+    samples = sample_names(n_samples)
+
+    basic_stats = write_qc_basic_stats(results_dir, samples, rng)
+    write_quality_base_stats(results_dir, samples, rng)
+    write_kraken_reports(
+        results_dir, samples, n_taxa, min(taxa_per_sample, n_taxa), rng, gz
+    )
+    write_workflow_results(output_dir, basic_stats, samples)
+    if fastq_samples and fastq_reads:
+        write_fastq(
+            f"{output_dir}/data/fastq", samples[:fastq_samples], fastq_reads, rng
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic benchmark data")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--taxa", type=int, default=100_000, help="taxa overall")
+    parser.add_argument("--taxa-per-sample", type=int, default=5_000)
+    parser.add_argument("--fastq-samples", type=int, default=2)
+    parser.add_argument("--fastq-reads", type=int, default=100_000, help="per part")
+    parser.add_argument("--no-gzip", action="store_true", help="plain Kraken TSV")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(
+        args.output,
+        args.samples,
+        args.taxa,
+        args.taxa_per_sample,
+        args.fastq_samples,
+        args.fastq_reads,
+        gz=not args.no_gzip,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
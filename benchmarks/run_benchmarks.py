@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+# Time and memory-profile the table and QC scripts against a synthetic data
+# directory from generate_data.py. Every benchmark runs in a fresh Python
+# process so peak RSS and in-process caches are not shared between them. The
+# fastest of --repeats runs is reported, so on-disk caches (e.g. the
+# qc_basic_stats Parquet cache) are measured warm.
+#
+# Usage (from benchmarks/):
+#   ./run_benchmarks.py /scratch/bench_500 -o results.json
+#   ./run_benchmarks.py /scratch/bench_500 --baseline baseline.json
+
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (script directory, module, function). The data directory mirrors the
+# repository layout (data/results, tables, ...), so running from <data>/tables
+# points every script's default ../ paths at the synthetic data.
+BENCHMARKS = {
+    "table_1": ("table_scripts", "table_1", "generate_table"),
+    "table_s1": ("table_scripts", "table_s1", "start"),
+    "table_s2": ("table_scripts", "table_s2", "generate_table"),
+    "ra_stats": ("one_off_scripts", "ra_stats", "generate_table"),
+    "new_table_1.concatenate_qc_basic_stats": (
+        "table_scripts",
+        "new_table_1",
+        "concatenate_qc_basic_stats",
+    ),
+    "sra_table": ("table_scripts", "create_sra_table", "create_sra_table"),
+    "bio_sample_table": (
+        "table_scripts",
+        "create_biosample_table",
+        "create_biosample_table",
+    ),
+    "input_checks": ("table_scripts", "input_checks", "check_all"),
+    "fastq_qc": ("fastq_scripts", "fastq_qc", "run_qc"),
+}
+
+# Ratio to the baseline above which a benchmark counts as a regression
+REGRESSION_THRESHOLD = 1.2
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_one(name, data_dir):
+    # Runs inside the child process; prints one JSON result
+    script_dir, module_name, function = BENCHMARKS[name]
+    sys.path.insert(0, os.path.join(repo_dir, script_dir))
+    os.chdir(os.path.join(data_dir, "tables"))
+    module = importlib.import_module(module_name)
+
+    args = ()
+    if name == "fastq_qc":
+        # Stored per-file summaries would turn the scan into a lookup
+        shutil.rmtree(module.summary_dir, ignore_errors=True)
+        args = (module.fastq_dir, module.output_dir, module.summary_dir)
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        getattr(module, function)(*args)
+    wall = time.perf_counter() - wall_start
+    # Include worker processes, e.g. fastq_qc's pool
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = time.process_time() - cpu_start + children.ru_utime + children.ru_stime
+    result = {"wall_s": wall, "cpu_s": cpu, "peak_rss_mb": peak_rss_bytes() / 2**20}
+    print(json.dumps(result))
+
+
+def run_benchmark(name, data_dir, repeats):
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, __file__, data_dir, "--run-one", name],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "wall_s": min(run["wall_s"] for run in runs),
+        "cpu_s": min(run["cpu_s"] for run in runs),
+        "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+        "runs": runs,
+    }
+
+
+def compare(results, baseline):
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        for metric in ["wall_s", "peak_rss_mb"]:
+            before = baseline["benchmarks"][name][metric]
+            ratio = result[metric] / before if before else float("inf")
+            flag = "REGRESSION" if ratio > REGRESSION_THRESHOLD else ""
+            print(
+                f"{name:<40} {metric:<12} {before:10.2f} -> "
+                f"{result[metric]:10.2f}  x{ratio:5.2f} {flag}"
+            )
+            if flag:
+                regressions.append((name, metric))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the table scripts")
+    parser.add_argument("data_dir", help="directory written by generate_data.py")
+    parser.add_argument(
+        "benchmarks", nargs="*", help="benchmarks to run (default: all)"
+    )
+    parser.add_argument("-n", "--repeats", type=int, default=3)
+    parser.add_argument("-o", "--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_intermixed_args()
+    data_dir = os.path.abspath(args.data_dir)
+
+    if args.run_one:
+        run_one(args.run_one, data_dir)
+        return
+
+    names = args.benchmarks or list(BENCHMARKS)
+    if not os.path.isdir(os.path.join(data_dir, "data/fastq")) and not args.benchmarks:
+        names.remove("fastq_qc")
+    results = {
+        "data_dir": data_dir,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "benchmarks": {},
+    }
+    for name in names:
+        result = run_benchmark(name, data_dir, args.repeats)
+        results["benchmarks"][name] = result
+        print(f"{name:<40} {result['wall_s']:8.2f}s  {result['peak_rss_mb']:8.1f} MiB")
+
+    if args.output:
+        with open(args.output, "w") as outf:
+            json.dump(results, outf, indent=1)
+    if args.baseline:
+        with open(args.baseline) as inf:
+            baseline = json.load(inf)
+        if compare(results, baseline):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Stream gzipped FASTQ in large decompressed blocks that end on record
+# boundaries, singly or as read 1 / read 2 pairs holding the same reads.
+# Shared by fastq_qc.py and fastq_split.py.
+
+import numpy as np
+
+try:
+    from isal import igzip as gzip  # Several times faster inflate if available
+except ImportError:
+    import gzip
+
+BLOCK_SIZE = 16 * 1024 * 1024
+# Pairs hold a block of each file, so read them in smaller blocks
+PAIRED_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def record_blocks(path, block_size=BLOCK_SIZE):
+    # Yield decompressed blocks that each end on a FASTQ record boundary
+    leftover = b""
+    with gzip.open(path, "rb") as inf:
+        while True:
+            chunk = inf.read(block_size)
+            if not chunk:
+                break
+            buf = leftover + chunk
+            newlines = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == 10)
+            n_lines = len(newlines) - len(newlines) % 4
+            if n_lines == 0:
+                leftover = buf
+                continue
+            cut = int(newlines[n_lines - 1]) + 1
+            yield buf[:cut]
+            leftover = buf[cut:]
+    if leftover.strip():
+        if not leftover.endswith(b"\n"):
+            leftover += b"\n"
+        yield leftover
+
+
+def record_cut(buf, n_records):
+    # Byte offset just after the first n_records records of buf
+    if n_records == 0:
+        return 0
+    newlines = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == 10)
+    return int(newlines[4 * n_records - 1]) + 1
+
+
+def read_id(buf):
+    # Read name of the first record, without a /1 or /2 suffix
+    name = buf[1 : buf.index(b"\n")].split(maxsplit=1)[0]
+    return name[:-2] if name[-2:] in (b"/1", b"/2") else name
+
+
+def paired_blocks(path_1, path_2, block_size=PAIRED_BLOCK_SIZE):
+    # Yield (block_1, block_2, n_reads) holding the same reads from each file
+    readers = [record_blocks(path_1, block_size), record_blocks(path_2, block_size)]
+    bufs = [b"", b""]
+    counts = [0, 0]
+    while True:
+        for i in range(2):
+            if counts[i] == 0 or counts[i] < counts[1 - i]:
+                block = next(readers[i], b"")
+                bufs[i] += block
+                counts[i] += block.count(b"\n") // 4
+        n = min(counts)
+        if n == 0:
+            break
+        cuts = [record_cut(buf, n) for buf in bufs]
+        if read_id(bufs[0]) != read_id(bufs[1]):
+            raise ValueError(f"Read 1 and read 2 are out of sync in {path_1}")
+        yield bufs[0][: cuts[0]], bufs[1][: cuts[1]], n
+        bufs = [buf[cut:] for buf, cut in zip(bufs, cuts)]
+        counts = [count - n for count in counts]
+    if any(counts):
+        raise ValueError(f"{path_1} and {path_2} have different read counts")
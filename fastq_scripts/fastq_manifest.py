@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# Checksum and integrity manifest for the FASTQ files named in sra_table.tsv.
+# Each file is read once, sequentially, in large blocks: the compressed bytes
+# feed MD5, and the same bytes are inflated to check every gzip member's CRC
+# and length and to count reads. Files are processed on a bounded thread pool
+# (hashlib and zlib release the GIL on large buffers). Results are cached by
+# absolute path, size and mtime, so unchanged files are never read again.
+# Read 1 and read 2 of every part must hold the same number of reads.
+#
+# On success, writes ../tables/fastq_manifest.tsv (one row per file) and adds
+# MD5_checksum columns next to the filename columns of sra_table.tsv, written
+# through table_output.write_table() so any TABLE_FORMATS copies match.
+#
+# Usage (from fastq_scripts/):
+#   ./fastq_manifest.py --fastq-dir /path/to/fastq -j 8
+
+import argparse
+import hashlib
+import os
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "../table_scripts")
+)
+from table_output import write_table
+
+# Setting directories
+fastq_dir = "../data/fastq"
+table_dir = "../tables"
+cache_path = "../data/results/.cache/fastq_manifest.tsv"
+
+BLOCK_SIZE = 8 * 1024 * 1024
+FILENAME_COLUMNS = ["filename", "filename2", "filename3", "filename4"]
+# Submission template names for the checksum of each file column
+MD5_COLUMNS = ["MD5_checksum", "MD5_checksum2", "MD5_checksum3", "MD5_checksum4"]
+MANIFEST_COLUMNS = ["path", "size", "mtime_ns", "md5", "n_reads", "error"]
+
+
+def scan_file(path, block_size=BLOCK_SIZE):
+    # MD5 of the compressed file, read count and gzip errors in one pass
+    md5 = hashlib.md5()
+    n_lines = 0
+    last_byte = b"\n"
+    error = ""
+    n_members = 0
+    inflate = None  # Decompressor for the gzip member being read
+    with open(path, "rb") as inf:
+        while True:
+            block = inf.read(block_size)
+            if not block:
+                break
+            md5.update(block)
+            try:
+                while block and not error:
+                    if inflate is None:
+                        inflate = zlib.decompressobj(wbits=31)
+                        n_members += 1
+                    data = inflate.decompress(block)
+                    if data:
+                        n_lines += data.count(b"\n")
+                        last_byte = data[-1:]
+                    # Multi-member gzip (e.g. BGZF) continues with a new member
+                    block = inflate.unused_data if inflate.eof else b""
+                    if inflate.eof:
+                        inflate = None
+            except zlib.error as e:
+                error = f"gzip: {e}"
+    if not error and inflate is not None:
+        error = "gzip: truncated file"
+    if not error and n_members == 0:
+        error = "gzip: empty file"
+    if not error and last_byte != b"\n":
+        n_lines += 1
+    if not error and n_lines % 4:
+        error = f"FASTQ: {n_lines} lines is not a whole number of records"
+    return md5.hexdigest(), n_lines // 4, error
+
+
+def load_cache(path=cache_path):
+    if not os.path.exists(path):
+        return {}
+    cache = pd.read_csv(
+        path, sep="\t", dtype={"md5": str, "error": str}, keep_default_na=False
+    )
+    return {row.path: row._asdict() for row in cache.itertuples(index=False)}
+
+
+def write_cache(entries, path=cache_path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    pd.DataFrame(list(entries.values()), columns=MANIFEST_COLUMNS).to_csv(
+        tmp_path, sep="\t", index=False
+    )
+    os.replace(tmp_path, path)
+
+
+def file_entry(path, cache):
+    # Cached entry for an unchanged file, otherwise a fresh scan. Entries are
+    # keyed on the absolute path, so runs from other directories share them.
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    cached = cache.get(path)
+    if cached and (cached["size"], cached["mtime_ns"]) == (
+        stat.st_size,
+        stat.st_mtime_ns,
+    ):
+        return cached
+    md5, n_reads, error = scan_file(path)
+    return {
+        "path": path,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "md5": md5,
+        "n_reads": n_reads,
+        "error": error,
+    }
+
+
+def parity_errors(sra_table, manifest):
+    # Read 1 and read 2 of each part must have the same number of reads
+    n_reads = dict(zip(manifest["filename"], manifest["n_reads"]))
+    errors = []
+    for row in sra_table.itertuples(index=False):
+        for read_1, read_2 in [
+            (row.filename, row.filename2),
+            (row.filename3, row.filename4),
+        ]:
+            if read_1 in n_reads and read_2 in n_reads:
+                if n_reads[read_1] != n_reads[read_2]:
+                    errors.append(
+                        f"{row.sample_name}: {read_1} has {n_reads[read_1]} reads, "
+                        f"{read_2} has {n_reads[read_2]}"
+                    )
+    return errors
+
+
+def build_manifest(fastq_dir=fastq_dir, table_dir=table_dir, workers=8):
+    sra_path = os.path.join(table_dir, "sra_table.tsv")
+    sra_table = pd.read_csv(sra_path, sep="\t", dtype=str, keep_default_na=False)
+    sra_table = sra_table.drop(columns=MD5_COLUMNS, errors="ignore")
+    filenames = pd.unique(sra_table[FILENAME_COLUMNS].to_numpy().ravel())
+
+    errors = []
+    paths = {}
+    for filename in filenames:
+        path = os.path.join(fastq_dir, filename)
+        if os.path.exists(path):
+            paths[filename] = path
+        else:
+            errors.append(f"{filename}: missing from {fastq_dir}")
+
+    cache = load_cache()
+    # Largest files first, so one big file does not finish the run alone
+    order = sorted(paths, key=lambda filename: -os.path.getsize(paths[filename]))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        entries = dict(
+            zip(order, pool.map(lambda f: file_entry(paths[f], cache), order))
+        )
+    cache.update({entry["path"]: entry for entry in entries.values()})
+    write_cache(cache)
+
+    manifest = pd.DataFrame(
+        [{"filename": filename, **entries[filename]} for filename in paths]
+    )
+    for filename, error in zip(manifest["filename"], manifest["error"]):
+        if error:
+            errors.append(f"{filename}: {error}")
+    errors.extend(parity_errors(sra_table, manifest))
+    if errors:
+        raise ValueError("FASTQ manifest failed:\n" + "\n".join(errors))
+
+    manifest[["filename", "size", "md5", "n_reads"]].to_csv(
+        os.path.join(table_dir, "fastq_manifest.tsv"), sep="\t", index=False
+    )
+    md5s = dict(zip(manifest["filename"], manifest["md5"]))
+    for filename_column, md5_column in zip(FILENAME_COLUMNS, MD5_COLUMNS):
+        position = sra_table.columns.get_loc(filename_column) + 1
+        sra_table.insert(position, md5_column, sra_table[filename_column].map(md5s))
+    write_table(sra_table, sra_path)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checksum the SRA upload FASTQ")
+    parser.add_argument("--fastq-dir", default=fastq_dir)
+    parser.add_argument("--table-dir", default=table_dir)
+    parser.add_argument("-j", "--workers", type=int, default=8, help="threads")
+    args = parser.parse_args()
+    try:
+        build_manifest(args.fastq_dir, args.table_dir, args.workers)
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+# Compute qc_basic_stats and qc_quality_base_stats locally from paired,
+# gzipped FASTQ in the SRA upload layout ({sample}-part-N_{1,2}.fastq.gz).
+# Decompression streams through the main process in large blocks cut at record
+# boundaries; worker processes turn each block into statistics with NumPy, so
+# memory stays constant regardless of file size. Every FASTQ file gets a
+# mergeable summary (see table_scripts/qc_summary.py) that is reused on later
+# runs as long as the file is unchanged.
+#
+# With --sketch, a second pass streams read 1 and read 2 together and feeds
+# read-pair hashes into fixed-size sketches (table_scripts/read_sketch.py),
+# one per part, cached like the summaries. They add approximate distinct read
+# pairs, duplicate percentage and the most over-represented read pair to
+# qc_basic_stats, and write the top read pairs to qc_overrepresented.tsv.
+#
+# Usage (from fastq_scripts/):
+#   ./fastq_qc.py --fastq-dir /path/to/fastq [--sketch] [sample ...]
+
+import argparse
+import glob
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from fastq_blocks import paired_blocks, record_blocks
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "../table_scripts")
+)
+from qc_summary import (
+    MAX_READ_LENGTH,
+    basic_stats_row,
+    empty_summary,
+    load_summary,
+    merge_summaries,
+    save_summary,
+)
+from read_sketch import (
+    duplication_stats,
+    load_sketch,
+    merge_sketches,
+    overrepresented,
+    pair_hashes,
+    pairs_sketch,
+    save_sketch,
+    sequence_hashes,
+)
+
+# Setting directories
+fastq_dir = "../data/fastq"
+output_dir = "../data/results/local_qc"
+summary_dir = "../data/results/qc_summaries"
+sketch_dir = "../data/results/qc_sketches"
+
+PHRED_OFFSET = 33
+N_OVERREPRESENTED = 10
+
+FASTQ_PATTERN = re.compile(
+    r"^(?P<sample>.+?)(-part-(?P<part>\d+))?_(?P<read>[12])\.fastq\.gz$"
+)
+
+_IS_GC = np.zeros(256, dtype=np.uint8)
+_IS_GC[list(b"GCgc")] = 1
+
+
+def line_bounds(buf):
+    # Start and end (exclusive) offsets of each line in a block of whole records
+    arr = np.frombuffer(buf, dtype=np.uint8)
+    ends = np.flatnonzero(arr == ord("\n"))
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    return arr, starts, ends
+
+
+def block_stats(buf):
+    # Summary of a block of complete FASTQ records
+    stats = empty_summary()
+    if not buf:
+        return stats
+    arr, starts, ends = line_bounds(buf)
+    seq_starts, seq_ends = starts[1::4], ends[1::4]
+    qual_starts, qual_ends = starts[3::4], ends[3::4]
+    lengths = seq_ends - seq_starts
+    if len(lengths) and lengths.max() > MAX_READ_LENGTH:
+        raise ValueError(f"Read longer than {MAX_READ_LENGTH} bases")
+
+    gc_cumsum = np.concatenate([[0], np.cumsum(_IS_GC[arr], dtype=np.int64)])
+    stats["n_reads"] = len(lengths)
+    stats["n_bases"] = int(lengths.sum())
+    read_gc = gc_cumsum[seq_ends] - gc_cumsum[seq_starts]
+    stats["n_gc"] = int(read_gc.sum())
+    stats["length_hist"] += np.bincount(lengths, minlength=MAX_READ_LENGTH + 1)
+    nonempty = lengths > 0
+    gc_percent = np.rint(100 * read_gc[nonempty] / lengths[nonempty]).astype(np.int64)
+    stats["gc_hist"] += np.bincount(gc_percent, minlength=101)
+
+    # Per-position quality: index every quality byte by its offset in the read
+    qual_lengths = qual_ends - qual_starts
+    total = int(qual_lengths.sum())
+    read_offsets = np.repeat(np.cumsum(qual_lengths) - qual_lengths, qual_lengths)
+    positions = np.arange(total) - read_offsets
+    scores = arr[np.repeat(qual_starts, qual_lengths) + positions].astype(np.int64)
+    scores -= PHRED_OFFSET
+    stats["qual_sum"] += np.bincount(
+        positions, weights=scores, minlength=MAX_READ_LENGTH
+    ).astype(np.int64)
+    stats["qual_count"] += np.bincount(positions, minlength=MAX_READ_LENGTH)
+    return stats
+
+
+def file_stats(path, pool, max_pending):
+    # Stream one file through the worker pool, keeping at most max_pending
+    # blocks in flight
+    stats = empty_summary()
+    pending = deque()
+    for block in record_blocks(path):
+        pending.append(pool.submit(block_stats, block))
+        if len(pending) >= max_pending:
+            stats = merge_summaries(stats, pending.popleft().result())
+    while pending:
+        stats = merge_summaries(stats, pending.popleft().result())
+    return stats
+
+
+def file_summary(path, sample, read, stage, pool, max_pending, summary_dir):
+    # Reuse the stored summary of an unchanged file, otherwise scan it
+    name = os.path.basename(path).removesuffix(".fastq.gz")
+    summary_path = os.path.join(summary_dir, f"{name}.{stage}.npz")
+    stat = os.stat(path)
+    if os.path.exists(summary_path):
+        summary = load_summary(summary_path)
+        if (summary.get("source_size"), summary.get("source_mtime_ns")) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+        ):
+            return summary
+
+    summary = file_stats(path, pool, max_pending)
+    os.makedirs(summary_dir, exist_ok=True)
+    save_summary(
+        summary_path,
+        summary,
+        sample=sample,
+        read=read,
+        stage=stage,
+        source=os.path.basename(path),
+        source_size=stat.st_size,
+        source_mtime_ns=stat.st_mtime_ns,
+    )
+    return summary
+
+
+def block_pair_sketch(buf_1, buf_2):
+    # Sketch of a pair of blocks holding the same reads
+    hashes = []
+    sequences = []
+    for buf in (buf_1, buf_2):
+        arr, starts, ends = line_bounds(buf)
+        seq_starts = starts[1::4]
+        lengths = ends[1::4] - seq_starts
+        hashes.append(sequence_hashes(arr, seq_starts, lengths))
+        sequences.append(
+            lambda index, arr=arr, seq_starts=seq_starts, lengths=lengths: [
+                arr[start : start + length].tobytes().decode()
+                for start, length in zip(seq_starts[index], lengths[index])
+            ]
+        )
+    return pairs_sketch(pair_hashes(*hashes), *sequences)
+
+
+def part_sketch(path_1, path_2, sample, stage, pool, max_pending, sketch_dir):
+    # Reuse the stored sketch of an unchanged part, otherwise scan both files
+    name = os.path.basename(path_1).removesuffix("_1.fastq.gz")
+    sketch_path = os.path.join(sketch_dir, f"{name}.{stage}.npz")
+    sources = [os.stat(path) for path in (path_1, path_2)]
+    signature = [(stat.st_size, stat.st_mtime_ns) for stat in sources]
+    if os.path.exists(sketch_path):
+        sketch = load_sketch(sketch_path)
+        if [
+            (sketch.get(f"source_size_{read}"), sketch.get(f"source_mtime_ns_{read}"))
+            for read in (1, 2)
+        ] == signature:
+            return sketch
+
+    sketch = merge_sketches()
+    pending = deque()
+    for buf_1, buf_2, _ in paired_blocks(path_1, path_2):
+        pending.append(pool.submit(block_pair_sketch, buf_1, buf_2))
+        if len(pending) >= max_pending:
+            sketch = merge_sketches(sketch, pending.popleft().result())
+    while pending:
+        sketch = merge_sketches(sketch, pending.popleft().result())
+    os.makedirs(sketch_dir, exist_ok=True)
+    save_sketch(
+        sketch_path,
+        sketch,
+        sample=sample,
+        stage=stage,
+        **{
+            f"source_{field}_{read}": value
+            for read, (size, mtime_ns) in zip((1, 2), signature)
+            for field, value in [("size", size), ("mtime_ns", mtime_ns)]
+        },
+    )
+    return sketch
+
+
+def sample_sketch(sample, read_files, stage, pool, max_pending, sketch_dir):
+    # One sketch for all read pairs of a sample, merged across parts
+    return merge_sketches(
+        *(
+            part_sketch(path_1, path_2, sample, stage, pool, max_pending, sketch_dir)
+            for path_1, path_2 in zip(read_files["1"], read_files["2"])
+        )
+    )
+
+
+def overrepresented_rows(sample, stage, sketch):
+    return [
+        {
+            "sample": sample,
+            "stage": stage,
+            "rank": rank,
+            "read_1_sequence": seq_1,
+            "read_2_sequence": seq_2,
+            "n_read_pairs_approx": count,
+            "percent_read_pairs": 100 * count / sketch["n_pairs"],
+        }
+        for rank, (seq_1, seq_2, count) in enumerate(
+            overrepresented(sketch, N_OVERREPRESENTED), start=1
+        )
+    ]
+
+
+def find_fastq_files(fastq_dir, samples=None):
+    # Map sample -> read (1 or 2) -> list of part files, in part order
+    files = {}
+    for path in sorted(glob.glob(os.path.join(fastq_dir, "*.fastq.gz"))):
+        match = FASTQ_PATTERN.match(os.path.basename(path))
+        if match is None:
+            continue
+        sample = match["sample"]
+        if samples is not None and sample not in samples:
+            continue
+        part = int(match["part"] or 1)
+        files.setdefault(sample, {}).setdefault(match["read"], []).append((part, path))
+    return {
+        sample: {
+            read: [path for _, path in sorted(parts)] for read, parts in reads.items()
+        }
+        for sample, reads in files.items()
+    }
+
+
+def sample_stats(sample, read_files, stage, pool, max_pending, summary_dir):
+    # Per read direction summaries for one sample, merged across parts
+    stats = {}
+    for read, paths in sorted(read_files.items()):
+        stats[read] = merge_summaries(
+            *(
+                file_summary(path, sample, read, stage, pool, max_pending, summary_dir)
+                for path in paths
+            )
+        )
+    if stats.get("1", {}).get("n_reads") != stats.get("2", {}).get("n_reads"):
+        raise ValueError(f"Read 1 and read 2 of {sample} have different read counts")
+    return stats
+
+
+def quality_base_rows(sample, stage, stats):
+    rows = []
+    for read, read_stats in sorted(stats.items()):
+        covered = np.flatnonzero(read_stats["qual_count"])
+        mean_phred = read_stats["qual_sum"][covered] / read_stats["qual_count"][covered]
+        rows.append(
+            pd.DataFrame(
+                {
+                    "sample": sample,
+                    "stage": stage,
+                    "file": f"{sample}_{read}",
+                    "position": covered + 1,
+                    "mean_phred_score": mean_phred,
+                }
+            )
+        )
+    return rows
+
+
+def run_qc(
+    fastq_dir,
+    output_dir,
+    summary_dir,
+    samples=None,
+    stage="raw_concat",
+    workers=None,
+    sketch_dir=None,
+):
+    # sketch_dir enables the read-pair sketches
+    files = find_fastq_files(fastq_dir, samples)
+    basic_rows = []
+    quality_dfs = []
+    overrepresented_dfs = []
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for sample, read_files in files.items():
+            stats = sample_stats(
+                sample, read_files, stage, pool, 2 * workers, summary_dir
+            )
+            row = basic_stats_row(sample, stage, stats)
+            if sketch_dir is not None:
+                sketch = sample_sketch(
+                    sample, read_files, stage, pool, 2 * workers, sketch_dir
+                )
+                # Library complexity columns go next to n_read_pairs
+                items = list(row.items())
+                position = list(row).index("n_read_pairs") + 1
+                row = dict(
+                    items[:position]
+                    + list(duplication_stats(sketch).items())
+                    + items[position:]
+                )
+                overrepresented_dfs.append(
+                    pd.DataFrame(overrepresented_rows(sample, stage, sketch))
+                )
+            basic_rows.append(row)
+            quality_dfs.extend(quality_base_rows(sample, stage, stats))
+
+    os.makedirs(output_dir, exist_ok=True)
+    pd.DataFrame(basic_rows).to_csv(
+        f"{output_dir}/qc_basic_stats.tsv", sep="\t", index=False
+    )
+    pd.concat(quality_dfs, ignore_index=True).to_csv(
+        f"{output_dir}/qc_quality_base_stats.tsv", sep="\t", index=False
+    )
+    if sketch_dir is not None:
+        pd.concat(overrepresented_dfs, ignore_index=True).to_csv(
+            f"{output_dir}/qc_overrepresented.tsv", sep="\t", index=False
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QC statistics for paired FASTQ")
+    parser.add_argument("samples", nargs="*", help="samples to process (default: all)")
+    parser.add_argument("--fastq-dir", default=fastq_dir)
+    parser.add_argument("--output-dir", default=output_dir)
+    parser.add_argument("--summary-dir", default=summary_dir)
+    parser.add_argument("--stage", default="raw_concat")
+    parser.add_argument(
+        "--sketch",
+        action="store_true",
+        help="estimate read-pair duplication (reads every file a second time)",
+    )
+    parser.add_argument("--sketch-dir", default=sketch_dir)
+    parser.add_argument("-j", "--workers", type=int, help="worker processes")
+    args = parser.parse_args()
+    run_qc(
+        args.fastq_dir,
+        args.output_dir,
+        args.summary_dir,
+        samples=set(args.samples) or None,
+        stage=args.stage,
+        workers=args.workers,
+        sketch_dir=args.sketch_dir if args.sketch else None,
+    )
+
+
+if __name__ == "__main__":
+    main()
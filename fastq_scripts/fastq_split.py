@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# Split one sample's paired FASTQ into the SRA upload layout
+# ({sample}-part-N_{1,2}.fastq.gz, as named by create_sra_table.py).
+# Read 1 and read 2 are streamed together in blocks of whole records and cut
+# at the same read, so pairs stay in sync. Every output block is compressed on
+# a worker pool as an independent gzip member (the multi-member layout BGZF
+# uses), and members are appended in order, so output files are plain gzip
+# that any reader accepts. Each part's read count is printed as the part is
+# finished.
+#
+# Usage (from fastq_scripts/):
+#   ./fastq_split.py HTP-2024-04-14 R1.fastq.gz R2.fastq.gz -o ../data/fastq \
+#       --part-size 150G
+
+import argparse
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from isal import igzip as gzip
+
+    COMPRESS_LEVEL = 2  # isal levels run from 0 to 3
+except ImportError:
+    import gzip
+
+    COMPRESS_LEVEL = 6
+
+from fastq_blocks import paired_blocks, record_cut
+
+# Setting directories
+fastq_dir = "../data/fastq"
+
+SIZE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_size(size):
+    # "150G" -> bytes
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([KMGT]?)B?", size.strip().upper())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"Invalid size: {size}")
+    return int(float(match[1]) * SIZE_UNITS[match[2]])
+
+
+def part_path(output_dir, sample, part, read):
+    return os.path.join(output_dir, f"{sample}-part-{part}_{read}.fastq.gz")
+
+
+def sized_blocks(blocks, reads_per_part=None):
+    # Cut paired blocks further so no block straddles a reads_per_part boundary
+    if reads_per_part is None:
+        yield from blocks
+        return
+    room = reads_per_part
+    for block_1, block_2, n in blocks:
+        while n > room:
+            cut_1, cut_2 = record_cut(block_1, room), record_cut(block_2, room)
+            yield block_1[:cut_1], block_2[:cut_2], room
+            block_1, block_2, n = block_1[cut_1:], block_2[cut_2:], n - room
+            room = reads_per_part
+        if n:
+            yield block_1, block_2, n
+            room -= n
+        if room == 0:
+            room = reads_per_part
+
+
+def compress_block(block, level=COMPRESS_LEVEL):
+    # One complete gzip member. A fixed mtime keeps the output, and so its MD5
+    # in the upload manifest, the same from run to run.
+    return gzip.compress(block, level, mtime=0)
+
+
+class PartWriter:
+    # Writes the two files of each part, appending compressed members in order
+    # as they come back from the pool
+
+    def __init__(self, output_dir, sample, pool, max_pending):
+        self.output_dir = output_dir
+        self.sample = sample
+        self.pool = pool
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.part = 0
+        self.files = None
+        self.n_reads = 0
+        self.n_bytes = 0
+        self.counts = []
+
+    def start_part(self):
+        self.part += 1
+        self.n_reads = 0
+        self.n_bytes = 0
+        self.files = [
+            open(
+                part_path(self.output_dir, self.sample, self.part, read) + ".tmp", "wb"
+            )
+            for read in (1, 2)
+        ]
+
+    def write(self, block_1, block_2, n):
+        if self.files is None:
+            self.start_part()
+        for outf, block in zip(self.files, (block_1, block_2)):
+            self.pending.append((outf, self.pool.submit(compress_block, block)))
+        self.n_reads += n
+        self.n_bytes += len(block_1)
+        while len(self.pending) > self.max_pending:
+            self.flush_one()
+
+    def flush_one(self):
+        outf, future = self.pending.popleft()
+        outf.write(future.result())
+
+    def finish_part(self):
+        if self.files is None:
+            return
+        while self.pending:
+            self.flush_one()
+        for read, outf in zip((1, 2), self.files):
+            outf.close()
+            path = part_path(self.output_dir, self.sample, self.part, read)
+            os.replace(path + ".tmp", path)
+        self.files = None
+        self.counts.append((self.part, self.n_reads))
+        print(f"{self.sample}\t{self.part}\t{self.n_reads}", flush=True)
+
+
+def split_sample(
+    sample,
+    path_1,
+    path_2,
+    output_dir=fastq_dir,
+    reads_per_part=None,
+    part_size=None,
+    workers=None,
+):
+    # Split a read pair into parts of reads_per_part reads, or of about
+    # part_size uncompressed bytes of read 1 (cut at the first block boundary
+    # past the target). Returns [(part, n_reads)].
+    if (reads_per_part is None) == (part_size is None):
+        raise ValueError("Give exactly one of reads_per_part and part_size")
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+    blocks = sized_blocks(paired_blocks(path_1, path_2), reads_per_part)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        writer = PartWriter(output_dir, sample, pool, 4 * workers)
+        for block_1, block_2, n in blocks:
+            writer.write(block_1, block_2, n)
+            if (reads_per_part is not None and writer.n_reads >= reads_per_part) or (
+                part_size is not None and writer.n_bytes >= part_size
+            ):
+                writer.finish_part()
+        writer.finish_part()
+    return writer.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split paired FASTQ into parts")
+    parser.add_argument("sample", help="sample name used in the output filenames")
+    parser.add_argument("read_1", help="read 1 FASTQ (gzipped)")
+    parser.add_argument("read_2", help="read 2 FASTQ (gzipped)")
+    parser.add_argument("-o", "--output-dir", default=fastq_dir)
+    cut = parser.add_mutually_exclusive_group(required=True)
+    cut.add_argument("--reads-per-part", type=int)
+    cut.add_argument(
+        "--part-size",
+        type=parse_size,
+        help="uncompressed read 1 bytes per part, e.g. 150G",
+    )
+    parser.add_argument("-j", "--workers", type=int, help="compression processes")
+    args = parser.parse_args()
+    print("sample\tpart\tn_reads", flush=True)
+    try:
+        split_sample(
+            args.sample,
+            args.read_1,
+            args.read_2,
+            args.output_dir,
+            reads_per_part=args.reads_per_part,
+            part_size=args.part_size,
+            workers=args.workers,
+        )
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+
+# Fetch the released FASTQ files named in sra_table.tsv into a local cache.
+# Files are split into chunks that are downloaded concurrently with HTTP range
+# requests over keep-alive connections, at most --connections-per-host at a
+# time per host. Finished chunks are recorded next to the partial file, so an
+# interrupted or failed download resumes where it stopped instead of starting
+# over. Every completed file is checked against the size and MD5 in
+# fastq_manifest.tsv (or the MD5_checksum columns of sra_table.tsv) before it
+# enters the cache.
+#
+# The cache holds at most --cache-size bytes. Files already in it are never
+# downloaded again; when room is needed the least recently used files are
+# evicted. File URLs come from --url-template, which can use base_url,
+# filename and any sra_table.tsv column (e.g. {sample_name}, or {accession}
+# once run accessions are added), so any HTTP server holding the files works.
+#
+# Usage (from fastq_scripts/):
+#   ./sra_fetch.py --base-url https://example.org/PRJNA1198001 \
+#       --since 2024-01-01 --cache-size 2T -j 16 [sample ...]
+
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlsplit
+
+import pandas as pd
+
+from fastq_manifest import FILENAME_COLUMNS, MD5_COLUMNS
+from fastq_split import parse_size
+
+# Setting directories
+table_dir = "../tables"
+cache_dir = "../data/sra_cache"
+
+CHUNK_SIZE = 64 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+MAX_RETRIES = 5
+MAX_REDIRECTS = 5
+LRU_FILE = ".lru.json"
+
+
+class RetryableError(IOError):
+    # Failures worth another attempt: dropped connections, short reads, 5xx
+    pass
+
+
+class HostPool:
+    # Keep-alive connections, reused across requests to the same host, with at
+    # most max_connections in use per host at a time
+
+    def __init__(self, max_connections, timeout=60):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.slots = {}
+
+    @contextmanager
+    def connection(self, scheme, netloc):
+        key = (scheme, netloc)
+        with self.lock:
+            slots = self.slots.setdefault(
+                key, threading.BoundedSemaphore(self.max_connections)
+            )
+        with slots:
+            with self.lock:
+                idle = self.idle.setdefault(key, [])
+                conn = idle.pop() if idle else None
+            if conn is None:
+                if scheme == "https":
+                    conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+                else:
+                    conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            try:
+                yield conn
+            except BaseException:
+                # The response may be half read; never reuse the connection
+                conn.close()
+                raise
+            with self.lock:
+                idle.append(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # No requests are in flight by now; close the idle connections
+        with self.lock:
+            for idle in self.idle.values():
+                for conn in idle:
+                    conn.close()
+            self.idle = {}
+
+    def request(self, method, url, handle, headers=None):
+        # Send a request, following redirects, and return handle(response).
+        # handle runs while the connection is held and must read the body.
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            target = parts.path or "/"
+            if parts.query:
+                target += f"?{parts.query}"
+            with self.connection(parts.scheme, parts.netloc) as conn:
+                try:
+                    conn.request(method, target, headers=headers or {})
+                    response = conn.getresponse()
+                except (OSError, http.client.HTTPException) as e:
+                    raise RetryableError(f"{url}: {e!r}") from e
+                if response.status in (301, 302, 303, 307, 308):
+                    response.read()
+                    url = urljoin(url, response.getheader("Location"))
+                    continue
+                if response.status == 429 or response.status >= 500:
+                    response.read()
+                    raise RetryableError(f"{url}: HTTP {response.status}")
+                if response.status >= 400:
+                    response.read()
+                    raise ValueError(f"{url}: HTTP {response.status}")
+                try:
+                    return handle(response)
+                except RetryableError:
+                    raise
+                except (OSError, http.client.HTTPException) as e:
+                    raise RetryableError(f"{url}: {e!r}") from e
+        raise ValueError(f"{url}: more than {MAX_REDIRECTS} redirects")
+
+
+def with_retries(function, *args):
+    # Call function, retrying RetryableError with exponential backoff
+    for attempt in range(MAX_RETRIES):
+        try:
+            return function(*args)
+        except RetryableError:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(2**attempt)
+
+
+def remote_info(pool, url):
+    # Size, whether byte ranges are served, and a validator that changes when
+    # the remote file does
+    def handle(response):
+        response.read()
+        size = response.getheader("Content-Length")
+        if size is None:
+            raise ValueError(f"{url}: no Content-Length")
+        return {
+            "size": int(size),
+            "ranges": response.getheader("Accept-Ranges", "").lower() == "bytes",
+            "validator": response.getheader("ETag")
+            or response.getheader("Last-Modified")
+            or "",
+        }
+
+    return with_retries(pool.request, "HEAD", url, handle)
+
+
+class LRUCache:
+    # Files in cache_dir, with their sizes and when each was last used, kept
+    # in cache_dir/.lru.json. Only the main thread touches the index.
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, LRU_FILE)
+        os.makedirs(cache_dir, exist_ok=True)
+        index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as inf:
+                index = json.load(inf)
+        # Forget files deleted behind the cache's back
+        self.index = {
+            filename: entry
+            for filename, entry in index.items()
+            if os.path.exists(self.path(filename))
+        }
+
+    def path(self, filename):
+        return os.path.join(self.cache_dir, filename)
+
+    def __contains__(self, filename):
+        return filename in self.index
+
+    def used_bytes(self):
+        return sum(entry["size"] for entry in self.index.values())
+
+    def touch(self, filename):
+        self.index[filename]["last_used"] = time.time()
+
+    def add(self, filename, size):
+        self.index[filename] = {"size": size, "last_used": time.time()}
+
+    def reserve(self, n_bytes, keep):
+        # Evict least recently used files, other than those in keep, until
+        # n_bytes more fit under the cap. n_bytes counts only files still to
+        # be fetched; files in keep that are already cached need no room.
+        if n_bytes <= 0:
+            return
+        kept = sum(
+            entry["size"] for filename, entry in self.index.items() if filename in keep
+        )
+        if kept + n_bytes > self.max_bytes:
+            raise ValueError(
+                f"Cache of {self.max_bytes:,} bytes cannot hold the "
+                f"{kept + n_bytes:,} bytes requested"
+            )
+        evictable = sorted(
+            (entry["last_used"], filename)
+            for filename, entry in self.index.items()
+            if filename not in keep
+        )
+        used = self.used_bytes()
+        for _, filename in evictable:
+            if used + n_bytes <= self.max_bytes:
+                break
+            used -= self.index.pop(filename)["size"]
+            os.remove(self.path(filename))
+            print(f"{filename}\tevicted", flush=True)
+        self.save()
+
+    def save(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as outf:
+            json.dump(self.index, outf, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+
+class Download:
+    # One file being fetched into path + ".part", with the finished chunks
+    # listed in path + ".part.json" so a later run can resume it
+
+    def __init__(self, path, url, info, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.url = url
+        self.size = info["size"]
+        if not info["ranges"]:
+            # The whole file in one request; nothing to resume from
+            chunk_size = max(self.size, 1)
+        self.state = {
+            "url": url,
+            "size": self.size,
+            "validator": info["validator"],
+            "chunk_size": chunk_size,
+            "done": [],
+        }
+        self.lock = threading.Lock()
+        self.resumed = self.load_state()
+        if not self.resumed:
+            with open(self.part_path, "wb") as outf:
+                outf.truncate(self.size)
+        self.fd = os.open(self.part_path, os.O_WRONLY)
+
+    @property
+    def part_path(self):
+        return f"{self.path}.part"
+
+    @property
+    def state_path(self):
+        return f"{self.path}.part.json"
+
+    def load_state(self):
+        # Keep earlier progress only if it is for the same remote file
+        if not (os.path.exists(self.part_path) and os.path.exists(self.state_path)):
+            return False
+        with open(self.state_path) as inf:
+            state = json.load(inf)
+        same_file = all(
+            state.get(key) == self.state[key]
+            for key in ["url", "size", "validator", "chunk_size"]
+        )
+        if not same_file or not self.state["validator"]:
+            return False
+        self.state["done"] = state["done"]
+        return bool(self.state["done"])
+
+    def save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as outf:
+            json.dump(self.state, outf)
+        os.replace(tmp_path, self.state_path)
+
+    def chunks(self):
+        # (index, first byte, last byte) of every chunk still to fetch
+        chunk_size = self.state["chunk_size"]
+        done = set(self.state["done"])
+        return [
+            (i, start, min(start + chunk_size, self.size) - 1)
+            for i, start in enumerate(range(0, self.size, chunk_size))
+            if i not in done
+        ]
+
+    def fetch_chunk(self, pool, index, start, end):
+        whole_file = start == 0 and end == self.size - 1
+
+        def handle(response):
+            if response.status != 206 and not (response.status == 200 and whole_file):
+                response.read()
+                raise ValueError(f"{self.url}: HTTP {response.status} to a range")
+            offset = start
+            while True:
+                data = response.read(min(READ_SIZE, end + 1 - offset))
+                if not data:
+                    break
+                os.pwrite(self.fd, data, offset)
+                offset += len(data)
+            if offset != end + 1:
+                raise RetryableError(f"{self.url}: short read at byte {offset:,}")
+
+        headers = {} if whole_file else {"Range": f"bytes={start}-{end}"}
+        with_retries(pool.request, "GET", self.url, handle, headers)
+        with self.lock:
+            self.state["done"].append(index)
+            self.save_state()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def finish(self, expected_size, expected_md5):
+        # Verify the complete file and move it into place
+        self.close()
+        error = None
+        if not pd.isna(expected_size) and self.size != expected_size:
+            error = f"{self.size:,} bytes, manifest has {expected_size:,}"
+        else:
+            md5 = hashlib.md5()
+            with open(self.part_path, "rb") as inf:
+                for block in iter(lambda: inf.read(8 * READ_SIZE), b""):
+                    md5.update(block)
+            if md5.hexdigest() != expected_md5:
+                error = f"MD5 {md5.hexdigest()}, manifest has {expected_md5}"
+        if error:
+            # Corrupt data is not worth resuming
+            for path in [self.part_path, self.state_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise ValueError(error)
+        os.replace(self.part_path, self.path)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+
+def requested_files(table_dir, samples=None, since=None, until=None):
+    # One row per FASTQ file to fetch: filename, its sra_table.tsv row, and
+    # the size and MD5 it must have
+    sra_table = pd.read_csv(
+        os.path.join(table_dir, "sra_table.tsv"),
+        sep="\t",
+        dtype=str,
+        keep_default_na=False,
+    )
+    if since or until:
+        biosamples = pd.read_csv(
+            os.path.join(table_dir, "bio_sample_table.tsv"), sep="\t", dtype=str
+        )
+        dates = dict(zip(biosamples["Sample Name"], biosamples["collection date"]))
+        collected = sra_table["sample_name"].map(dates).fillna("")
+        keep = collected != ""
+        if since:
+            keep &= collected >= since
+        if until:
+            keep &= collected <= until
+        sra_table = sra_table[keep]
+    if samples:
+        unknown = set(samples) - set(sra_table["sample_name"])
+        if unknown:
+            raise ValueError(f"Samples not in sra_table.tsv: {', '.join(unknown)}")
+        sra_table = sra_table[sra_table["sample_name"].isin(samples)]
+
+    rows = []
+    for row in sra_table.to_dict("records"):
+        for filename_column, md5_column in zip(FILENAME_COLUMNS, MD5_COLUMNS):
+            rows.append(
+                {
+                    "filename": row[filename_column],
+                    "row": row,
+                    "md5": row.get(md5_column) or None,
+                    "size": None,
+                }
+            )
+    files = pd.DataFrame(rows, columns=["filename", "row", "md5", "size"])
+    manifest_path = os.path.join(table_dir, "fastq_manifest.tsv")
+    if os.path.exists(manifest_path):
+        manifest = pd.read_csv(manifest_path, sep="\t", dtype={"md5": str})
+        files["md5"] = (
+            files["filename"]
+            .map(dict(zip(manifest["filename"], manifest["md5"])))
+            .fillna(files["md5"])
+        )
+        files["size"] = files["filename"].map(
+            dict(zip(manifest["filename"], manifest["size"]))
+        )
+    return files
+
+
+def fetch(
+    base_url,
+    url_template="{base_url}/{filename}",
+    samples=None,
+    since=None,
+    until=None,
+    table_dir=table_dir,
+    cache_dir=cache_dir,
+    cache_size=None,
+    jobs=16,
+    connections_per_host=8,
+    chunk_size=CHUNK_SIZE,
+):
+    files = requested_files(table_dir, samples, since, until)
+    errors = [
+        f"{filename}: no checksum in fastq_manifest.tsv or sra_table.tsv"
+        for filename in files.loc[files["md5"].isna(), "filename"]
+    ]
+    if errors:
+        raise ValueError("SRA fetch failed:\n" + "\n".join(errors))
+
+    cache = LRUCache(cache_dir, cache_size if cache_size else float("inf"))
+    wanted = set(files["filename"])
+    for filename in files["filename"]:
+        if filename in cache:
+            cache.touch(filename)
+            print(f"{filename}\tcached", flush=True)
+    missing = files[~files["filename"].isin(cache.index)]
+
+    urls = {
+        file.filename: url_template.format(
+            **{**file.row, "base_url": base_url.rstrip("/"), "filename": file.filename}
+        )
+        for file in missing.itertuples(index=False)
+    }
+    with HostPool(connections_per_host) as pool, ThreadPoolExecutor(
+        max_workers=jobs
+    ) as executor:
+        infos = dict(
+            zip(
+                urls,
+                executor.map(lambda filename: remote_info(pool, urls[filename]), urls),
+            )
+        )
+        for file in missing.itertuples(index=False):
+            if not pd.isna(file.size) and infos[file.filename]["size"] != file.size:
+                errors.append(
+                    f"{file.filename}: server has {infos[file.filename]['size']:,} "
+                    f"bytes, manifest has {int(file.size):,}"
+                )
+        if errors:
+            raise ValueError("SRA fetch failed:\n" + "\n".join(errors))
+        # infos holds only the files missing from the cache
+        cache.reserve(sum(info["size"] for info in infos.values()), keep=wanted)
+
+        expected = {file.filename: file for file in missing.itertuples(index=False)}
+        # future -> (filename, "chunk" or "finish")
+        running = {}
+        downloads = {}
+        remaining = {}
+        for file in missing.itertuples(index=False):
+            download = Download(
+                cache.path(file.filename),
+                urls[file.filename],
+                infos[file.filename],
+                chunk_size,
+            )
+            downloads[file.filename] = download
+            chunks = download.chunks()
+            remaining[file.filename] = len(chunks)
+            for chunk in chunks:
+                future = executor.submit(download.fetch_chunk, pool, *chunk)
+                running[future] = (file.filename, "chunk")
+
+        def finish(file):
+            # Chunks all fetched: verify, then the file joins the cache
+            running[
+                executor.submit(downloads[file.filename].finish, file.size, file.md5)
+            ] = (file.filename, "finish")
+
+        # Files whose chunks were all fetched by an earlier run
+        for file in missing.itertuples(index=False):
+            if remaining[file.filename] == 0:
+                finish(file)
+        failed = set()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename, step = running.pop(future)
+                try:
+                    future.result()
+                except (ValueError, OSError, http.client.HTTPException) as e:
+                    if filename not in failed:
+                        failed.add(filename)
+                        errors.append(f"{filename}: {e}")
+                    continue
+                if step == "finish":
+                    cache.add(filename, downloads[filename].size)
+                    cache.save()
+                    status = "resumed" if downloads[filename].resumed else "fetched"
+                    print(f"{filename}\t{status}", flush=True)
+                    continue
+                remaining[filename] -= 1
+                if remaining[filename] == 0 and filename not in failed:
+                    finish(expected[filename])
+        # Partial files and their state stay for the next run
+        for download in downloads.values():
+            download.close()
+    cache.save()
+    if errors:
+        raise ValueError("SRA fetch failed:\n" + "\n".join(errors))
+    return [cache.path(filename) for filename in files["filename"]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch released FASTQ files")
+    parser.add_argument("samples", nargs="*", help="samples to fetch (default: all)")
+    parser.add_argument("--base-url", required=True)
+    parser.add_argument(
+        "--url-template",
+        default="{base_url}/{filename}",
+        help="file URL; may use base_url, filename and sra_table.tsv columns",
+    )
+    parser.add_argument("--since", help="first BioSample collection date")
+    parser.add_argument("--until", help="last BioSample collection date")
+    parser.add_argument("--table-dir", default=table_dir)
+    parser.add_argument("--cache-dir", default=cache_dir)
+    parser.add_argument("--cache-size", type=parse_size, help="e.g. 2T")
+    parser.add_argument("-j", "--jobs", type=int, default=16, help="threads")
+    parser.add_argument("--connections-per-host", type=int, default=8)
+    parser.add_argument("--chunk-size", type=parse_size, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    try:
+        fetch(
+            args.base_url,
+            args.url_template,
+            samples=set(args.samples) or None,
+            since=args.since,
+            until=args.until,
+            table_dir=args.table_dir,
+            cache_dir=args.cache_dir,
+            cache_size=args.cache_size,
+            jobs=args.jobs,
+            connections_per_host=args.connections_per_host,
+            chunk_size=args.chunk_size,
+        )
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# Tests for sra_fetch.py against a local http.server that serves byte ranges
+# and can refuse chosen ranges, so downloads can be interrupted on purpose.
+#
+# Usage (from fastq_scripts/):
+#   python -m unittest test_sra_fetch
+
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+import sra_fetch
+from fastq_manifest import FILENAME_COLUMNS, MD5_COLUMNS
+
+CHUNK_SIZE = 1000
+FILE_SIZE = 4500
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # Serves server.files ({url path: bytes}), answering 403 once to each
+    # (path, first byte) in server.refuse, and records every GET in
+    # server.gets as (path, first byte)
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{hashlib.md5(data).hexdigest()}"')
+        self.end_headers()
+
+    def do_GET(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_body(404, b"")
+            return
+        byte_range = self.headers.get("Range")
+        if byte_range is None:
+            self.server.gets.append((self.path, 0))
+            self.send_body(200, data)
+            return
+        start, end = map(int, byte_range[len("bytes=") :].split("-"))
+        self.server.gets.append((self.path, start))
+        if (self.path, start) in self.server.refuse:
+            self.server.refuse.discard((self.path, start))
+            self.send_body(403, b"")
+            return
+        self.send_body(
+            206,
+            data[start : end + 1],
+            [("Content-Range", f"bytes {start}-{end}/{len(data)}")],
+        )
+
+
+def fastq_files(sample):
+    # The four file names sra_table.tsv lists for sample, with their contents
+    return {
+        f"{sample}-part-{part}_{read}.fastq.gz": os.urandom(FILE_SIZE)
+        for part in (1, 2)
+        for read in (1, 2)
+    }
+
+
+class SraFetchTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+        self.server.files = {}
+        self.server.refuse = set()
+        self.server.gets = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/files"
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.table_dir = os.path.join(tmp_dir.name, "tables")
+        self.cache_dir = os.path.join(tmp_dir.name, "cache")
+        os.makedirs(self.table_dir)
+
+        self.contents = {}
+        rows = []
+        for sample in ["HTP-2024-01-07", "HTP-2024-01-14"]:
+            files = fastq_files(sample)
+            self.contents.update(files)
+            row = {"sample_name": sample}
+            for filename_column, md5_column, (filename, data) in zip(
+                FILENAME_COLUMNS, MD5_COLUMNS, files.items()
+            ):
+                row[filename_column] = filename
+                row[md5_column] = hashlib.md5(data).hexdigest()
+            rows.append(row)
+        self.sra_table = pd.DataFrame(rows)
+        self.write_sra_table()
+        self.server.files = {
+            f"/files/{filename}": data for filename, data in self.contents.items()
+        }
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def write_sra_table(self):
+        self.sra_table.to_csv(
+            os.path.join(self.table_dir, "sra_table.tsv"), sep="\t", index=False
+        )
+
+    def fetch(self, samples, cache_size=None):
+        # Run a fetch and return what it printed
+        output = io.StringIO()
+        with redirect_stdout(output):
+            sra_fetch.fetch(
+                self.base_url,
+                samples=samples,
+                table_dir=self.table_dir,
+                cache_dir=self.cache_dir,
+                cache_size=cache_size,
+                jobs=4,
+                connections_per_host=2,
+                chunk_size=CHUNK_SIZE,
+            )
+        return output.getvalue()
+
+    def cached(self, filename):
+        path = os.path.join(self.cache_dir, filename)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as inf:
+            return inf.read()
+
+    def test_resumes_interrupted_download(self):
+        filename = "HTP-2024-01-07-part-1_1.fastq.gz"
+        self.server.refuse.add((f"/files/{filename}", 2 * CHUNK_SIZE))
+        with self.assertRaisesRegex(ValueError, "HTTP 403"):
+            self.fetch(["HTP-2024-01-07"])
+        self.assertIsNone(self.cached(filename))
+        self.assertTrue(
+            os.path.exists(os.path.join(self.cache_dir, filename + ".part.json"))
+        )
+
+        self.server.gets.clear()
+        output = self.fetch(["HTP-2024-01-07"])
+        # Only the refused chunk is requested again
+        self.assertEqual(self.server.gets, [(f"/files/{filename}", 2 * CHUNK_SIZE)])
+        self.assertIn(f"{filename}\tresumed", output)
+        self.assertEqual(self.cached(filename), self.contents[filename])
+        self.assertFalse(
+            os.path.exists(os.path.join(self.cache_dir, filename + ".part"))
+        )
+
+    def test_rejects_md5_mismatch(self):
+        filename = "HTP-2024-01-07-part-2_1.fastq.gz"
+        self.sra_table.loc[0, "MD5_checksum3"] = "0" * 32
+        self.write_sra_table()
+        with self.assertRaisesRegex(ValueError, f"{filename}: MD5"):
+            self.fetch(["HTP-2024-01-07"])
+        self.assertIsNone(self.cached(filename))
+        # Corrupt data is dropped rather than kept for resuming
+        self.assertFalse(
+            os.path.exists(os.path.join(self.cache_dir, filename + ".part"))
+        )
+        self.assertEqual(
+            self.cached("HTP-2024-01-07-part-1_1.fastq.gz"),
+            self.contents["HTP-2024-01-07-part-1_1.fastq.gz"],
+        )
+
+    def test_evicts_least_recently_used(self):
+        one_sample = 4 * FILE_SIZE
+        self.fetch(["HTP-2024-01-07"], cache_size=one_sample)
+        output = self.fetch(["HTP-2024-01-14"], cache_size=one_sample)
+        for filename in fastq_files("HTP-2024-01-07"):
+            self.assertIn(f"{filename}\tevicted", output)
+            self.assertIsNone(self.cached(filename))
+        for filename in fastq_files("HTP-2024-01-14"):
+            self.assertEqual(self.cached(filename), self.contents[filename])
+
+    def test_cached_files_need_no_room(self):
+        self.fetch(["HTP-2024-01-07"])
+        self.server.gets.clear()
+        # A cap below the cached files' size only matters for new downloads
+        output = self.fetch(["HTP-2024-01-07"], cache_size=FILE_SIZE)
+        self.assertEqual(self.server.gets, [])
+        self.assertEqual(output.count("\tcached"), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,24 +1,23 @@
 #!/usr/bin/env python3
 
 # Imports
-import pandas as pd
-import numpy as np
-from datetime import datetime
+import os
+import sys
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "../table_scripts")
+)
+from qc_basic_stats import load_qc_basic_stats
+from stage_trace import stage
 
 # Setting directories and S3 buckets
 workflow_results_dir = "../data/results"
 delivery_metadata_dir = "../data"
 table_dir = "../tables"
 
-basic_stats = pd.read_csv(f"{workflow_results_dir}/qc_basic_stats.tsv", sep="\t")
-basic_stats["date"] = pd.to_datetime(
-    basic_stats["sample"].str.split("-").str[1:4].str.join("-")
-)
-basic_stats["sequencing_machine"] = np.where(
-    basic_stats["date"] >= datetime(2024, 2, 25),
-    "NovaSeq X",
-    "NovaSeq 6000",
-)
+with stage("load") as s:
+    basic_stats = load_qc_basic_stats(workflow_results_dir)
+    s.rows = len(basic_stats)
 
 basic_stats = basic_stats[basic_stats["stage"] == "raw_concat"]
 
@@ -1,84 +1,177 @@
 #! /usr/bin/env python3
 #!/usr/bin/env python3
 
+import argparse
 import pandas as pd
 import os
-import subprocess
+import sys
 import numpy as np
-from scipy.stats import gmean
 from collections import defaultdict
 
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "../table_scripts")
+)
+from kraken_reports import (
+    DOMAIN_TAX_IDS,
+    domain_relative_abundance,
+    kraken_report_path,
+    read_clade_counts,
+)
+from input_checks import check, clade_count_violations, sample_name_violations
+from qc_basic_stats import sample_dates, sequencing_machine
+from stage_trace import stage
+
 # Setting directories and S3 buckets
 workflow_results_dir = "../data/results"
 table_dir = "../tables"
 os.makedirs(workflow_results_dir, exist_ok=True)
 
+# Resampled draws held in memory at once; bounds each bootstrap batch
+BATCH_ELEMENTS = 2**22
 
-def generate_table():
-    data = []
 
-    tax_ids = {
-        "Bacteria": 2,
-        "Viruses": 10239,
-        "Archaea": 2157,
-        "Eukaryota": 2759,
-        "Unclassified": 0,
-        "Classified": 1,
+def sample_groups(samples):
+    # Group label of every sample under each grouping the CIs are computed for
+    dates = sample_dates(samples)
+    return {
+        "all": pd.Series("All samples", index=samples.index),
+        "sequencing_machine": pd.Series(sequencing_machine(dates), index=samples.index),
+        "quarter": pd.Series(dates.dt.to_period("Q").astype(str), index=samples.index),
     }
 
-    kraken_path = os.path.join(
-        workflow_results_dir,
-        "kraken_reports_merged.tsv",
-    )
-    zip_kraken_path = kraken_path + ".gz"
-    if os.path.exists(zip_kraken_path):
-        subprocess.run(
-            ["gunzip", "-c", zip_kraken_path],
-            stdout=open(kraken_path, "w"),
-            check=True,
-        )
 
-    kraken_df = pd.read_csv(kraken_path, sep="\t")
-    for sample in kraken_df["sample"].unique():
-        sample_data = kraken_df[kraken_df["sample"] == sample]
-        sample_data = sample_data.groupby("taxid").agg({"n_reads_clade": "sum"})
-        sample_data = sample_data.reset_index()
-        # Get read counts for all taxonomic groups in one step
-        reads_by_group = {
-            group: sample_data[sample_data["taxid"] == tax_id]["n_reads_clade"].values[
-                0
-            ]
-            for group, tax_id in tax_ids.items()
-        }
+def middle_ranks(counts, order, below, low, high, middle):
+    # Sorted positions of the middle order statistics of each resample, given
+    # how often each sample was drawn (counts) and how many draws fall below
+    # sorted position low (below). The median of a resample almost always lies
+    # between low and high, so draws are only accumulated across that window;
+    # the rare resamples outside it are accumulated in full.
+    cumulative = below[:, None] + np.cumsum(counts[:, order[low:high]], axis=1)
+    ranks = [low + (cumulative <= k).sum(axis=1) for k in middle]
+    outside = (below > middle[0]) | (cumulative[:, -1] <= middle[1])
+    if outside.any():
+        cumulative = np.cumsum(counts[outside][:, order], axis=1)
+        for rank, k in zip(ranks, middle):
+            rank[outside] = (cumulative <= k).sum(axis=1)
+    return ranks
+
+
+def bootstrap_statistics(values, n_resamples, rng):
+    # Bootstrap distributions of the median and geometric mean of each column
+    # of values (samples x domains). Every batch draws one index matrix of
+    # resamples x samples, shared by all domains, and reduces it to how often
+    # each sample was drawn: the geometric mean is then a matrix product, and
+    # the median is read from the pre-sorted values (see middle_ranks).
+    values = np.asarray(values, dtype=np.float64)
+    n_samples, n_domains = values.shape
+    order = np.argsort(values, axis=0, kind="stable")
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    # The two middle order statistics (the same one for odd n_samples), and a
+    # window of sorted positions around them
+    middle = [(n_samples - 1) // 2, n_samples // 2]
+    window = int(4 * np.sqrt(n_samples)) + 16
+    low = max(0, middle[0] - window)
+    high = min(n_samples, middle[1] + window + 1)
+    below_low = np.zeros((n_samples, n_domains))
+    np.put_along_axis(below_low, order[:low], 1.0, axis=0)
+    zeros = (values == 0).astype(np.float64)
+    with np.errstate(divide="ignore"):
+        logs = np.where(values > 0, np.log(values), 0.0)
+
+    batch_size = max(1, BATCH_ELEMENTS // n_samples)
+    medians = []
+    gmeans = []
+    for start in range(0, n_resamples, batch_size):
+        size = min(batch_size, n_resamples - start)
+        index = rng.integers(0, n_samples, size=(size, n_samples), dtype=np.int32)
+        index += n_samples * np.arange(size, dtype=np.int32)[:, None]
+        counts = np.bincount(index.ravel(), minlength=size * n_samples)
+        counts = counts.reshape(size, n_samples).astype(np.int32)
+        weights = counts.astype(np.float64)
+
+        # A resample containing a zero has a geometric mean of zero
+        gmean_batch = np.exp(weights @ logs / n_samples)
+        gmean_batch[weights @ zeros > 0] = 0.0
+        gmeans.append(gmean_batch)
+
+        below = (weights @ below_low).astype(np.int64)
+        median_batch = np.empty((size, n_domains))
+        for domain in range(n_domains):
+            ranks = middle_ranks(
+                counts, order[:, domain], below[:, domain], low, high, middle
+            )
+            median_batch[:, domain] = (
+                sorted_values[ranks[0], domain] + sorted_values[ranks[1], domain]
+            ) / 2
+        medians.append(median_batch)
+    return {
+        "median": np.concatenate(medians),
+        "geometric_mean": np.concatenate(gmeans),
+    }
 
-        n_reads_bacteria = reads_by_group["Bacteria"]
-        n_reads_virus = reads_by_group["Viruses"]
-        n_reads_archea = reads_by_group["Archaea"]
-        n_reads_eukaryota = reads_by_group["Eukaryota"]
-        n_reads_unclassified = reads_by_group["Unclassified"]
-        n_reads_classified = reads_by_group["Classified"]
-        total_reads = n_reads_unclassified + n_reads_classified
-
-        bacteria_ra = n_reads_bacteria / total_reads
-        virus_ra = n_reads_virus / total_reads
-        archea_ra = n_reads_archea / total_reads
-        eukaryota_ra = n_reads_eukaryota / total_reads
-        unclassified_ra = n_reads_unclassified / total_reads
-
-        data.append(
-            [sample, bacteria_ra, virus_ra, archea_ra, eukaryota_ra, unclassified_ra]
+
+def bootstrap_table(df, n_resamples=10_000, confidence=0.95, seed=0):
+    # Percentile bootstrap intervals per grouping, group, domain and statistic
+    from scipy.stats import gmean  # Slow to import; only needed here
+
+    rng = np.random.default_rng(seed)
+    domains = list(df.columns[1:])
+    quantiles = [(1 - confidence) / 2, (1 + confidence) / 2]
+    rows = []
+    for grouping, labels in sample_groups(df["sample"]).items():
+        for group, group_df in df.groupby(labels.values, sort=True):
+            values = group_df[domains].to_numpy()
+            with np.errstate(divide="ignore"):
+                estimates = {
+                    "median": np.median(values, axis=0),
+                    "geometric_mean": gmean(values, axis=0),
+                }
+            resampled = bootstrap_statistics(values, n_resamples, rng)
+            for statistic, distribution in resampled.items():
+                low, high = np.quantile(distribution, quantiles, axis=0)
+                for i, domain in enumerate(domains):
+                    rows.append(
+                        {
+                            "grouping": grouping,
+                            "group": group,
+                            "n_samples": len(group_df),
+                            "domain": domain,
+                            "statistic": statistic,
+                            "estimate": estimates[statistic][i],
+                            "ci_low": low[i],
+                            "ci_high": high[i],
+                        }
+                    )
+    return pd.DataFrame(rows)
+
+
+def generate_table(bootstrap=False, n_resamples=10_000, confidence=0.95, seed=0):
+    with stage("load") as s:
+        kraken_path = kraken_report_path(workflow_results_dir)
+        clade_counts = read_clade_counts(
+            kraken_path, tax_ids=list(DOMAIN_TAX_IDS.values()), report=True
         )
+        s.rows = len(clade_counts)
+    with stage("validate") as s:
+        violations = clade_count_violations(clade_counts)
+        if bootstrap:
+            # The bootstrap groups samples by the date in their names
+            violations += sample_name_violations(clade_counts["sample"].cat.categories)
+        check(kraken_path, violations)
+        s.rows = len(clade_counts)
+    with stage("compute") as s:
+        domain_ra = domain_relative_abundance(clade_counts)
+        s.rows = len(domain_ra)
 
     df = pd.DataFrame(
-        data,
-        columns=[
-            "sample",
-            "bacteria_ra",
-            "virus_ra",
-            "archea_ra",
-            "eukaryota_ra",
-            "unclassified_ra",
-        ],
+        {
+            "sample": domain_ra.index,
+            "bacteria_ra": domain_ra["Bacteria"].values,
+            "virus_ra": domain_ra["Viruses"].values,
+            "archea_ra": domain_ra["Archaea"].values,
+            "eukaryota_ra": domain_ra["Eukaryota"].values,
+            "unclassified_ra": domain_ra["Unclassified"].values,
+        }
     )
     # Calculate statistics for each group
     columns = df.columns[1:]
@@ -89,12 +182,35 @@ def generate_table():
         max_val = df[group].max()
         print(f"{group}: {median:.2%} ({min_val:.2%}, {max_val:.2%})")
 
+    if bootstrap:
+        with stage("bootstrap") as s:
+            ci_table = bootstrap_table(df, n_resamples, confidence, seed)
+            s.rows = len(ci_table)
+        with stage("write"):
+            os.makedirs(table_dir, exist_ok=True)
+            ci_table.to_csv(
+                os.path.join(table_dir, "domain_ra_bootstrap.tsv"),
+                sep="\t",
+                index=False,
+                float_format="%.6g",
+            )
+
     return df
 
 
 def start():
+    parser = argparse.ArgumentParser(description="Domain relative abundances")
+    parser.add_argument(
+        "--bootstrap",
+        action="store_true",
+        help="write bootstrap CIs to ../tables/domain_ra_bootstrap.tsv",
+    )
+    parser.add_argument("--n-resamples", type=int, default=10_000)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
 
-    generate_table()
+    generate_table(args.bootstrap, args.n_resamples, args.confidence, args.seed)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+
+# Build every table in tables/ from one process. Each output is a target with
+# declared inputs; targets whose input hashes and code are unchanged since the
+# last build are skipped, and independent targets run in parallel.
+#
+# With --watch the process stays up, polls the targets' inputs and code, and
+# rebuilds only the targets a change affects. Loaded results stay resident
+# between builds (qc_basic_stats is re-read only when its file changes), and
+# an edited script is re-imported before the next build.
+#
+# Usage (from table_scripts/):
+#   ./build_tables.py                  # build all default targets
+#   ./build_tables.py table_s2 --force # rebuild one target unconditionally
+#   ./build_tables.py --watch          # rebuild on change until interrupted
+
+import argparse
+import ast
+import fnmatch
+import glob
+import hashlib
+import importlib
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from stage_trace import traced_as
+
+# Setting directories
+results_dir = "../data/results"
+table_dir = "../tables"
+state_path = f"{table_dir}/.build_state.json"
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Bump to force a rebuild of every target
+BUILD_VERSION = 1
+
+# inputs are paths or glob patterns; module holds `function`. The target's
+# code version covers module and every local module it imports, found by
+# local_modules().
+Target = namedtuple(
+    "Target", ["name", "output", "inputs", "module", "function", "default"]
+)
+
+TARGETS = [
+    Target(
+        "table_1",
+        f"{table_dir}/table_1.tsv",
+        [f"{results_dir}/qc_basic_stats.tsv"],
+        "table_1",
+        "generate_table",
+        True,
+    ),
+    Target(
+        "table_s1",
+        f"{table_dir}/table_s1.tsv",
+        [f"{results_dir}/qc_basic_stats.tsv"],
+        "table_s1",
+        "start",
+        True,
+    ),
+    Target(
+        "table_s2",
+        f"{table_dir}/table_s2.tsv",
+        [f"{results_dir}/kraken_reports_merged.tsv*"],
+        "table_s2",
+        "generate_table",
+        True,
+    ),
+    Target(
+        "sra_table",
+        f"{table_dir}/sra_table.tsv",
+        [f"{results_dir}/qc_basic_stats.tsv"],
+        "create_sra_table",
+        "create_sra_table",
+        True,
+    ),
+    Target(
+        "bio_sample_table",
+        f"{table_dir}/bio_sample_table.tsv",
+        [f"{results_dir}/qc_basic_stats.tsv"],
+        "create_biosample_table",
+        "create_biosample_table",
+        True,
+    ),
+    # Per-delivery variant of Table 1 built from raw mgs-workflow output. It
+    # writes the same file as table_1, so it only runs when asked for by name.
+    Target(
+        "new_table_1",
+        f"{table_dir}/table_1.tsv",
+        [
+            "../workflow_results/*/output/results/qc/qc_basic_stats.tsv.gz",
+            "../delivery_metadata/*",
+        ],
+        "new_table_1",
+        "generate_summary_table",
+        False,
+    ),
+]
+
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as inf:
+        for block in iter(lambda: inf.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def input_hashes(target, hash_cache):
+    # Content hashes of every input file. hash_cache maps path -> (size,
+    # mtime_ns, digest) so unchanged files are not re-read.
+    hashes = {}
+    for pattern in target.inputs:
+        paths = sorted(glob.glob(pattern))
+        if not paths and not glob.has_magic(pattern):
+            raise FileNotFoundError(f"Input not found for {target.name}: {pattern}")
+        for path in paths:
+            stat = os.stat(path)
+            cached = hash_cache.get(path)
+            if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+                digest = cached[2]
+            else:
+                digest = file_digest(path)
+                hash_cache[path] = [stat.st_size, stat.st_mtime_ns, digest]
+            hashes[path] = digest
+    return hashes
+
+
+def module_path(module):
+    return os.path.join(script_dir, f"{module}.py")
+
+
+def imported_names(path):
+    # Top-level names of every module imported anywhere in path, including
+    # imports made inside functions
+    with open(path, "rb") as inf:
+        tree = ast.parse(inf.read(), path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+    return names
+
+
+def local_modules(module):
+    # module and every module in table_scripts/ it imports, directly or not,
+    # in a stable order
+    found = set()
+    queue = [module]
+    while queue:
+        name = queue.pop()
+        if name in found or not os.path.exists(module_path(name)):
+            continue
+        found.add(name)
+        queue.extend(imported_names(module_path(name)))
+    return sorted(found)
+
+
+def code_version(target):
+    digest = hashlib.sha256(str(BUILD_VERSION).encode())
+    for module in local_modules(target.module):
+        digest.update(module.encode())
+        with open(module_path(module), "rb") as inf:
+            digest.update(inf.read())
+    return digest.hexdigest()
+
+
+def load_state():
+    if not os.path.exists(state_path):
+        return {"targets": {}, "hashes": {}}
+    with open(state_path) as inf:
+        return json.load(inf)
+
+
+def save_state(state):
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w") as outf:
+        json.dump(state, outf, indent=1, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+
+def dependencies(targets):
+    # A target depends on any other selected target whose output it reads
+    outputs = {os.path.normpath(target.output): target.name for target in targets}
+    deps = {}
+    for target in targets:
+        deps[target.name] = set()
+        for pattern in target.inputs:
+            for output, name in outputs.items():
+                if name != target.name and fnmatch.fnmatch(
+                    output, os.path.normpath(pattern)
+                ):
+                    deps[target.name].add(name)
+    return deps
+
+
+def build_target(target, shared=True):
+    start = time.perf_counter()
+    module = importlib.import_module(target.module)
+    with traced_as(target.name, shared):
+        getattr(module, target.function)()
+    return time.perf_counter() - start
+
+
+def select_targets(names=None):
+    if names:
+        by_name = {target.name: target for target in TARGETS}
+        unknown = [name for name in names if name not in by_name]
+        if unknown:
+            raise SystemExit(f"Unknown targets: {', '.join(unknown)}")
+        return [by_name[name] for name in names]
+    return [target for target in TARGETS if target.default]
+
+
+def build(names=None, force=False, jobs=None):
+    targets = select_targets(names)
+    os.makedirs(table_dir, exist_ok=True)
+    state = load_state()
+    deps = dependencies(targets)
+    pending = {target.name: target for target in targets}
+    summary = {}
+
+    def up_to_date(target):
+        # Runs after the target's dependencies, so their outputs are current
+        previous = state["targets"].get(target.name)
+        current = {
+            "inputs": input_hashes(target, state["hashes"]),
+            "code": code_version(target),
+        }
+        fresh = not force and previous == current and os.path.exists(target.output)
+        return fresh, current
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        running = {}
+        current = {}
+        while pending or running:
+            n_pending = len(pending)
+            for name, target in list(pending.items()):
+                if deps[name] & (set(pending) | set(running.values())):
+                    continue
+                del pending[name]
+                if any(summary[dep][0] == "failed" for dep in deps[name]):
+                    summary[name] = ("failed", 0.0)
+                    continue
+                try:
+                    fresh, current[name] = up_to_date(target)
+                except FileNotFoundError as e:
+                    print(e)
+                    summary[name] = ("failed", 0.0)
+                    continue
+                if fresh:
+                    summary[name] = ("skipped", 0.0)
+                    continue
+                running[pool.submit(build_target, target, jobs != 1)] = name
+
+            if not running:
+                if len(pending) == n_pending:
+                    raise SystemExit(f"Dependency cycle among: {', '.join(pending)}")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    summary[name] = ("built", future.result())
+                    state["targets"][name] = current[name]
+                except Exception as e:
+                    # InputError messages list one problem per line
+                    print(f"{name} failed: {type(e).__name__}: {e}")
+                    summary[name] = ("failed", 0.0)
+                    state["targets"].pop(name, None)
+            save_state(state)
+
+    save_state(state)
+    print_summary(targets, summary)
+    return summary
+
+
+def print_summary(targets, summary):
+    width = max(len(target.name) for target in targets)
+    for target in targets:
+        status, seconds = summary[target.name]
+        print(f"{target.name:<{width}}  {status:<7}  {seconds:7.2f}s")
+
+
+def watched_files(targets):
+    # (size, mtime_ns) of every input and module source of targets
+    paths = set()
+    for target in targets:
+        for pattern in target.inputs:
+            paths.update(glob.glob(pattern))
+        paths.update(module_path(module) for module in local_modules(target.module))
+    snapshot = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:  # Removed since the glob
+            continue
+        snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+def unload_modules(paths):
+    # Drop every table module from this process if any of paths is a module
+    # source, so the next build imports the edited code. Modules import each
+    # other's functions by name, so reloading only the edited one is not
+    # enough.
+    if not any(os.path.dirname(os.path.abspath(path)) == script_dir for path in paths):
+        return
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None) or ""
+        if name != __name__ and os.path.dirname(os.path.abspath(path)) == script_dir:
+            del sys.modules[name]
+
+
+def watch(names=None, jobs=None, interval=2.0):
+    # Poll the inputs and code of the selected targets and build whenever
+    # anything changed. build() itself skips targets whose input hashes and
+    # code are unchanged, so a change rebuilds only the targets it affects.
+    targets = select_targets(names)
+    previous = None
+    while True:
+        snapshot = watched_files(targets)
+        if snapshot != previous:
+            if previous is not None:
+                changed = {
+                    path
+                    for path in snapshot.keys() | previous.keys()
+                    if snapshot.get(path) != previous.get(path)
+                }
+                print(
+                    f"{time.strftime('%H:%M:%S')} changed: {', '.join(sorted(changed))}"
+                )
+                unload_modules(changed)
+            build(names, jobs=jobs)
+            # Tables the build wrote may be inputs of other targets; anything
+            # else that changed during the build is picked up by the next poll
+            outputs = {os.path.normpath(target.output) for target in targets}
+            previous = snapshot
+            previous.update(
+                (path, value)
+                for path, value in watched_files(targets).items()
+                if os.path.normpath(path) in outputs
+            )
+        time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the tables in tables/")
+    parser.add_argument("targets", nargs="*", help="targets to build (default: all)")
+    parser.add_argument(
+        "--force", action="store_true", help="rebuild even if up to date"
+    )
+    parser.add_argument("-j", "--jobs", type=int, help="number of parallel builds")
+    parser.add_argument(
+        "--watch", action="store_true", help="keep running and rebuild on change"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=2.0, help="seconds between polls"
+    )
+    args = parser.parse_args()
+    if args.watch:
+        try:
+            watch(args.targets, jobs=args.jobs, interval=args.interval)
+        except KeyboardInterrupt:
+            return
+    summary = build(args.targets, force=args.force, jobs=args.jobs)
+    if any(status == "failed" for status, _ in summary.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
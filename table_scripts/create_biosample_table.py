@@ -1,56 +1,54 @@
 #!/usr/bin/env python3
 
+# Only needs sample names, so it reads and checks them with the standard
+# library rather than paying for the pandas import and the full qc_basic_stats
+# load
+
+import csv
 import os
-import numpy as np
-import pandas as pd
+from input_checks import check, sample_date, sample_name_violations
+from stage_trace import stage
+from table_output import write_table
+
+# Setting directories and S3 buckets
+table_dir = "../tables"
+results_dir = "../data/results"
+
+
+def bio_sample_rows(samples):
+    # BioSample table columns for sample names holding a date, one row per
+    # sample in order of first appearance
+    samples = list(dict.fromkeys(samples))
+    n_samples = len(samples)
+    return {
+        "Sample Name": samples,
+        "Sample Title": ["Influent wastewater from Hyperion Treatment Plant (LA, USA)"]
+        * n_samples,
+        "BioProject accession": [""] * n_samples,
+        "Organism": ["wastewater metagenome"] * n_samples,
+        "collection date": [sample_date(sample) for sample in samples],
+        "broad-scale environmental context": ["wastewater"] * n_samples,
+        "local-scale environmental context": ["influent wastewater"] * n_samples,
+        "environmental medium": ["Composite wastewater"] * n_samples,
+        "geographic location": ["USA: California"] * n_samples,
+        "latitude and longitude": ["33.924223 N 118.431516 W"] * n_samples,
+    }
 
 
 def create_biosample_table():
-    # Setting directories and S3 buckets
-    table_dir = "../tables"
-    results_dir = "../data/results"
-
-    metadata = pd.read_csv(os.path.join(results_dir, "qc_basic_stats.tsv"), sep="\t")
-    metadata["date"] = metadata["sample"].str.split("-").str[1:4].str.join("-")
-    # Create dictionary mapping sample to date
-    sample_to_date = dict(zip(metadata["sample"], metadata["date"]))
-
-    with open(f"{table_dir}/bio_sample_table.tsv", "w") as outf:
-        outf.write(
-            "\t".join(
-                [
-                    "Sample Name",
-                    "Sample Title",
-                    "BioProject accession",
-                    "Organism",
-                    "collection date",
-                    "broad-scale environmental context",
-                    "local-scale environmental context",
-                    "environmental medium",
-                    "geographic location",
-                    "latitude and longitude",
-                ]
-            )
-            + "\n"
-        )
-        for name, date in sample_to_date.items():
-            outf.write(
-                "\t".join(
-                    [
-                        name,
-                        "Influent wastewater from Hyperion Treatment Plant (LA, USA)",
-                        "",
-                        "wastewater metagenome",
-                        date,
-                        "wastewater",
-                        "influent wastewater",
-                        "Composite wastewater",
-                        "USA: California",
-                        "33.924223 N 118.431516 W",
-                    ]
-                )
-                + "\n"
-            )
+    qc_path = os.path.join(results_dir, "qc_basic_stats.tsv")
+    with stage("load") as s:
+        with open(qc_path, newline="") as inf:
+            samples = [row["sample"] for row in csv.DictReader(inf, delimiter="\t")]
+        s.rows = len(samples)
+    with stage("validate") as s:
+        check(qc_path, sample_name_violations(samples))
+        s.rows = len(samples)
+    bio_sample_table = bio_sample_rows(samples)
+
+    with stage("write") as s:
+        write_table(bio_sample_table, f"{table_dir}/bio_sample_table.tsv")
+        s.rows = len(bio_sample_table["Sample Name"])
 
 
 if __name__ == "__main__":
@@ -2,23 +2,24 @@
 
 import pandas as pd
 import os
-import numpy as np
-from datetime import datetime
+from qc_basic_stats import load_qc_basic_stats
+from stage_trace import stage
+from table_output import write_table
 
 # Setting directories and S3 buckets
 table_dir = "../tables"
 results_dir = "../data/results"
 
 
-def create_sra_table():
-    metadata = pd.read_csv(os.path.join(results_dir, "qc_basic_stats.tsv"), sep="\t")
+def sra_rows(metadata):
+    # SRA rows from qc_basic_stats rows with date and sequencing_machine columns
     metadata = metadata[
         metadata["stage"] == "cleaned"
     ]  # Only want one entry per sample, not two!
 
     df = pd.DataFrame()
-    df["sample_name"] = metadata["sample"]
-    df["library_ID"] = metadata["sample"]
+    df["sample_name"] = metadata["sample"].astype(str)
+    df["library_ID"] = metadata["sample"].astype(str)
     # Add additional columns
     df["title"] = "Metatranscriptomic Sequencing of Los Angeles Influent Sewage"
     df["library_strategy"] = "RNA-Seq"
@@ -26,15 +27,9 @@ def create_sra_table():
     df["library_selection"] = "cDNA"
     df["library_layout"] = "paired"
     df["platform"] = "ILLUMINA"
-    df["date"] = (
-        df["sample_name"].str.split("-").str[1:4].str.join("-").astype("datetime64[s]")
-    )
+    df["date"] = metadata["date"]
+    df["instrument_model"] = "Illumina " + metadata["sequencing_machine"]
     df.sort_values(by="date", inplace=True)
-    df["instrument_model"] = np.where(
-        df["date"] >= datetime(2024, 2, 25),
-        "Illumina NovaSeq X",
-        "Illumina NovaSeq 6000",
-    )
     df["design_description"] = (
         "Samples (60-ml) were filtered through 0.22-μm vacuum filters, then ultracentrifugated with 10-kDa Amicon filters until volumes were reduced to <500 μl. These concentrates were stored at −80°C before RNA extraction. Subsequently an Invitrogen PureLink RNA minikit with DNase (Invitrogen, Waltham, MA cite) was used to extract RNA following the manufacturer's protocol. Library preparation was performed by UC GRT Hub using the Illumina RNA prep with enrichment kit."
     )
@@ -63,10 +58,19 @@ def create_sra_table():
     ]
 
     # Create the SRA table with selected columns
-    sra_table = df[sra_columns]
+    return df[sra_columns]
+
+
+def create_sra_table():
+    with stage("load") as s:
+        metadata = load_qc_basic_stats(results_dir)
+        s.rows = len(metadata)
+    sra_table = sra_rows(metadata)
 
     # Save the SRA table as a TSV file
-    sra_table.to_csv(os.path.join(table_dir, "sra_table.tsv"), sep="\t", index=False)
+    with stage("write") as s:
+        write_table(sra_table, os.path.join(table_dir, "sra_table.tsv"))
+        s.rows = len(sra_table)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+# Consistency checks on the workflow results the tables are built from, run
+# before any table is generated so a bad input fails with a list of every
+# problem instead of a NaT or an IndexError part way through a build. Every
+# check is a whole-column operation over the table (sample names are checked
+# once per distinct sample), so they add little to loading the inputs. The
+# sample name check needs only the standard library, and numpy and pandas are
+# imported by the checks that use them, so create_biosample_table.py can check
+# the names it reads without loading either.
+#
+# load_qc_basic_stats() checks qc_basic_stats.tsv whenever it parses it (a
+# valid cached copy has already passed), so every script that loads it through
+# there is covered. table_s2.py and ra_stats.py check the Kraken clade counts
+# they read, and update_tables.py checks the rows it folds in. Run directly,
+# this checks both inputs and lists all violations.
+#
+# Usage (from table_scripts/):
+#   ./input_checks.py
+
+import os
+import re
+import sys
+from datetime import datetime
+
+from table_constants import DOMAIN_TAX_IDS
+
+# Setting directories
+results_dir = "../data/results"
+
+STAGES = ["raw_concat", "cleaned"]
+# n_bases_approx is the sum of both reads' lengths; mean_seq_len is rounded
+BASES_RTOL = 0.01
+# Sample names look like HTP-YYYY-MM-DD
+SAMPLE_DATE_PATTERN = r"^[^-]+-(\d{4}-\d{2}-\d{2})"
+# Labels shown per violation before the rest are counted
+MAX_EXAMPLES = 10
+
+
+class InputError(ValueError):
+    def __init__(self, source, violations):
+        self.source = source
+        self.violations = violations
+        super().__init__(
+            f"{source}: {len(violations)} problem(s)\n"
+            + "\n".join(f"  - {violation}" for violation in violations)
+        )
+
+
+def describe(problem, labels):
+    # "problem (n): a, b, c ..." with at most MAX_EXAMPLES labels
+    labels = [str(label) or '""' for label in labels]
+    shown = ", ".join(labels[:MAX_EXAMPLES])
+    if len(labels) > MAX_EXAMPLES:
+        shown += f" and {len(labels) - MAX_EXAMPLES:,} more"
+    return f"{problem} ({len(labels):,}): {shown}"
+
+
+def sample_date(sample):
+    # The YYYY-MM-DD in a sample name, or None if it has no valid date
+    match = re.match(SAMPLE_DATE_PATTERN, sample)
+    if match is None:
+        return None
+    try:
+        datetime.strptime(match.group(1), "%Y-%m-%d")
+    except ValueError:
+        return None
+    return match.group(1)
+
+
+def undated_samples(samples):
+    # Sample names without a valid YYYY-MM-DD after the first dash, each
+    # checked once
+    return [name for name in dict.fromkeys(map(str, samples)) if not sample_date(name)]
+
+
+def sample_name_violations(samples):
+    undated = undated_samples(samples)
+    if undated:
+        return [describe("Sample names without a date", undated)]
+    return []
+
+
+def qc_basic_stats_violations(basic_stats):
+    # basic_stats as read from qc_basic_stats.tsv, one row per sample and stage
+    import numpy as np
+    import pandas as pd
+
+    # An empty sample field reads as NaN
+    samples = basic_stats["sample"].astype(object).fillna("").astype(str)
+    violations = sample_name_violations(samples.unique())
+
+    stage_rows = (
+        samples.groupby([samples, basic_stats["stage"].astype(str)], sort=False)
+        .size()
+        .unstack(fill_value=0)
+        .reindex(columns=STAGES, fill_value=0)
+    )
+    for stage in STAGES:
+        missing = stage_rows.index[stage_rows[stage] == 0]
+        if len(missing):
+            violations.append(describe(f"Samples without a {stage} row", missing))
+        repeated = stage_rows.index[stage_rows[stage] > 1]
+        if len(repeated):
+            violations.append(describe(f"Samples with several {stage} rows", repeated))
+
+    # Compare stages only where each sample has exactly one row of each
+    stages = pd.DataFrame(
+        {
+            "sample": samples,
+            "stage": basic_stats["stage"].astype(str),
+            "n_read_pairs": basic_stats["n_read_pairs"],
+        }
+    )
+    stages = stages[
+        samples.map((stage_rows == 1).all(axis=1)) & stages["stage"].isin(STAGES)
+    ]
+    read_pairs = stages.pivot(
+        index="sample", columns="stage", values="n_read_pairs"
+    ).reindex(columns=STAGES)
+    grown = read_pairs.index[read_pairs["cleaned"] > read_pairs["raw_concat"]]
+    if len(grown):
+        violations.append(
+            describe("Samples with more cleaned than raw read pairs", grown)
+        )
+
+    if "mean_seq_len" in basic_stats:
+        expected = (
+            2
+            * basic_stats["n_read_pairs"].to_numpy(dtype=np.float64)
+            * basic_stats["mean_seq_len"].to_numpy(dtype=np.float64)
+        )
+        off = ~np.isclose(
+            basic_stats["n_bases_approx"].to_numpy(dtype=np.float64),
+            expected,
+            rtol=BASES_RTOL,
+        )
+        if off.any():
+            violations.append(
+                describe(
+                    "Rows whose n_bases_approx is not 2 x n_read_pairs x "
+                    "mean_seq_len",
+                    samples[off] + "/" + basic_stats["stage"][off].astype(str),
+                )
+            )
+    return violations
+
+
+def clade_count_violations(clade_counts, tax_ids=DOMAIN_TAX_IDS):
+    # clade_counts as returned by kraken_reports.read_clade_counts() for at
+    # least the tax_ids groups: per-sample Kraken clade read counts
+    violations = []
+    counts = clade_counts.pivot_table(
+        index="sample",
+        columns="taxid",
+        values="n_reads_clade",
+        aggfunc="sum",
+        sort=False,
+        observed=True,
+    ).reindex(columns=list(tax_ids.values()))
+    counts.columns = list(tax_ids)
+
+    for group in ["Unclassified", "Classified"]:
+        missing = counts.index[counts[group].isna()]
+        if len(missing):
+            violations.append(
+                describe(
+                    f"Samples without a {group.lower()} row, "
+                    f"taxid {tax_ids[group]}",
+                    missing,
+                )
+            )
+
+    has_root = counts["Classified"].notna()
+    counts = counts.fillna(0)
+    empty = counts.index[(counts["Unclassified"] + counts["Classified"]) <= 0]
+    if len(empty):
+        violations.append(
+            describe("Samples with no classified or unclassified reads", empty)
+        )
+    negative = counts.index[(counts < 0).any(axis=1)]
+    if len(negative):
+        violations.append(describe("Samples with negative read counts", negative))
+    # Every domain is a clade under the root, so together they cannot hold more
+    # reads than were classified (checked only where the root row is present)
+    domains = [
+        group for group in tax_ids if group not in ("Unclassified", "Classified")
+    ]
+    overfull = counts.index[
+        has_root & (counts[domains].sum(axis=1) > counts["Classified"])
+    ]
+    if len(overfull):
+        violations.append(
+            describe("Samples whose domains hold more reads than classified", overfull)
+        )
+    return violations
+
+
+def check(source, violations):
+    if violations:
+        raise InputError(source, violations)
+
+
+def check_all(results_dir=results_dir):
+    # Every violation in every input, as {source: violations}
+    from kraken_reports import kraken_report_path, read_clade_counts
+    from result_tables import load_table
+
+    qc_path = os.path.join(results_dir, "qc_basic_stats.tsv")
+    basic_stats = load_table(
+        qc_path,
+        "qc_basic_stats",
+        columns=["sample", "stage", "n_read_pairs", "n_bases_approx", "mean_seq_len"],
+    )
+    kraken_path = kraken_report_path(results_dir)
+    clade_counts = read_clade_counts(kraken_path, tax_ids=list(DOMAIN_TAX_IDS.values()))
+    return {
+        qc_path: qc_basic_stats_violations(basic_stats),
+        kraken_path: clade_count_violations(clade_counts),
+    }
+
+
+def main():
+    failed = False
+    for source, violations in check_all().items():
+        if violations:
+            print(InputError(source, violations))
+            failed = True
+        else:
+            print(f"{source}: ok")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# Merge per-sample Kraken reports into kraken_reports_merged.tsv.gz.
+#
+# Kraken2 reports have one line per taxon:
+#   pc_reads_total, n_reads_clade, n_reads_direct,
+#   [n_minimizers_total, n_minimizers_distinct,] rank, taxid, name
+# (the minimizer columns only with --report-minimizer-data; without them they
+# are written as 0, since the merged columns are integers). Worker processes
+# parse one report each, reorder its columns into the merged layout with the
+# name's indentation removed and a sample column added, and compress it as one
+# gzip member. The parent appends members in sample order as they arrive, so
+# memory holds only a few reports and the output is plain (multi-member) gzip
+# that pandas and the table scripts read as before.
+#
+# With --index, each sample's byte offset and length in the output are
+# written to kraken_reports_merged.index.tsv, and
+# kraken_reports.read_sample_reports() reads one sample by seeking straight to
+# its member.
+#
+# Usage (from table_scripts/):
+#   ./kraken_merge.py --index /path/to/reports/*.kraken.report.gz
+
+import argparse
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from isal import igzip as gzip
+
+    COMPRESS_LEVEL = 2  # isal levels run from 0 to 3
+except ImportError:
+    import gzip
+
+    COMPRESS_LEVEL = 6
+
+from kraken_reports import MERGED_COLUMNS, kraken_index_path
+
+# Setting directories
+results_dir = "../data/results"
+output_path = f"{results_dir}/kraken_reports_merged.tsv.gz"
+
+# {sample}.kraken.report.gz, {sample}.report.tsv, {sample}_kraken2_report.txt...
+SAMPLE_PATTERN = re.compile(r"^(?P<sample>.+?)[._](kraken2?[._])?report\b")
+
+
+def report_sample(path):
+    match = SAMPLE_PATTERN.match(os.path.basename(path))
+    if match is None:
+        raise ValueError(f"Cannot tell the sample of {path}")
+    return match["sample"]
+
+
+def merged_lines(path, sample):
+    # Lines of one report in the merged layout, without a header
+    opener = gzip.open if path.endswith(".gz") else open
+    lines = []
+    with opener(path, "rt") as inf:
+        for line_number, line in enumerate(inf, start=1):
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) == 6:
+                fields[3:3] = ["0", "0"]
+            if len(fields) != 8 or not fields[6].isdigit():
+                raise ValueError(f"{path}:{line_number}: not a Kraken report line")
+            fields[7] = fields[7].strip()
+            fields.append(sample)
+            lines.append("\t".join(fields) + "\n")
+    return lines
+
+
+def compressed_report(path, sample):
+    # (gzip member, number of rows) for one sample's report
+    lines = merged_lines(path, sample)
+    data = "".join(lines).encode()
+    # A fixed mtime keeps the output the same from run to run
+    return gzip.compress(data, COMPRESS_LEVEL, mtime=0), len(lines)
+
+
+def merge_reports(paths, output_path=output_path, index=False, workers=None):
+    if not output_path.endswith(".gz"):
+        raise ValueError(f"The merged report is gzipped: {output_path} needs .gz")
+    samples = {}
+    for path in paths:
+        sample = report_sample(path)
+        if sample in samples:
+            raise ValueError(f"Two reports for {sample}: {samples[sample]}, {path}")
+        samples[sample] = path
+
+    workers = workers or os.cpu_count()
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    try:
+        index_rows = write_merged(samples, tmp_path, workers)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
+
+    index_path = kraken_index_path(output_path)
+    if index:
+        with open(f"{index_path}.tmp", "w") as outf:
+            outf.write("sample\toffset\tlength\tn_rows\n")
+            for row in index_rows:
+                outf.write("\t".join(map(str, row)) + "\n")
+        os.replace(f"{index_path}.tmp", index_path)
+    elif os.path.exists(index_path):
+        # An index of an earlier merge would point at the wrong bytes
+        os.remove(index_path)
+    return index_rows
+
+
+def write_merged(samples, path, workers):
+    # Write the header and then every sample's member, in sample order.
+    # Returns (sample, offset, length, n_rows) for each sample.
+    index_rows = []
+    with open(path, "wb") as outf, ProcessPoolExecutor(workers) as pool:
+        header = "\t".join(MERGED_COLUMNS) + "\n"
+        outf.write(gzip.compress(header.encode(), COMPRESS_LEVEL, mtime=0))
+        pending = deque()
+
+        def write_next():
+            sample, future = pending.popleft()
+            member, n_rows = future.result()
+            index_rows.append((sample, outf.tell(), len(member), n_rows))
+            outf.write(member)
+
+        for sample in sorted(samples):
+            pending.append(
+                (sample, pool.submit(compressed_report, samples[sample], sample))
+            )
+            if len(pending) >= 2 * workers:
+                write_next()
+        while pending:
+            write_next()
+    return index_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge per-sample Kraken reports")
+    parser.add_argument("paths", nargs="+", help="Kraken report files")
+    parser.add_argument("-o", "--output", default=output_path)
+    parser.add_argument(
+        "--index", action="store_true", help="write a per-sample byte-offset index"
+    )
+    parser.add_argument("-j", "--workers", type=int)
+    args = parser.parse_args()
+    try:
+        merge_reports(args.paths, args.output, args.index, args.workers)
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import gzip
+import io
+import os
+import pandas as pd
+from result_tables import load_table, report_footprint
+from table_constants import DOMAIN_TAX_IDS
+
+# Columns of kraken_reports_merged.tsv that the table scripts actually use
+KRAKEN_COLUMNS = ["sample", "taxid", "n_reads_clade"]
+# All columns of kraken_reports_merged.tsv, in file order
+MERGED_COLUMNS = [
+    "pc_reads_total",
+    "n_reads_clade",
+    "n_reads_direct",
+    "n_minimizers_total",
+    "n_minimizers_distinct",
+    "rank",
+    "taxid",
+    "name",
+    "sample",
+]
+
+
+def kraken_report_path(results_dir):
+    # Prefer the compressed report; pandas decompresses it in memory
+    kraken_path = os.path.join(results_dir, "kraken_reports_merged.tsv")
+    if os.path.exists(kraken_path + ".gz"):
+        return kraken_path + ".gz"
+    return kraken_path
+
+
+def kraken_index_path(kraken_path):
+    # Per-sample byte-offset index written by kraken_merge.py --index
+    return kraken_path.removesuffix(".gz").removesuffix(".tsv") + ".index.tsv"
+
+
+def read_sample_reports(kraken_path, samples, columns=None):
+    # Rows of the given samples only, read by seeking to each sample's gzip
+    # member through the index instead of scanning the whole report
+    index = pd.read_csv(kraken_index_path(kraken_path), sep="\t", index_col="sample")
+    missing = [sample for sample in samples if sample not in index.index]
+    if missing:
+        raise KeyError(f"Samples not in {kraken_path}: {', '.join(missing)}")
+    blocks = [("\t".join(MERGED_COLUMNS) + "\n").encode()]
+    with open(kraken_path, "rb") as inf:
+        for sample in samples:
+            inf.seek(int(index.at[sample, "offset"]))
+            blocks.append(gzip.decompress(inf.read(int(index.at[sample, "length"]))))
+    return load_table(
+        io.BytesIO(b"".join(blocks)), "kraken_reports_merged", columns=columns
+    )
+
+
+def read_clade_counts(kraken_path, tax_ids=None, chunksize=1_000_000, report=False):
+    # Stream the merged report in chunks and fold each chunk into running
+    # per-sample, per-taxid totals. Memory scales with samples x tracked taxids,
+    # not with the size of the report.
+    totals = None
+    reader = load_table(
+        kraken_path,
+        "kraken_reports_merged",
+        columns=KRAKEN_COLUMNS,
+        chunksize=chunksize,
+    )
+    with reader:
+        for chunk in reader:
+            if tax_ids is not None:
+                chunk = chunk[chunk["taxid"].isin(tax_ids)]
+            chunk_totals = chunk.groupby(
+                ["sample", "taxid"], sort=False, observed=True
+            )["n_reads_clade"].sum()
+            if totals is None:
+                totals = chunk_totals
+            else:
+                # groupby(sort=False) keeps samples in order of first appearance
+                totals = (
+                    pd.concat([totals, chunk_totals])
+                    .groupby(level=["sample", "taxid"], sort=False)
+                    .sum()
+                )
+
+    if totals is None:
+        return pd.DataFrame(columns=KRAKEN_COLUMNS)
+    totals = totals.reset_index()
+    totals["sample"] = pd.Categorical(
+        totals["sample"], categories=totals["sample"].unique()
+    )
+    if report:
+        report_footprint("kraken_reports_merged (per-sample totals)", totals)
+    return totals
+
+
+def clade_count_matrix(clade_counts, tax_ids):
+    # Pivot long per-sample counts into a sample x taxid matrix in one pass.
+    # A taxid missing from a sample's report counts as 0 reads.
+    matrix = clade_counts.pivot_table(
+        index="sample",
+        columns="taxid",
+        values="n_reads_clade",
+        aggfunc="sum",
+        fill_value=0,
+        sort=False,
+    )
+    return matrix.reindex(columns=list(tax_ids), fill_value=0)
+
+
+def domain_relative_abundance(clade_counts, tax_ids=DOMAIN_TAX_IDS):
+    # Fraction of each sample's reads assigned to each group in tax_ids,
+    # relative to classified + unclassified reads
+    matrix = clade_count_matrix(clade_counts, tax_ids.values())
+    matrix.columns = list(tax_ids)
+    total_reads = matrix["Unclassified"] + matrix["Classified"]
+    return matrix.div(total_reads, axis=0)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+# Roll per-read Kraken output up to clade counts for arbitrary taxon sets.
+#
+# Per-read Kraken output has one line per read pair:
+#   C/U <tab> read_id <tab> taxid <tab> length <tab> LCA k-mer mapping
+# (with --use-names the taxid column reads "name (taxid N)"). Files are
+# streamed in blocks of whole lines; worker processes turn each block into
+# per-taxid counts, and each sample keeps one running count per taxid. Clade
+# membership is a precomputed bitmap over taxids (bit c set if the taxid
+# descends from clade c), so clade totals are a handful of masked sums.
+#
+# Usage (from table_scripts/):
+#   ./kraken_rollup.py --clades clades.tsv /path/to/*.kraken.gz > counts.tsv
+#
+# clades.tsv has columns clade and taxid; a clade may list several root taxids
+# (e.g. every human-infecting virus) and includes all of their descendants.
+
+import argparse
+import csv
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+try:
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
+
+from kraken_reports import DOMAIN_TAX_IDS
+from taxonomy_index import TaxonomyIndex, index_path
+
+BLOCK_SIZE = 16 * 1024 * 1024
+MAX_CLADES = 64  # One bit per clade in a uint64 bitmap
+
+SAMPLE_PATTERN = re.compile(r"^(?P<sample>.+?)(-part-\d+)?\.kraken")
+
+# Default clades: the domains reported in table S2
+DEFAULT_CLADES = {
+    group: [tax_id]
+    for group, tax_id in DOMAIN_TAX_IDS.items()
+    if group not in ("Unclassified", "Classified")
+}
+
+
+def read_clades(path):
+    clades = pd.read_csv(path, sep="\t", dtype={"clade": str, "taxid": np.int64})
+    return {
+        clade: group["taxid"].tolist()
+        for clade, group in clades.groupby("clade", sort=False)
+    }
+
+
+def clade_bitmap(index, clades):
+    # uint64 per taxid with bit c set if the taxid falls in clade c
+    if len(clades) > MAX_CLADES:
+        raise ValueError(f"At most {MAX_CLADES} clades are supported")
+    bitmap = np.zeros(int(index.taxids.max()) + 1, dtype=np.uint64)
+    for bit, roots in enumerate(clades.values()):
+        members = index.add_descendant_taxids(roots)
+        bitmap[members] |= np.uint64(1) << np.uint64(bit)
+    return bitmap
+
+
+def line_blocks(path, block_size=BLOCK_SIZE):
+    # Yield decompressed blocks that each end on a line boundary
+    opener = gzip.open if path.endswith(".gz") else open
+    leftover = b""
+    with opener(path, "rb") as inf:
+        while True:
+            chunk = inf.read(block_size)
+            if not chunk:
+                break
+            buf = leftover + chunk
+            cut = buf.rfind(b"\n") + 1
+            if cut == 0:
+                leftover = buf
+                continue
+            yield buf[:cut]
+            leftover = buf[cut:]
+    if leftover.strip():
+        yield leftover
+
+
+def block_taxid_counts(block):
+    # (taxids, counts) for one block of per-read output
+    taxids = pd.read_csv(
+        BytesIO(block),
+        sep="\t",
+        header=None,
+        usecols=[2],
+        quoting=csv.QUOTE_NONE,
+    )[2]
+    if not pd.api.types.is_integer_dtype(taxids):
+        taxids = taxids.str.extract(r"\(taxid (\d+)\)$", expand=False)
+    taxids = taxids.astype(np.int64).to_numpy()
+    return np.unique(taxids, return_counts=True)
+
+
+def sample_taxid_counts(paths, pool, max_pending):
+    # Running per-taxid read counts over all files of one sample
+    counts = {}
+    pending = deque()
+
+    def fold(future):
+        for taxid, count in zip(*future.result()):
+            counts[taxid] = counts.get(taxid, 0) + count
+
+    for path in paths:
+        for block in line_blocks(path):
+            pending.append(pool.submit(block_taxid_counts, block))
+            if len(pending) >= max_pending:
+                fold(pending.popleft())
+    while pending:
+        fold(pending.popleft())
+    taxids = np.fromiter(counts, dtype=np.int64, count=len(counts))
+    return taxids, np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+
+
+def clade_counts(taxids, counts, bitmap, n_clades):
+    # Reads per clade, plus unclassified (taxid 0) and total reads
+    in_taxonomy = (taxids >= 0) & (taxids < len(bitmap))
+    bits = np.zeros(len(taxids), dtype=np.uint64)
+    bits[in_taxonomy] = bitmap[taxids[in_taxonomy]]
+    row = [
+        int(counts[(bits >> np.uint64(bit)) & np.uint64(1) == 1].sum())
+        for bit in range(n_clades)
+    ]
+    return row + [int(counts[taxids == 0].sum()), int(counts.sum())]
+
+
+def group_by_sample(paths):
+    samples = {}
+    for path in sorted(paths):
+        match = SAMPLE_PATTERN.match(os.path.basename(path))
+        sample = match["sample"] if match else os.path.basename(path)
+        samples.setdefault(sample, []).append(path)
+    return samples
+
+
+def rollup(paths, clades=None, index=None, workers=None):
+    # Sample x clade count matrix for per-read Kraken output files
+    if clades is None:
+        clades = DEFAULT_CLADES
+    if index is None:
+        index = TaxonomyIndex.load()
+    bitmap = clade_bitmap(index, clades)
+    workers = workers or os.cpu_count()
+
+    rows = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for sample, sample_paths in group_by_sample(paths).items():
+            taxids, counts = sample_taxid_counts(sample_paths, pool, 2 * workers)
+            rows[sample] = clade_counts(taxids, counts, bitmap, len(clades))
+
+    matrix = pd.DataFrame.from_dict(
+        rows,
+        orient="index",
+        columns=list(clades) + ["Unclassified", "Total"],
+    )
+    matrix.index.name = "sample"
+    return matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clade counts from per-read Kraken")
+    parser.add_argument("paths", nargs="+", help="per-read Kraken output files")
+    parser.add_argument("--clades", help="TSV with clade and taxid columns")
+    parser.add_argument("--taxonomy-index", default=index_path)
+    parser.add_argument("-j", "--workers", type=int)
+    parser.add_argument("-o", "--output", help="output TSV (default: stdout)")
+    args = parser.parse_args()
+
+    clades = read_clades(args.clades) if args.clades else None
+    matrix = rollup(
+        args.paths,
+        clades=clades,
+        index=TaxonomyIndex.load(args.taxonomy_index),
+        workers=args.workers,
+    )
+    matrix.to_csv(args.output or sys.stdout, sep="\t")
+
+
+if __name__ == "__main__":
+    main()
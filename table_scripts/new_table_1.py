@@ -1,28 +1,21 @@
 #!/usr/bin/env python3
 
 import pandas as pd
-import csv
+import numpy as np
 import os
-import gzip
+import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from io import StringIO
+from result_tables import load_table
+from stage_trace import stage
+from table_output import percent, scaled, write_table
 
 # Setting directories
 workflow_results_dir = "../workflow_results"
 delivery_metadata_dir = "../delivery_metadata"
 table_dir = "../tables"
 
-# Loading mgs-workflow results
-datasets = [
-    "JR-2024-03-22-a",
-    "JR-2024-03-22-b",
-    "JR-2024-04-12",
-    "JR-2024-04-15",
-    "JR-2024-04-16",
-    "JR-2024-08-06",
-    "JR-2024-08-27",
-]
-
 # Dictionary mapping dataset names to UCI identifiers
 dataset_to_uci = {
     "JR-2024-03-22-a": "UCI-2024-03-pilot-a",
@@ -34,76 +27,94 @@ dataset_to_uci = {
 }
 
 
-def get_delivery_date_range():
-    delivery_dates = {}
-    for metadata_file in os.listdir(delivery_metadata_dir):
+def load_delivery_metadata():
+    # Build the sample -> date and delivery -> date range indexes in a single
+    # pass over the delivery metadata files
+    dfs = []
+    for metadata_file in sorted(os.listdir(delivery_metadata_dir)):
         if metadata_file.startswith("."):  # Skip hidden files like .DS_Store
             continue
-        dataset = metadata_file.split(".")[0]
-        uci_name = dataset_to_uci[dataset]
-
-        with open(f"{delivery_metadata_dir}/{metadata_file}", "r") as inf:
-            df = pd.read_csv(inf, sep="\t")
-            df["date"] = pd.to_datetime(df["date"], errors="coerce")
-            df = df[df["date"].dt.year.isin([2023, 2024])]
+        df = pd.read_csv(f"{delivery_metadata_dir}/{metadata_file}", sep="\t")
+        df["dataset"] = metadata_file.split(".")[0]
+        dfs.append(df)
+    metadata = pd.concat(dfs, ignore_index=True)
+    metadata["date"] = pd.to_datetime(metadata["date"], errors="coerce")
+    metadata = metadata[metadata["date"].dt.year.isin([2023, 2024])]
+
+    sample_to_date = dict(
+        zip(metadata["sample"], metadata["date"].dt.strftime("%Y-%m-%d"))
+    )
+    date_range = metadata.groupby("dataset")["date"].agg(["min", "max"])
+    delivery_dates = {
+        dataset_to_uci.get(dataset, dataset): (
+            f"{row['min']:%Y-%m-%d} to {row['max']:%Y-%m-%d}"
+        )
+        for dataset, row in date_range.iterrows()
+    }
+    return sample_to_date, delivery_dates
 
-            min_date = df["date"].min().strftime("%Y-%m-%d")
-            max_date = df["date"].max().strftime("%Y-%m-%d")
-            delivery_dates[uci_name] = f"{min_date} to {max_date}"
 
-    return delivery_dates
+def get_delivery_date_range():
+    return load_delivery_metadata()[1]
 
 
 def sample_to_date():
-    sample_to_date = {}
-    for metadata_file in os.listdir(delivery_metadata_dir):
-        if metadata_file.startswith("."):  # Skip hidden files like .DS_Store
-            continue
-        with open(f"{delivery_metadata_dir}/{metadata_file}", "r") as inf:
-            df = pd.read_csv(inf, sep="\t")
-            df["date"] = pd.to_datetime(df["date"], errors="coerce")
-            df = df[df["date"].dt.year.isin([2023, 2024])]
-            sample_to_date.update(
-                dict(zip(df["sample"], df["date"].dt.strftime("%Y-%m-%d")))
-            )
-    return sample_to_date
+    return load_delivery_metadata()[0]
 
 
-def concatenate_qc_basic_stats():
-    dfs = []
-    sample_to_date_dict = sample_to_date()
+def discover_datasets():
+    # Every workflow run directory that has QC output, not just known deliveries
+    pattern = f"{workflow_results_dir}/*/output/results/qc/qc_basic_stats.tsv.gz"
+    return {
+        os.path.relpath(path, workflow_results_dir).split(os.sep)[0]: path
+        for path in sorted(glob.glob(pattern))
+    }
 
-    for dataset in datasets:
-        gzipped_file = (
-            f"{workflow_results_dir}/{dataset}/output/results/qc/qc_basic_stats.tsv.gz"
-        )
-        if os.path.exists(gzipped_file):
-            with gzip.open(gzipped_file, "rt") as f:
-                df = pd.read_csv(f, sep="\t")
-
-                if dataset == "JR-2024-04-16":
-                    df["date"] = df["sample"].map(sample_to_date_dict)
-                    df["date"] = pd.to_datetime(df["date"])
-                    df["uci_name"] = df["date"].apply(
-                        lambda x: (
-                            dataset_to_uci["JR-2024-04-12"]
-                            if x.date() <= datetime(2024, 1, 7).date()
-                            else dataset_to_uci["JR-2024-04-15"]
-                        )
-                    )
-                else:
-                    df["uci_name"] = dataset_to_uci[dataset]
-
-                dfs.append(df)
+
+def read_qc_basic_stats(path):
+    return load_table(
+        path,
+        "qc_basic_stats",
+        columns=["sample", "stage", "n_read_pairs", "percent_gc", "n_bases_approx"],
+    )
+
+
+def concatenate_qc_basic_stats(sample_to_date_dict=None, max_workers=None):
+    if sample_to_date_dict is None:
+        sample_to_date_dict = sample_to_date()
+    dataset_paths = discover_datasets()
+
+    # Decompressing is the slow part, so parse the datasets in parallel.
+    # Workers are spawned rather than forked: build_tables.py runs this from a
+    # thread pool, and forking a process with other threads running can
+    # deadlock.
+    with ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        dataset_dfs = pool.map(read_qc_basic_stats, dataset_paths.values())
+
+    dfs = []
+    for dataset, df in zip(dataset_paths, dataset_dfs):
+        if dataset == "JR-2024-04-16":
+            # This delivery contains samples from both full runs; split by date
+            df["date"] = pd.to_datetime(df["sample"].map(sample_to_date_dict))
+            df["uci_name"] = np.where(
+                df["date"] <= datetime(2024, 1, 7),
+                dataset_to_uci["JR-2024-04-12"],
+                dataset_to_uci["JR-2024-04-15"],
+            )
         else:
-            print(f"File not found for {dataset}: {gzipped_file}")
+            df["uci_name"] = dataset_to_uci.get(dataset, dataset)
+        dfs.append(df)
 
     return pd.concat(dfs, ignore_index=True)
 
 
 def generate_summary_table():
-    delivery_dates = get_delivery_date_range()
-    df = concatenate_qc_basic_stats()
+    with stage("load") as s:
+        sample_to_date_dict, delivery_dates = load_delivery_metadata()
+        df = concatenate_qc_basic_stats(sample_to_date_dict)
+        s.rows = len(df)
     df_raw = df[df["stage"] == "raw_concat"]
 
     df_raw_summary = (
@@ -118,18 +129,20 @@ def generate_summary_table():
     )
 
     df_raw_summary["Date Range"] = df_raw_summary["uci_name"].map(delivery_dates)
-    df_raw_summary["total_read_pairs"] = df_raw_summary["total_read_pairs"].apply(
-        lambda x: f"{x/1e9:,.2f}B"
+    df_raw_summary["total_read_pairs"] = scaled(
+        df_raw_summary["total_read_pairs"], "B", thousands=True
     )
-    df_raw_summary["total_bases"] = df_raw_summary["total_bases"].apply(
-        lambda x: f"{x/1e9:,.0f}B"
+    df_raw_summary["total_bases"] = scaled(
+        df_raw_summary["total_bases"], "B", decimals=0, thousands=True
     )
-    df_raw_summary["mean_gc_content"] = df_raw_summary["mean_gc_content"].apply(
-        lambda x: f"{x:,.2f}%"
+    df_raw_summary["mean_gc_content"] = percent(
+        df_raw_summary["mean_gc_content"], thousands=True
     )
 
     os.makedirs(table_dir, exist_ok=True)
-    df_raw_summary.to_csv(f"{table_dir}/table_1.tsv", sep="\t", index=False)
+    with stage("write") as s:
+        write_table(df_raw_summary, f"{table_dir}/table_1.tsv")
+        s.rows = len(df_raw_summary)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+# Per-process cost rollups from Nextflow trace logs, replacing the per-element
+# parse_duration_string loop in figures/fig_infra_scripts/aux_functions.R.
+#
+# Every trace file under data/logging is read in chunks. Durations ("1h 2m
+# 3s", "350ms") and memory sizes ("1.5 GB") are parsed with vectorized string
+# operations, and each chunk is folded into running per-(dataset, process)
+# totals, so traces with any number of tasks stream through in constant memory.
+# The dataset is the first directory below the log directory, or the file name
+# for traces stored directly in it.
+#
+# Two layouts are read: standard Nextflow traces with a header row (process,
+# cpus, realtime, peak_rss, ...), and headerless files with the columns
+# import_log() expects (process, cpus, realtime), optionally followed by the
+# cpu_time, peak_rss and rows columns written by stage_trace.py.
+#
+# Usage (from table_scripts/):
+#   ./nextflow_costs.py > ../tables/nextflow_costs.tsv
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Setting directories
+log_dir = "../data/logging"
+
+HEADERLESS_COLUMNS = ["process", "cpus", "realtime", "cpu_time", "peak_rss", "rows"]
+TRACE_COLUMNS = ["process", "cpus", "realtime", "peak_rss"]
+TRACE_SUFFIXES = (".txt", ".tsv", ".trace")
+
+DURATION_UNITS = {"ms": 1e-3, "s": 1, "m": 60, "h": 3600, "d": 86400}
+MEMORY_UNITS = {"B": 1, "KB": 2**10, "MB": 2**20, "GB": 2**30, "TB": 2**40}
+NUMBER = r"[0-9][0-9,]*(?:\.[0-9]+)?"
+# One optional group per unit, in the order Nextflow writes them
+DURATION_PATTERN = "^" + "".join(
+    rf"(?:\s*(?P<{unit}>{NUMBER}){unit}(?![a-z]))?"
+    for unit in ["d", "h", "m", "s", "ms"]
+)
+MEMORY_PATTERN = rf"^\s*(?P<n>{NUMBER})\s*(?P<unit>[KMGT]?B)\s*$"
+
+
+def unique_strings(values):
+    # Codes into, and the distinct values of, a column of strings. Trace
+    # durations and sizes repeat a lot, so parsing the distinct values and
+    # indexing back is much cheaper than parsing every row.
+    codes, uniques = pd.factorize(
+        pd.Series(values, dtype=object), use_na_sentinel=False
+    )
+    return codes, pd.Series(uniques, dtype=str)
+
+
+def parse_durations(durations):
+    # Seconds for each duration string; "-" and missing values count as 0, as
+    # in parse_duration_string
+    codes, uniques = unique_strings(durations)
+    parts = uniques.str.extract(DURATION_PATTERN)
+    seconds = np.zeros(len(parts))
+    for unit, scale in DURATION_UNITS.items():
+        n = parts[unit].str.replace(",", "", regex=False).astype(float)
+        seconds += n.fillna(0).to_numpy() * scale
+    return seconds[codes]
+
+
+def parse_memory(sizes):
+    # Bytes for each memory string ("1.5 GB"); NaN where not reported
+    codes, uniques = unique_strings(sizes)
+    parts = uniques.str.extract(MEMORY_PATTERN)
+    n = parts["n"].str.replace(",", "", regex=False).astype(float)
+    return (n * parts["unit"].map(MEMORY_UNITS)).to_numpy(dtype=float)[codes]
+
+
+def find_traces(log_dir):
+    # {path: dataset} for every trace file under log_dir
+    traces = {}
+    for root, dirs, files in os.walk(log_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.startswith(".") or not name.endswith(TRACE_SUFFIXES):
+                continue
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, log_dir).split(os.sep)
+            if len(relative) > 1:
+                traces[path] = relative[0]
+            else:
+                traces[path] = os.path.splitext(name)[0]
+    return traces
+
+
+def trace_chunks(path, chunksize):
+    # Chunks with process, cpus, realtime and peak_rss columns
+    with open(path) as inf:
+        first = inf.readline().rstrip("\n").split("\t")
+    if "process" in first and "realtime" in first:
+        columns = [column for column in TRACE_COLUMNS if column in first]
+        reader = pd.read_csv(
+            path, sep="\t", usecols=columns, dtype=str, chunksize=chunksize
+        )
+    else:
+        names = HEADERLESS_COLUMNS[: len(first)]
+        columns = [column for column in TRACE_COLUMNS if column in names]
+        reader = pd.read_csv(
+            path,
+            sep="\t",
+            header=None,
+            names=names,
+            usecols=columns,
+            dtype=str,
+            chunksize=chunksize,
+        )
+    for chunk in reader:
+        if "peak_rss" not in chunk:
+            chunk["peak_rss"] = None
+        yield chunk
+
+
+def chunk_costs(chunk):
+    cpus = pd.to_numeric(chunk["cpus"], errors="coerce").to_numpy()
+    realtime_s = parse_durations(chunk["realtime"])
+    return pd.DataFrame(
+        {
+            "process": chunk["process"].to_numpy(),
+            "n_tasks": 1,
+            "cpu_hours": realtime_s * np.nan_to_num(cpus) / 3600,
+            "realtime_hours": realtime_s / 3600,
+            "peak_rss_bytes": parse_memory(chunk["peak_rss"]),
+        }
+    )
+
+
+def fold_costs(costs):
+    # Sum task counts and hours, keep the largest peak memory
+    return costs.groupby(["dataset", "process"], sort=False).agg(
+        n_tasks=("n_tasks", "sum"),
+        cpu_hours=("cpu_hours", "sum"),
+        realtime_hours=("realtime_hours", "sum"),
+        peak_rss_bytes=("peak_rss_bytes", "max"),
+    )
+
+
+def process_costs(log_dir=log_dir, chunksize=500_000):
+    # One row per dataset and process, most expensive first
+    totals = None
+    for path, dataset in find_traces(log_dir).items():
+        for chunk in trace_chunks(path, chunksize):
+            costs = chunk_costs(chunk)
+            costs.insert(0, "dataset", dataset)
+            costs = fold_costs(costs)
+            if totals is not None:
+                costs = fold_costs(pd.concat([totals, costs]).reset_index())
+            totals = costs
+    if totals is None:
+        raise FileNotFoundError(f"No trace files found under {log_dir}")
+
+    totals = totals.reset_index()
+    totals["peak_rss_gb"] = totals.pop("peak_rss_bytes") / 2**30
+    dataset_hours = totals.groupby("dataset")["cpu_hours"].transform("sum")
+    totals["pc_dataset_cpu_hours"] = 100 * totals["cpu_hours"] / dataset_hours
+    return totals.sort_values(
+        ["dataset", "cpu_hours"], ascending=[True, False], ignore_index=True
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Roll up Nextflow trace costs")
+    parser.add_argument("--log-dir", default=log_dir)
+    parser.add_argument("-o", "--output", help="output TSV (default: stdout)")
+    args = parser.parse_args()
+    costs = process_costs(args.log_dir)
+    costs.to_csv(args.output or sys.stdout, sep="\t", index=False, float_format="%.4f")
+
+
+if __name__ == "__main__":
+    main()
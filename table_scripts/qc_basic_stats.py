@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Without pyarrow we parse the TSV on every run
+    pa = None
+    pq = None
+
+from input_checks import check, qc_basic_stats_violations
+from table_constants import NOVASEQ_X_START
+
+# Bump when parse_qc_basic_stats() changes, so existing caches are rebuilt
+CACHE_VERSION = 2
+
+# Tables already loaded in this process, keyed by source path. Lets a single
+# build of several tables share one load.
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def sample_dates(samples):
+    # Sample names look like HTP-YYYY-MM-DD
+    return pd.to_datetime(samples.astype(str).str.split("-").str[1:4].str.join("-"))
+
+
+def sequencing_machine(dates):
+    return np.where(dates >= NOVASEQ_X_START, "NovaSeq X", "NovaSeq 6000")
+
+
+def parse_qc_basic_stats(source_path):
+    basic_stats = pd.read_csv(source_path, sep="\t")
+    # Before parsing dates, so a bad sample name is reported with the rest
+    check(source_path, qc_basic_stats_violations(basic_stats))
+    basic_stats["sample"] = pd.Categorical(
+        basic_stats["sample"], categories=basic_stats["sample"].unique()
+    )
+    basic_stats["stage"] = basic_stats["stage"].astype("category")
+    basic_stats["date"] = sample_dates(basic_stats["sample"])
+    basic_stats["sequencing_machine"] = sequencing_machine(basic_stats["date"])
+    return basic_stats
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as inf:
+        for block in iter(lambda: inf.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_signature(source_path, with_hash=False):
+    stat = os.stat(source_path)
+    signature = {
+        "version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+    if with_hash:
+        signature["sha256"] = file_sha256(source_path)
+    return signature
+
+
+def cache_is_valid(cache_path, source_path):
+    if not os.path.exists(cache_path):
+        return False
+    metadata = pq.read_schema(cache_path).metadata or {}
+    if b"qc_source" not in metadata:
+        return False
+    cached = json.loads(metadata[b"qc_source"])
+    current = source_signature(source_path)
+    if cached["version"] != current["version"] or cached["size"] != current["size"]:
+        return False
+    if cached["mtime_ns"] == current["mtime_ns"]:
+        return True
+    # The file was touched (e.g. re-synced) but may be unchanged
+    return cached.get("sha256") == file_sha256(source_path)
+
+
+def write_cache(basic_stats, cache_path, source_path):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    table = pa.Table.from_pandas(basic_stats, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"qc_source"] = json.dumps(
+        source_signature(source_path, with_hash=True)
+    ).encode()
+    table = table.replace_schema_metadata(metadata)
+    # Write to a temporary file first so readers never see a partial cache
+    tmp_path = f"{cache_path}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, cache_path)
+
+
+def load_qc_basic_stats(results_dir, cache_dir=None):
+    # Load qc_basic_stats.tsv with categorical sample/stage, a datetime date
+    # and the sequencing machine, going through a Parquet cache that is
+    # rebuilt whenever the TSV changes
+    source_path = os.path.join(results_dir, "qc_basic_stats.tsv")
+    with _loaded_lock:
+        signature = source_signature(source_path)
+        key = os.path.abspath(source_path)
+        if key in _loaded and _loaded[key][0] == signature:
+            # Callers add and overwrite columns, so hand out a copy
+            return _loaded[key][1].copy()
+        basic_stats = read_qc_basic_stats(source_path, cache_dir)
+        _loaded[key] = (signature, basic_stats)
+        return basic_stats.copy()
+
+
+def read_qc_basic_stats(source_path, cache_dir=None):
+    if pq is None:
+        return parse_qc_basic_stats(source_path)
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(source_path), ".cache")
+    cache_path = os.path.join(cache_dir, "qc_basic_stats.parquet")
+    if cache_is_valid(cache_path, source_path):
+        return pq.read_table(cache_path, memory_map=True).to_pandas()
+
+    basic_stats = parse_qc_basic_stats(source_path)
+    write_cache(basic_stats, cache_path, source_path)
+    return basic_stats
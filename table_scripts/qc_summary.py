@@ -0,0 +1,122 @@
+import glob
+import os
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from qc_basic_stats import sample_dates, sequencing_machine
+
+# A QC summary holds only sums and histograms, so summaries of FASTQ parts,
+# lanes or reruns merge into exactly the summary of the concatenated reads.
+# Each FASTQ file gets one summary, saved as an .npz next to its metadata.
+
+MAX_READ_LENGTH = 1024
+GC_BINS = 101  # Per-read GC content in whole percent, 0-100
+
+COUNT_FIELDS = ["n_reads", "n_bases", "n_gc"]
+ARRAY_FIELDS = {
+    "length_hist": MAX_READ_LENGTH + 1,
+    "gc_hist": GC_BINS,
+    "qual_sum": MAX_READ_LENGTH,
+    "qual_count": MAX_READ_LENGTH,
+}
+METADATA_FIELDS = [
+    "sample",
+    "read",
+    "stage",
+    "source",
+    "source_size",
+    "source_mtime_ns",
+]
+
+
+def empty_summary():
+    summary = {field: 0 for field in COUNT_FIELDS}
+    for field, size in ARRAY_FIELDS.items():
+        summary[field] = np.zeros(size, dtype=np.int64)
+    return summary
+
+
+def merge_summaries(*summaries):
+    # Field-wise sums; metadata is not carried over
+    fields = COUNT_FIELDS + list(ARRAY_FIELDS)
+    return reduce(
+        lambda a, b: {field: a[field] + b[field] for field in fields},
+        summaries,
+        empty_summary(),
+    )
+
+
+def save_summary(path, summary, **metadata):
+    arrays = {
+        field: np.asarray(summary[field], dtype=np.int64) for field in COUNT_FIELDS
+    }
+    arrays.update({field: summary[field] for field in ARRAY_FIELDS})
+    arrays.update({key: np.asarray(value) for key, value in metadata.items()})
+    # Write to a temporary file first so readers never see a partial summary
+    tmp_path = f"{path}.tmp.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_summary(path):
+    with np.load(path, allow_pickle=False) as npz:
+        summary = {field: int(npz[field]) for field in COUNT_FIELDS}
+        summary.update({field: npz[field] for field in ARRAY_FIELDS})
+        summary.update(
+            {key: npz[key].item() for key in METADATA_FIELDS if key in npz.files}
+        )
+    return summary
+
+
+def sample_summaries(summary_dir, stage=None):
+    # Merge every per-file summary into one summary per sample, stage and read
+    # direction: {(sample, stage): {read: summary}}
+    samples = {}
+    for path in sorted(glob.glob(os.path.join(summary_dir, "*.npz"))):
+        summary = load_summary(path)
+        if stage is not None and summary["stage"] != stage:
+            continue
+        reads = samples.setdefault((summary["sample"], summary["stage"]), {})
+        reads[summary["read"]] = merge_summaries(
+            reads.get(summary["read"], empty_summary()), summary
+        )
+    return samples
+
+
+def basic_stats_row(sample, stage, reads):
+    # One qc_basic_stats row from the merged read 1 and read 2 summaries
+    both = merge_summaries(*reads.values())
+    return {
+        "sample": sample,
+        "stage": stage,
+        "n_read_pairs": reads.get("1", empty_summary())["n_reads"],
+        "n_bases_approx": both["n_bases"],
+        "percent_gc": 100 * both["n_gc"] / both["n_bases"] if both["n_bases"] else 0.0,
+        "mean_seq_len": both["n_bases"] / both["n_reads"] if both["n_reads"] else 0.0,
+    }
+
+
+def basic_stats_from_summaries(summary_dir, stage="raw_concat"):
+    # qc_basic_stats-style table derived from the summaries in summary_dir,
+    # with the same date and sequencing_machine columns as load_qc_basic_stats
+    basic_stats = pd.DataFrame(
+        [
+            basic_stats_row(sample, sample_stage, reads)
+            for (sample, sample_stage), reads in sample_summaries(
+                summary_dir, stage
+            ).items()
+        ],
+        columns=[
+            "sample",
+            "stage",
+            "n_read_pairs",
+            "n_bases_approx",
+            "percent_gc",
+            "mean_seq_len",
+        ],
+    )
+    basic_stats["date"] = sample_dates(basic_stats["sample"])
+    basic_stats["sequencing_machine"] = sequencing_machine(basic_stats["date"])
+    return basic_stats
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+# Dense per-position quality cube built from qc_quality_base_stats.tsv.
+#
+# mean_phred_score is stored as a float32 array of shape
+# (sample, stage, read_pair, position) in a .npy file that is opened
+# memory-mapped, with a small JSON sidecar naming the entries along each axis.
+# Positions not covered by a read are NaN. Slicing reads only the pages it
+# touches, so pulling a few samples or one stage out of thousands of samples
+# takes milliseconds and involves no text parsing.
+#
+# The converter also writes a plot-ready table for fig_1_and_2.R: only the
+# raw_concat stage, optionally every --step-th position, in the column layout
+# of qc_quality_base_stats.tsv.
+#
+# Usage (from table_scripts/):
+#   ./quality_cube.py              # writes ../data/results/quality_cube/ and
+#                                  # ../data/results/qc_quality_base_stats_plot.tsv
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from result_tables import load_table
+
+# Setting directories
+results_dir = "../data/results"
+cube_dir = f"{results_dir}/quality_cube"
+plot_path = f"{results_dir}/qc_quality_base_stats_plot.tsv"
+
+CUBE_FILE = "mean_phred_score.npy"
+INDEX_FILE = "index.json"
+
+
+class QualityCube:
+    def __init__(self, values, samples, stages, read_pairs):
+        # values[sample, stage, read_pair, position - 1]
+        self.values = values
+        self.samples = list(samples)
+        self.stages = list(stages)
+        self.read_pairs = list(read_pairs)
+        self._rows = {
+            name: {label: i for i, label in enumerate(labels)}
+            for name, labels in [
+                ("samples", self.samples),
+                ("stages", self.stages),
+                ("read pairs", self.read_pairs),
+            ]
+        }
+
+    @property
+    def n_positions(self):
+        return self.values.shape[3]
+
+    @classmethod
+    def from_table(cls, quality):
+        # Build from a qc_quality_base_stats frame with categorical sample,
+        # stage and file columns (as loaded by result_tables.load_table)
+        files = quality["file"].cat.categories.astype(str)
+        # Files are named {sample}_{read pair}
+        file_read_pairs = files.str.rsplit("_", n=1).str[-1]
+        read_pairs = sorted(file_read_pairs.unique())
+        read_pair_codes = pd.Index(read_pairs).get_indexer(file_read_pairs)
+
+        sample_codes = quality["sample"].cat.codes.to_numpy()
+        stage_codes = quality["stage"].cat.codes.to_numpy()
+        pair_codes = read_pair_codes[quality["file"].cat.codes.to_numpy()]
+        position_index = quality["position"].to_numpy().astype(np.int64) - 1
+
+        values = np.full(
+            (
+                len(quality["sample"].cat.categories),
+                len(quality["stage"].cat.categories),
+                len(read_pairs),
+                int(position_index.max()) + 1 if len(quality) else 0,
+            ),
+            np.nan,
+            dtype=np.float32,
+        )
+        values[sample_codes, stage_codes, pair_codes, position_index] = quality[
+            "mean_phred_score"
+        ].to_numpy()
+        return cls(
+            values,
+            quality["sample"].cat.categories.astype(str),
+            quality["stage"].cat.categories.astype(str),
+            read_pairs,
+        )
+
+    @classmethod
+    def open(cls, cube_dir=cube_dir):
+        # Memory-map a saved cube; nothing is read until it is sliced
+        with open(os.path.join(cube_dir, INDEX_FILE)) as inf:
+            index = json.load(inf)
+        values = np.load(os.path.join(cube_dir, CUBE_FILE), mmap_mode="r")
+        return cls(values, index["samples"], index["stages"], index["read_pairs"])
+
+    def save(self, cube_dir=cube_dir):
+        os.makedirs(cube_dir, exist_ok=True)
+        cube_path = os.path.join(cube_dir, CUBE_FILE)
+        index_path = os.path.join(cube_dir, INDEX_FILE)
+        # Write both to temporary files first so readers never see a cube and
+        # an index that do not match
+        out = np.lib.format.open_memmap(
+            f"{cube_path}.tmp",
+            mode="w+",
+            dtype=np.float32,
+            shape=self.values.shape,
+        )
+        out[...] = self.values
+        out.flush()
+        del out
+        with open(f"{index_path}.tmp", "w") as outf:
+            json.dump(
+                {
+                    "samples": self.samples,
+                    "stages": self.stages,
+                    "read_pairs": self.read_pairs,
+                    "n_positions": self.n_positions,
+                },
+                outf,
+            )
+        os.replace(f"{cube_path}.tmp", cube_path)
+        os.replace(f"{index_path}.tmp", index_path)
+
+    def axis_indices(self, samples=None, stages=None, read_pairs=None, positions=None):
+        # Index arrays along each axis; None selects everything. positions are
+        # 1-based, as in the TSV.
+        def lookup(name, selected):
+            rows = self._rows[name]
+            if selected is None:
+                return np.arange(len(rows))
+            missing = [label for label in selected if label not in rows]
+            if missing:
+                raise KeyError(f"Unknown {name}: {', '.join(map(str, missing))}")
+            return np.array([rows[label] for label in selected], dtype=np.int64)
+
+        if positions is None:
+            position_index = np.arange(self.n_positions)
+        else:
+            position_index = np.asarray(positions, dtype=np.int64) - 1
+            if len(position_index) and (
+                position_index.min() < 0 or position_index.max() >= self.n_positions
+            ):
+                raise KeyError(f"Positions must lie in 1..{self.n_positions}")
+        return (
+            lookup("samples", samples),
+            lookup("stages", stages),
+            lookup("read pairs", read_pairs),
+            position_index,
+        )
+
+    def select(self, samples=None, stages=None, read_pairs=None, positions=None):
+        # Dense sub-cube for the selected labels, in the order given
+        indices = self.axis_indices(samples, stages, read_pairs, positions)
+        return np.asarray(self.values[np.ix_(*indices)])
+
+    def to_frame(self, samples=None, stages=None, read_pairs=None, positions=None):
+        # Long table in the qc_quality_base_stats.tsv layout, without the
+        # positions a read does not cover
+        indices = self.axis_indices(samples, stages, read_pairs, positions)
+        values = np.asarray(self.values[np.ix_(*indices)])
+        grid = np.meshgrid(*[np.arange(len(index)) for index in indices], indexing="ij")
+        covered = ~np.isnan(values)
+        sample_index, stage_index, pair_index, position_index = (
+            index[axis[covered]] for index, axis in zip(indices, grid)
+        )
+        samples = np.array(self.samples, dtype=object)[sample_index]
+        read_pairs = np.array(self.read_pairs, dtype=object)[pair_index]
+        return pd.DataFrame(
+            {
+                "sample": samples,
+                "file": samples + "_" + read_pairs,
+                "position": position_index + 1,
+                "mean_phred_score": values[covered],
+                "stage": np.array(self.stages, dtype=object)[stage_index],
+            }
+        )
+
+
+def build_cube(results_dir=results_dir):
+    quality = load_table(
+        os.path.join(results_dir, "qc_quality_base_stats.tsv"),
+        "qc_quality_base_stats",
+    )
+    return QualityCube.from_table(quality)
+
+
+def export_plot_table(cube, path=plot_path, stage="raw_concat", step=1):
+    # raw_concat rows for the figure, keeping every step-th position and the
+    # last one so each line still ends where the reads do
+    positions = np.unique(
+        np.r_[np.arange(1, cube.n_positions + 1, step), cube.n_positions]
+    )
+    plot_table = cube.to_frame(stages=[stage], positions=positions)
+    plot_table.to_csv(path, sep="\t", index=False)
+    return plot_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the quality cube")
+    parser.add_argument("--results-dir", default=results_dir)
+    parser.add_argument("--cube-dir", default=cube_dir)
+    parser.add_argument("--plot-table", default=plot_path)
+    parser.add_argument(
+        "--step", type=int, default=1, help="keep every step-th position for plots"
+    )
+    args = parser.parse_args()
+    cube = build_cube(args.results_dir)
+    cube.save(args.cube_dir)
+    export_plot_table(cube, args.plot_table, step=args.step)
+
+
+if __name__ == "__main__":
+    main()
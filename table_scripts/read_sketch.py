@@ -0,0 +1,188 @@
+import os
+from functools import reduce
+
+import numpy as np
+
+# Fixed-size sketches of the read pairs in a FASTQ file, for library
+# complexity: a HyperLogLog of read-pair hashes estimates the number of
+# distinct pairs, and a count-min sketch estimates how often a given pair
+# occurs. Both merge exactly (register-wise max and sum), so sketches of parts,
+# lanes or reruns merge into the sketch of the concatenated reads, like the QC
+# summaries in qc_summary.py. A sketch takes about 1 MiB whatever the number
+# of reads; read pairs are identified by a 64-bit hash of both sequences.
+
+HLL_PRECISION = 14  # 2**14 one-byte registers, ~0.8% standard error
+CMS_DEPTH = 4
+CMS_WIDTH = 2**15
+N_CANDIDATES = 100  # Over-represented read pairs tracked per sketch
+
+FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+FNV_PRIME = np.uint64(0x100000001B3)
+
+
+def mix(h):
+    # splitmix64 finalizer: spreads every input bit over the whole hash
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xBF58476D1CE4E5B9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def sequence_hashes(arr, starts, lengths):
+    # 64-bit FNV-1a hash of each sequence arr[start:start + length], computed
+    # one position at a time across all sequences
+    h = np.full(len(starts), FNV_OFFSET, dtype=np.uint64)
+    if not len(starts):
+        return h
+    last = len(arr) - 1
+    for position in range(int(lengths.max())):
+        live = lengths > position
+        bases = arr[np.minimum(starts + position, last)].astype(np.uint64)
+        h = np.where(live, (h ^ bases) * FNV_PRIME, h)
+    return h
+
+
+def pair_hashes(hashes_1, hashes_2):
+    return mix(hashes_1 ^ mix(hashes_2 + np.uint64(0x9E3779B97F4A7C15)))
+
+
+def empty_sketch():
+    return {
+        "n_pairs": 0,
+        "hll": np.zeros(2**HLL_PRECISION, dtype=np.uint8),
+        "cms": np.zeros((CMS_DEPTH, CMS_WIDTH), dtype=np.uint64),
+        "candidate_hash": np.zeros(0, dtype=np.uint64),
+        "candidate_seq_1": np.zeros(0, dtype=str),
+        "candidate_seq_2": np.zeros(0, dtype=str),
+    }
+
+
+def bit_length(x):
+    # Exact bit length of uint64 values, via two float64-exact halves
+    high = (x >> np.uint64(32)).astype(np.float64)
+    low = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+def cms_columns(hashes):
+    # One count-min column per row for each hash
+    return [
+        (mix(hashes + np.uint64(row + 1)) & np.uint64(CMS_WIDTH - 1)).astype(np.int64)
+        for row in range(CMS_DEPTH)
+    ]
+
+
+def cms_counts(sketch, hashes):
+    # Estimated occurrences of each hash (never an underestimate)
+    columns = cms_columns(hashes)
+    return np.min(
+        [sketch["cms"][row, column] for row, column in enumerate(columns)], axis=0
+    )
+
+
+def pairs_sketch(hashes, seqs_1, seqs_2):
+    # Sketch of a block of read pairs, given their hashes and a function from
+    # pair indices to sequences, so only candidate sequences are decoded
+    sketch = empty_sketch()
+    sketch["n_pairs"] = len(hashes)
+    if not len(hashes):
+        return sketch
+
+    suffix_bits = 64 - HLL_PRECISION
+    registers = (hashes >> np.uint64(suffix_bits)).astype(np.int64)
+    suffix = hashes & np.uint64(2**suffix_bits - 1)
+    # Position of the first set bit in the suffix (all zero counts as the last)
+    ranks = (suffix_bits + 1 - bit_length(suffix)).astype(np.uint8)
+    np.maximum.at(sketch["hll"], registers, ranks)
+
+    for row, column in enumerate(cms_columns(hashes)):
+        sketch["cms"][row] += np.bincount(column, minlength=CMS_WIDTH).astype(np.uint64)
+
+    # Most frequent pairs of the block are the over-representation candidates
+    unique, first, counts = np.unique(hashes, return_index=True, return_counts=True)
+    top = np.argsort(-counts, kind="stable")[:N_CANDIDATES]
+    top = top[counts[top] > 1]
+    sketch["candidate_hash"] = unique[top]
+    sketch["candidate_seq_1"] = np.array(seqs_1(first[top]), dtype=str)
+    sketch["candidate_seq_2"] = np.array(seqs_2(first[top]), dtype=str)
+    return sketch
+
+
+def merge_two(a, b):
+    merged = {
+        "n_pairs": a["n_pairs"] + b["n_pairs"],
+        "hll": np.maximum(a["hll"], b["hll"]),
+        "cms": a["cms"] + b["cms"],
+    }
+    # Keep the candidates the merged count-min sketch counts highest
+    hashes, index = np.unique(
+        np.concatenate([a["candidate_hash"], b["candidate_hash"]]), return_index=True
+    )
+    seqs_1 = np.concatenate([a["candidate_seq_1"], b["candidate_seq_1"]])[index]
+    seqs_2 = np.concatenate([a["candidate_seq_2"], b["candidate_seq_2"]])[index]
+    top = np.argsort(-cms_counts(merged, hashes), kind="stable")[:N_CANDIDATES]
+    merged["candidate_hash"] = hashes[top]
+    merged["candidate_seq_1"] = seqs_1[top]
+    merged["candidate_seq_2"] = seqs_2[top]
+    return merged
+
+
+def merge_sketches(*sketches):
+    return reduce(merge_two, sketches, empty_sketch())
+
+
+def distinct_pairs(sketch):
+    # HyperLogLog estimate, with linear counting while registers are empty
+    m = len(sketch["hll"])
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(2.0 ** -sketch["hll"].astype(np.float64))
+    empty = int(np.count_nonzero(sketch["hll"] == 0))
+    if estimate <= 2.5 * m and empty:
+        estimate = m * np.log(m / empty)
+    # Cannot exceed the number of pairs counted
+    return int(round(min(estimate, sketch["n_pairs"])))
+
+
+def overrepresented(sketch, n=10):
+    # [(read 1 sequence, read 2 sequence, estimated count)], most frequent first
+    counts = cms_counts(sketch, sketch["candidate_hash"])
+    order = np.argsort(-counts, kind="stable")[:n]
+    return [
+        (sketch["candidate_seq_1"][i], sketch["candidate_seq_2"][i], int(counts[i]))
+        for i in order
+    ]
+
+
+def duplication_stats(sketch):
+    # qc_basic_stats columns describing library complexity
+    n_pairs = sketch["n_pairs"]
+    n_distinct = distinct_pairs(sketch)
+    top = overrepresented(sketch, n=1)
+    return {
+        "n_distinct_read_pairs_approx": n_distinct,
+        "percent_duplicate_approx": (
+            100 * (1 - n_distinct / n_pairs) if n_pairs else 0.0
+        ),
+        "top_sequence": top[0][0] if top else "",
+        "top_sequence_percent": 100 * top[0][2] / n_pairs if top else 0.0,
+    }
+
+
+def save_sketch(path, sketch, **metadata):
+    arrays = dict(sketch, n_pairs=np.asarray(sketch["n_pairs"], dtype=np.int64))
+    arrays.update({key: np.asarray(value) for key, value in metadata.items()})
+    # Write to a temporary file first so readers never see a partial sketch
+    tmp_path = f"{path}.tmp.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_sketch(path):
+    with np.load(path, allow_pickle=False) as npz:
+        sketch = {key: npz[key] for key in npz.files}
+    sketch["n_pairs"] = int(sketch["n_pairs"])
+    for key, value in sketch.items():
+        if isinstance(value, np.ndarray) and value.ndim == 0:
+            sketch[key] = value.item()
+    return sketch
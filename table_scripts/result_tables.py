@@ -0,0 +1,79 @@
+import sys
+
+import pandas as pd
+
+# Column types for the merged workflow result tables. Repeated strings become
+# categoricals and counts get the narrowest type that safely holds them, so a
+# few hundred samples x tens of thousands of taxa still fit in memory.
+SCHEMAS = {
+    "kraken_reports_merged": {
+        "sample": "category",
+        "taxid": "int32",
+        "rank": "category",
+        "name": "category",
+        "n_reads_clade": "int64",
+        "n_reads_direct": "int64",
+        "n_minimizers_total": "int64",
+        "n_minimizers_distinct": "int64",
+        "pc_reads_total": "float32",
+    },
+    "qc_quality_base_stats": {
+        "sample": "category",
+        "stage": "category",
+        "file": "category",
+        "position": "int16",
+        "mean_phred_score": "float32",
+    },
+    "qc_basic_stats": {
+        "sample": "category",
+        "stage": "category",
+        "n_read_pairs": "int64",
+        "n_bases_approx": "int64",
+        "percent_gc": "float64",
+        "mean_seq_len": "float32",
+        "percent_duplicates": "float32",
+        # Added by fastq_qc.py --sketch
+        "n_distinct_read_pairs_approx": "int64",
+        "percent_duplicate_approx": "float32",
+        "top_sequence_percent": "float32",
+    },
+}
+
+
+def load_table(path, table, columns=None, engine="c", chunksize=None, report=False):
+    # Read a result table with only the requested columns, typed by SCHEMAS.
+    # engine="pyarrow" parses with Arrow and keeps Arrow-backed columns.
+    # With chunksize, returns an iterator of typed chunks instead.
+    schema = SCHEMAS[table]
+    dtype = {
+        column: column_type
+        for column, column_type in schema.items()
+        if columns is None or column in columns
+    }
+    kwargs = {}
+    if engine == "pyarrow":
+        kwargs["dtype_backend"] = "pyarrow"
+    df = pd.read_csv(
+        path,
+        sep="\t",
+        usecols=columns,
+        dtype=dtype,
+        engine=engine,
+        chunksize=chunksize,
+        **kwargs,
+    )
+    if report and chunksize is None:
+        report_footprint(table, df)
+    return df
+
+
+def footprint(df):
+    # Bytes held by df, including the contents of string columns
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def report_footprint(name, df):
+    print(
+        f"{name}: {len(df):,} rows, {footprint(df) / 2**20:,.2f} MiB in memory",
+        file=sys.stderr,
+    )
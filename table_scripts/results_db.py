@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+# One embedded SQLite database over the workflow results, so ad-hoc questions
+# ("read pairs for NovaSeq X samples in March", "virus fraction over time")
+# are indexed queries instead of another script that re-reads full TSVs.
+#
+# Tables (every row carries the sample's date, as YYYY-MM-DD):
+#   qc_basic_stats          + sequencing_machine
+#   qc_quality_base_stats   + sequencing_machine, read_pair
+#   kraken_reports          kraken_reports_merged.tsv(.gz)
+#   deliveries              delivery_metadata/*.tsv, + dataset
+# with indexes on sample, date, stage and taxid.
+#
+# Loading streams each TSV in typed chunks (result_tables.SCHEMAS) into one
+# transaction with batched inserts, and builds the indexes afterwards. The
+# database is written to a temporary file and moved into place when complete.
+#
+# Usage (from table_scripts/):
+#   ./results_db.py                          # (re)build ../data/results.sqlite
+#   ./results_db.py --sql "SELECT ..."       # run a query, print TSV
+#
+# From Python:
+#   from results_db import query
+#   query("qc_basic_stats", stage="raw_concat", sequencing_machine="NovaSeq X",
+#         date=("2024-03-01", "2024-03-31"))
+
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+from contextlib import closing
+
+import pandas as pd
+
+from kraken_reports import kraken_report_path
+from qc_basic_stats import sample_dates, sequencing_machine
+from result_tables import load_table
+
+# Setting directories
+results_dir = "../data/results"
+delivery_metadata_dir = "../delivery_metadata"
+db_path = "../data/results.sqlite"
+
+CHUNKSIZE = 500_000
+INDEXED_COLUMNS = ["sample", "date", "stage", "taxid"]
+
+
+def with_sample_columns(chunk, machine=True):
+    # Add date (and sequencing machine) columns, computed once per distinct
+    # sample rather than once per row
+    samples = pd.Series(chunk["sample"].astype(str).unique())
+    dates = sample_dates(samples)
+    chunk["date"] = (
+        chunk["sample"]
+        .astype(str)
+        .map(dict(zip(samples, dates.dt.strftime("%Y-%m-%d"))))
+    )
+    if machine:
+        chunk["sequencing_machine"] = (
+            chunk["sample"]
+            .astype(str)
+            .map(dict(zip(samples, sequencing_machine(dates))))
+        )
+    return chunk
+
+
+def result_chunks(results_dir):
+    # (table name, chunk) for every result table, in load order
+    qc_path = os.path.join(results_dir, "qc_basic_stats.tsv")
+    for chunk in pd.read_csv(qc_path, sep="\t", chunksize=CHUNKSIZE):
+        yield "qc_basic_stats", with_sample_columns(chunk)
+
+    quality_path = os.path.join(results_dir, "qc_quality_base_stats.tsv")
+    for chunk in load_table(quality_path, "qc_quality_base_stats", chunksize=CHUNKSIZE):
+        chunk = with_sample_columns(chunk)
+        # Files are named {sample}_{read pair}
+        chunk["read_pair"] = chunk["file"].astype(str).str.rsplit("_", n=1).str[-1]
+        yield "qc_quality_base_stats", chunk
+
+    kraken_path = kraken_report_path(results_dir)
+    for chunk in load_table(kraken_path, "kraken_reports_merged", chunksize=CHUNKSIZE):
+        yield "kraken_reports", with_sample_columns(chunk, machine=False)
+
+
+def delivery_chunks(delivery_metadata_dir):
+    for path in sorted(glob.glob(os.path.join(delivery_metadata_dir, "*.tsv"))):
+        deliveries = pd.read_csv(path, sep="\t", dtype=str)
+        deliveries.insert(0, "dataset", os.path.basename(path).split(".")[0])
+        yield "deliveries", deliveries
+
+
+def build_database(
+    results_dir=results_dir,
+    delivery_metadata_dir=delivery_metadata_dir,
+    db_path=db_path,
+):
+    tmp_path = f"{db_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    con = sqlite3.connect(tmp_path)
+    # A fresh file that replaces the old one only when complete, so there is
+    # nothing to recover on a crash
+    con.execute("PRAGMA journal_mode = OFF")
+    con.execute("PRAGMA synchronous = OFF")
+    counts = {}
+    with con:
+        for chunks in [
+            result_chunks(results_dir),
+            delivery_chunks(delivery_metadata_dir),
+        ]:
+            for table, chunk in chunks:
+                # Categoricals load as their values
+                chunk = chunk.astype(
+                    {
+                        column: str
+                        for column, dtype in chunk.dtypes.items()
+                        if isinstance(dtype, pd.CategoricalDtype)
+                    }
+                )
+                chunk.to_sql(
+                    table,
+                    con,
+                    if_exists="append",
+                    index=False,
+                    chunksize=50_000,
+                )
+                counts[table] = counts.get(table, 0) + len(chunk)
+        for table in counts:
+            for column in INDEXED_COLUMNS:
+                if column in table_columns(con, table):
+                    con.execute(f"CREATE INDEX {table}_{column} ON {table} ({column})")
+        con.execute("ANALYZE")
+    con.close()
+    os.replace(tmp_path, db_path)
+    return counts
+
+
+def table_columns(con, table):
+    return [row[1] for row in con.execute(f"PRAGMA table_info({table})")]
+
+
+def quoted(column):
+    return f'"{column}"'
+
+
+def where_clause(columns, where):
+    # SQL WHERE clause and parameters for keyword filters:
+    #   column=value         equality
+    #   column=[v1, v2]      membership
+    #   column=(low, high)   inclusive range; None leaves a side open
+    conditions = []
+    params = []
+    for column, value in where.items():
+        if column not in columns:
+            raise ValueError(f"Unknown column: {column}")
+        if isinstance(value, tuple):
+            low, high = value
+            if low is not None:
+                conditions.append(f"{quoted(column)} >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append(f"{quoted(column)} <= ?")
+                params.append(high)
+        elif isinstance(value, (list, set)):
+            value = list(value)
+            placeholders = ", ".join("?" * len(value))
+            conditions.append(f"{quoted(column)} IN ({placeholders})")
+            params.extend(value)
+        else:
+            conditions.append(f"{quoted(column)} = ?")
+            params.append(value)
+    if not conditions:
+        return "", params
+    return " WHERE " + " AND ".join(conditions), params
+
+
+def query(table, columns=None, order_by=None, db_path=db_path, **where):
+    # Rows of table matching the keyword filters (see where_clause), with
+    # only the requested columns. Filters run inside SQLite on its indexes.
+    with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as con:
+        known = table_columns(con, table)
+        if not known:
+            raise ValueError(f"Unknown table: {table}")
+        selected = columns or known
+        for column in selected + ([order_by] if order_by else []):
+            if column not in known:
+                raise ValueError(f"Unknown column: {column}")
+        clause, params = where_clause(known, where)
+        statement = f"SELECT {', '.join(map(quoted, selected))} FROM {table}{clause}"
+        if order_by:
+            statement += f" ORDER BY {quoted(order_by)}"
+        return pd.read_sql_query(statement, con, params=params)
+
+
+def sql(statement, params=(), db_path=db_path):
+    # Any read-only SQL statement, as a DataFrame
+    with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as con:
+        return pd.read_sql_query(statement, con, params=params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Workflow results database")
+    parser.add_argument("--results-dir", default=results_dir)
+    parser.add_argument("--delivery-metadata-dir", default=delivery_metadata_dir)
+    parser.add_argument("--db", default=db_path)
+    parser.add_argument("--sql", help="run a query instead of building")
+    args = parser.parse_args()
+    if args.sql:
+        sql(args.sql, db_path=args.db).to_csv(sys.stdout, sep="\t", index=False)
+        return
+    counts = build_database(args.results_dir, args.delivery_metadata_dir, args.db)
+    for table, n_rows in counts.items():
+        print(f"{table:<24} {n_rows:>12,} rows")
+
+
+if __name__ == "__main__":
+    main()
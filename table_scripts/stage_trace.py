@@ -0,0 +1,168 @@
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-stage timing and memory trace for the table scripts, off unless
+# TABLE_TRACE names a file to append to. Each finished stage adds one
+# tab-separated line:
+#
+#   process  cpus  realtime  cpu_time  peak_rss  rows
+#
+# process is TABLES:<script>:<stage>, cpus is CPU time / wall time, and
+# durations use Nextflow's "1h 2m 3s" / "350ms" style, so the first three
+# columns load with import_log() in figures/fig_infra_scripts/aux_functions.R
+# next to the workflow's own traces.
+#
+# build_tables.py runs each target inside traced_as(<target>), so its stages
+# are labelled with the target rather than build_tables. When targets share
+# the process concurrently, cpu_time is the stage's own thread's CPU time
+# (without worker processes or library threads), and peak_rss is the whole
+# process's high-water mark when the stage ends, since memory cannot be split
+# by thread and resetting the mark would disturb the other targets' stages.
+
+_trace_path = os.environ.get("TABLE_TRACE")
+_local = threading.local()
+_PROC_STATUS = "/proc/self/status"
+_PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+
+class Stage:
+    # Set rows to record how many rows the stage processed
+    __slots__ = ("name", "rows", "peak_rss")
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.peak_rss = 0
+
+
+# Handed out when tracing is off; attribute writes go nowhere useful
+_DISABLED = Stage("disabled")
+
+
+def enabled():
+    return _trace_path is not None
+
+
+def format_duration(seconds):
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    parts = []
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size:
+            parts.append(f"{int(seconds // size)}{unit}")
+            seconds %= size
+    parts.append(f"{seconds:.1f}s")
+    return " ".join(parts)
+
+
+def format_memory(n_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n_bytes < 1024:
+            return f"{n_bytes:.1f} {unit}"
+        n_bytes /= 1024
+    return f"{n_bytes:.1f} TB"
+
+
+def current_peak_rss():
+    # High-water mark of resident memory in bytes. On Linux this is VmHWM,
+    # which reset_peak_rss() can lower again; elsewhere the process-wide peak.
+    try:
+        with open(_PROC_STATUS) as inf:
+            for line in inf:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def reset_peak_rss():
+    try:
+        with open(_PROC_CLEAR_REFS, "w") as outf:
+            outf.write("5")
+    except OSError:
+        pass
+
+
+def process_name(name):
+    script = getattr(_local, "script", None)
+    if script is None:
+        script = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+    return f"TABLES:{script}:{name}"
+
+
+@contextmanager
+def traced_as(script, shared=False):
+    # Label this thread's stages with script instead of the command line.
+    # shared says other threads may be running stages at the same time.
+    previous = getattr(_local, "script", None), getattr(_local, "shared", False)
+    _local.script, _local.shared = script, shared
+    try:
+        yield
+    finally:
+        _local.script, _local.shared = previous
+
+
+def process_cpu_time():
+    # CPU time of this process and of its finished child processes
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+@contextmanager
+def stage(name):
+    # Time a named stage of a table build:
+    #   with stage("read_csv") as s:
+    #       df = ...
+    #       s.rows = len(df)
+    if _trace_path is None:
+        yield _DISABLED
+        return
+
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    shared = getattr(_local, "shared", False)
+    if shared:
+        # Per-thread CPU time, and the process-wide peak left as it is
+        cpu_time = time.thread_time
+    else:
+        # Fold the peak so far into the enclosing stage before resetting it
+        if stack:
+            stack[-1].peak_rss = max(stack[-1].peak_rss, current_peak_rss())
+        reset_peak_rss()
+        cpu_time = process_cpu_time
+
+    record = Stage(name)
+    stack.append(record)
+    wall_start = time.perf_counter()
+    cpu_start = cpu_time()
+    try:
+        yield record
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = cpu_time() - cpu_start
+        stack.pop()
+        record.peak_rss = max(record.peak_rss, current_peak_rss())
+        if stack:
+            stack[-1].peak_rss = max(stack[-1].peak_rss, record.peak_rss)
+        write_record(record, wall, cpu)
+
+
+def write_record(record, wall, cpu):
+    fields = [
+        process_name(record.name),
+        f"{cpu / wall if wall > 0 else 0:.2f}",
+        format_duration(wall),
+        format_duration(cpu),
+        format_memory(record.peak_rss),
+        "" if record.rows is None else str(record.rows),
+    ]
+    # One short write per line, so appends from concurrent processes don't mix
+    with open(_trace_path, "a") as outf:
+        outf.write("\t".join(fields) + "\n")
@@ -1,60 +1,72 @@
 #!/usr/bin/env python3
 
 # Imports
-import pandas as pd
-import numpy as np
-from datetime import datetime
+import argparse
+from qc_basic_stats import load_qc_basic_stats
+from qc_summary import basic_stats_from_summaries
+from stage_trace import stage
+from table_output import percent, scaled, write_table
 
 # Setting directories and S3 buckets
 workflow_results_dir = "../data/results"
 delivery_metadata_dir = "../data"
 table_dir = "../tables"
 
-basic_stats = pd.read_csv(f"{workflow_results_dir}/qc_basic_stats.tsv", sep="\t")
-basic_stats["date"] = pd.to_datetime(
-    basic_stats["sample"].str.split("-").str[1:4].str.join("-")
-)
-basic_stats["sequencing_machine"] = np.where(
-    basic_stats["date"] >= datetime(2024, 2, 25),
-    "NovaSeq X",
-    "NovaSeq 6000",
-)
-
-basic_stats = basic_stats[basic_stats["stage"] == "raw_concat"]
-
-basic_stats_summary = (
-    basic_stats.groupby(["sequencing_machine"])
-    .agg(
-        total_read_pairs=("n_read_pairs", "sum"),
-        mean_gc_content=("percent_gc", "mean"),
-        total_bases=("n_bases_approx", "sum"),
-        n_samples=("sample", "nunique"),
-        date_range=("date", lambda x: f"{x.min().date()} to {x.max().date()}"),
+
+def summary_table(basic_stats):
+    # Table 1 from raw_concat rows with date and sequencing_machine columns
+    basic_stats_summary = (
+        basic_stats.groupby(["sequencing_machine"])
+        .agg(
+            total_read_pairs=("n_read_pairs", "sum"),
+            mean_gc_content=("percent_gc", "mean"),
+            total_bases=("n_bases_approx", "sum"),
+            n_samples=("sample", "nunique"),
+            date_range=("date", lambda x: f"{x.min().date()} to {x.max().date()}"),
+        )
+        .reset_index()
+    )
+
+    basic_stats_summary["# Bases"] = scaled(basic_stats_summary["total_bases"], "T")
+    basic_stats_summary["# Reads"] = scaled(
+        basic_stats_summary["total_read_pairs"], "B"
     )
-    .reset_index()
-)
-
-basic_stats_summary["# Bases"] = basic_stats_summary["total_bases"].apply(
-    lambda x: f"{x / 1e12:.2f}T"
-)
-basic_stats_summary["# Reads"] = basic_stats_summary["total_read_pairs"].apply(
-    lambda x: f"{x / 1e9:.2f}B"
-)
-basic_stats_summary["# Samples"] = basic_stats_summary["n_samples"]
-basic_stats_summary["GC Content"] = basic_stats_summary["mean_gc_content"].apply(
-    lambda x: f"{x:.2f}%"
-)
-basic_stats_summary["Date Range"] = basic_stats_summary["date_range"]
-basic_stats_summary = basic_stats_summary[
-    [
-        "sequencing_machine",
-        "# Samples",
-        "Date Range",
-        "# Reads",
-        "# Bases",
-        "GC Content",
+    basic_stats_summary["# Samples"] = basic_stats_summary["n_samples"]
+    basic_stats_summary["GC Content"] = percent(basic_stats_summary["mean_gc_content"])
+    basic_stats_summary["Date Range"] = basic_stats_summary["date_range"]
+    return basic_stats_summary[
+        [
+            "sequencing_machine",
+            "# Samples",
+            "Date Range",
+            "# Reads",
+            "# Bases",
+            "GC Content",
+        ]
     ]
-]
 
-basic_stats_summary.to_csv(f"{table_dir}/table_1.tsv", sep="\t", index=False)
-exit()
+
+def generate_table(summary_dir=None):
+    with stage("load") as s:
+        if summary_dir is None:
+            basic_stats = load_qc_basic_stats(workflow_results_dir)
+            basic_stats = basic_stats[basic_stats["stage"] == "raw_concat"]
+        else:
+            # Per-sample rows merged from per-file QC summaries (fastq_qc.py)
+            basic_stats = basic_stats_from_summaries(summary_dir, stage="raw_concat")
+        s.rows = len(basic_stats)
+
+    basic_stats_summary = summary_table(basic_stats)
+
+    with stage("write") as s:
+        write_table(basic_stats_summary, f"{table_dir}/table_1.tsv")
+        s.rows = len(basic_stats_summary)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--summary-dir", help="build from QC summaries instead of qc_basic_stats"
+    )
+    args = parser.parse_args()
+    generate_table(args.summary_dir)
@@ -0,0 +1,18 @@
+from datetime import datetime
+
+# Constants shared by the table scripts. This module imports nothing heavy, so
+# input_checks.py, and through it create_biosample_table.py, can use it
+# without loading pandas.
+
+# Samples collected on or after this date were sequenced on a NovaSeq X
+NOVASEQ_X_START = datetime(2024, 2, 25)
+
+# Top-level taxids used for domain relative abundances
+DOMAIN_TAX_IDS = {
+    "Bacteria": 2,
+    "Viruses": 10239,
+    "Archaea": 2157,
+    "Eukaryota": 2759,
+    "Unclassified": 0,
+    "Classified": 1,
+}
@@ -0,0 +1,185 @@
+import csv
+import os
+
+# Shared column formatting and writing for the table scripts. Each formatter
+# takes a whole column (Series, array or list) and returns an object array of
+# strings. The scaling and unit choice are done once for the whole column,
+# and _fixed_point() writes the digits of every value at once with numpy
+# array arithmetic. The printed digits are the ones format() prints with the
+# spec the scripts used row by row, so they do not change.
+#
+# write_table() writes a finished table with one bulk call per format. The
+# TSV is always written. TABLE_FORMATS can add comma-separated extra formats
+# ("parquet", "xlsx"), written next to the TSV under the same name. Parquet
+# needs pyarrow and Excel needs openpyxl; neither is imported unless asked for.
+# A table can also be a dict of column lists, written with the csv module, so
+# create_biosample_table.py runs without pandas. numpy and pandas are imported
+# inside the functions that use them for the same reason.
+#
+# Tables can gain columns after they are written (fastq_manifest.py adds MD5
+# checksums to the SRA table). with_extra_columns() carries such columns over
+# when a table is rebuilt, for updates that must not drop them.
+
+UNITS = {"": 1, "K": 1e3, "M": 1e6, "B": 1e9, "T": 1e12}
+EXTRA_FORMATS = {"parquet": ".parquet", "xlsx": ".xlsx"}
+
+_formats = [
+    fmt.strip() for fmt in os.environ.get("TABLE_FORMATS", "").split(",") if fmt.strip()
+]
+
+
+def _fixed_point(values, decimals, thousands=False, suffix=""):
+    # format(value, ",.{decimals}f") + suffix for a float64 column, without a
+    # Python call per value. Each value is rounded to a whole number of
+    # 10**-decimals, and its sign, digits, separators, point and suffix are
+    # written into a character matrix viewed as one string per row. Values
+    # within rounding error of a tie, beyond 2**53 or not finite are rare and
+    # formatted one by one, so every digit matches format().
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return np.array([], dtype=object)
+    scaled = np.abs(values) * 10.0**decimals
+    exact = np.isfinite(scaled) & (scaled < 2**53)
+    scaled = np.where(exact, scaled, 0)
+    exact &= np.abs(scaled % 1 - 0.5) > scaled * 1e-15
+    units = np.rint(np.where(exact, scaled, 0)).astype(np.int64)
+    whole, fraction = np.divmod(units, 10**decimals)
+
+    def offset(j):
+        # Columns from the units digit to digit j, counting separators
+        return j + j // 3 if thousands else j
+
+    max_digits = len(str(whole.max()))
+    n_digits = np.ones(len(values), dtype=np.int64)
+    for j in range(1, max_digits):
+        n_digits += whole >= 10**j
+    # Padding and sign, integer digits, then point, fraction and suffix
+    width = offset(max_digits - 1) + 2
+    chars = np.full(
+        (len(values), width + (decimals + 1 if decimals else 0) + len(suffix)),
+        ord(" "),
+        dtype=np.uint32,
+    )
+    for j in range(max_digits):
+        shown = j < n_digits
+        column = width - 1 - offset(j)
+        chars[:, column] = np.where(shown, ord("0") + whole // 10**j % 10, ord(" "))
+        if thousands and j and j % 3 == 0:
+            chars[:, column + 1] = np.where(shown, ord(","), ord(" "))
+    negative = np.flatnonzero(np.signbit(values))
+    chars[negative, width - 2 - offset(n_digits[negative] - 1)] = ord("-")
+    if decimals:
+        chars[:, width] = ord(".")
+        for k in range(decimals):
+            chars[:, width + 1 + k] = (
+                ord("0") + fraction // 10 ** (decimals - 1 - k) % 10
+            )
+    for k, char in enumerate(suffix):
+        chars[:, chars.shape[1] - len(suffix) + k] = ord(char)
+    text = np.char.lstrip(chars.view(f"U{chars.shape[1]}").ravel(), " ")
+    text = text.astype(object)
+
+    inexact = np.flatnonzero(~exact)
+    spec = ("," if thousands else "") + f".{decimals}f"
+    text[inexact] = [format(value, spec) + suffix for value in values[inexact].tolist()]
+    return text
+
+
+def scaled(values, unit, decimals=2, thousands=False):
+    # 1234567890 -> "1.23B" for unit "B"; thousands adds "," separators
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64) / UNITS[unit]
+    return _fixed_point(values, decimals, thousands, unit)
+
+
+def percent(values, decimals=2, fraction=False, thousands=False):
+    # 47.4 -> "47.40%"; with fraction=True, 0.474 -> "47.40%" ("{:.2%}"
+    # multiplies by 100 the same way)
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    if fraction:
+        values = values * 100
+    return _fixed_point(values, decimals, thousands, "%")
+
+
+def read_counts(values, decimals=2):
+    # Table S1 rule: billions above 1e9 reads, millions otherwise
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    formatted = np.empty(len(values), dtype=object)
+    billions = values > 1e9
+    formatted[billions] = scaled(values[billions], "B", decimals)
+    formatted[~billions] = scaled(values[~billions], "M", decimals)
+    return formatted
+
+
+def table_paths(path, formats=None):
+    # {format: path} for every file write_table() produces
+    formats = _formats if formats is None else formats
+    unknown = [fmt for fmt in formats if fmt not in EXTRA_FORMATS]
+    if unknown:
+        raise ValueError(
+            f"Unknown table format(s) {', '.join(unknown)}; "
+            f"choose from {', '.join(EXTRA_FORMATS)}"
+        )
+    stem = path[: -len(".tsv")] if path.endswith(".tsv") else path
+    paths = {"tsv": path}
+    paths.update({fmt: stem + EXTRA_FORMATS[fmt] for fmt in formats})
+    return paths
+
+
+def write_columns(columns, path):
+    # {column: values} as TSV, quoted the way DataFrame.to_csv() quotes
+    with open(path, "w", newline="") as outf:
+        writer = csv.writer(outf, delimiter="\t", lineterminator="\n")
+        writer.writerow(columns)
+        writer.writerows(zip(*columns.values()))
+
+
+def write_table(table, path, formats=None):
+    # Write a DataFrame, or a dict of column lists, as TSV, plus any extra
+    # formats (TABLE_FORMATS by default). Returns the paths written.
+    paths = table_paths(path, formats)
+    if isinstance(table, dict):
+        write_columns(table, paths["tsv"])
+        if len(paths) == 1:
+            return paths
+        import pandas as pd
+
+        table = pd.DataFrame(table)
+    else:
+        table.to_csv(paths["tsv"], sep="\t", index=False)
+    if "parquet" in paths:
+        table.to_parquet(paths["parquet"], index=False)
+    if "xlsx" in paths:
+        table.to_excel(paths["xlsx"], index=False)
+    return paths
+
+
+def read_table(path):
+    # A written TSV with every field as the string it was written as
+    import pandas as pd
+
+    return pd.read_csv(path, sep="\t", dtype=str, keep_default_na=False)
+
+
+def with_extra_columns(table, existing, key):
+    # table plus the columns of existing (a read_table() frame, or None) that
+    # it lacks, matched on the key column. Rows not in existing leave them
+    # empty. Columns keep existing's order, with new ones at the end.
+    if existing is None:
+        return table
+    extra = [column for column in existing.columns if column not in table.columns]
+    if not extra:
+        return table
+    values = existing.drop_duplicates(key, keep="last").set_index(key)[extra]
+    table = table.join(values, on=key)
+    table[extra] = table[extra].fillna("")
+    columns = [column for column in existing.columns if column in table.columns]
+    columns += [column for column in table.columns if column not in existing.columns]
+    return table[columns]
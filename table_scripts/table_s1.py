@@ -4,6 +4,9 @@
 
 import os
 import pandas as pd
+from qc_basic_stats import load_qc_basic_stats
+from stage_trace import stage
+from table_output import read_counts, write_table
 
 # Setting directories and S3 buckets
 data_dir = "../data"
@@ -13,51 +16,37 @@ table_dir = "../tables"
 os.makedirs(table_dir, exist_ok=True)
 
 
+def table_s1_rows(metadata):
+    # Table S1 rows from qc_basic_stats rows with a date column
+    # One row per sample, in order of first appearance, with the values of its
+    # last row
+    samples = metadata.groupby("sample", sort=False, observed=True)[
+        ["date", "n_read_pairs"]
+    ].last()
+    return pd.DataFrame(
+        {
+            "Sample": samples.index.astype(str),
+            "Country": "United States",
+            "State": "California",
+            "County": "Los Angeles County",
+            "City": "Los Angeles",
+            "Treatment Plant": "Hyperion Treatment Plant",
+            "Date": samples["date"].dt.strftime("%Y-%m-%d").to_numpy(),
+            "Reads": read_counts(samples["n_read_pairs"]),
+        }
+    )
+
+
 def start():
 
-    metadata = pd.read_csv(os.path.join(results_dir, "qc_basic_stats.tsv"), sep="\t")
-    metadata["date"] = metadata["sample"].str.split("-").str[1:4].str.join("-")
-    # Create dictionary mapping sample to date
-    sample_to_date = dict(zip(metadata["sample"], metadata["date"]))
-    sample_to_n_read_pairs = dict(zip(metadata["sample"], metadata["n_read_pairs"]))
+    with stage("load") as s:
+        metadata = load_qc_basic_stats(results_dir)
+        s.rows = len(metadata)
+    table_s1 = table_s1_rows(metadata)
 
-    with open(f"{table_dir}/table_s1.tsv", "w") as outf:
-        outf.write(
-            "\t".join(
-                [
-                    "Sample",
-                    "Country",
-                    "State",
-                    "County",
-                    "City",
-                    "Treatment Plant",
-                    "Date",
-                    "Reads",
-                ]
-            )
-            + "\n"
-        )
-        for name, date in sample_to_date.items():
-            n_read_pairs = sample_to_n_read_pairs[name]
-            if n_read_pairs > 1e9:
-                n_read_pairs = f"{n_read_pairs / 1e9:.2f}B"
-            else:
-                n_read_pairs = f"{n_read_pairs / 1e6:.2f}M"
-            outf.write(
-                "\t".join(
-                    [
-                        name,
-                        "United States",
-                        "California",
-                        "Los Angeles County",
-                        "Los Angeles",
-                        "Hyperion Treatment Plant",
-                        date,
-                        n_read_pairs,
-                    ]
-                )
-                + "\n"
-            )
+    with stage("write") as s:
+        write_table(table_s1, f"{table_dir}/table_s1.tsv")
+        s.rows = len(table_s1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# Precomputed taxonomy index replacing the iterative add_descendent_taxids and
+# raise_rank loops in figures/fig_infra_scripts/aux_functions.R.
+#
+# Nodes are stored as parallel arrays (taxid, parent, rank, depth) plus a
+# pre-order interval encoding: node i's subtree is exactly the nodes whose
+# pre-order number falls in [tin[i], tout[i]). Descendant queries are then an
+# array slice, and ancestor-at-rank lookups are one array per rank, built
+# level by level and cached.
+#
+# Usage (from table_scripts/):
+#   ./taxonomy_index.py /path/to/nodes.dmp   # writes ../data/taxonomy_index.npz
+
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+index_path = "../data/taxonomy_index.npz"
+
+
+def read_nodes(path):
+    # NCBI nodes.dmp, or a TSV taxonomy table with taxid, parent_taxid and rank
+    # columns as used by aux_functions.R
+    if path.endswith(".dmp"):
+        nodes = pd.read_csv(
+            path,
+            sep="\t",
+            header=None,
+            usecols=[0, 2, 4],
+            names=["taxid", "parent_taxid", "rank"],
+            dtype={"taxid": np.int64, "parent_taxid": np.int64, "rank": str},
+        )
+    else:
+        nodes = pd.read_csv(
+            path,
+            sep="\t",
+            usecols=["taxid", "parent_taxid", "rank"],
+            dtype={"taxid": np.int64, "parent_taxid": np.int64, "rank": str},
+        )
+    return nodes
+
+
+class TaxonomyIndex:
+    def __init__(self, taxids, parents, rank_codes, rank_names, depth, tin, tout):
+        self.taxids = taxids
+        # Row index of each node's parent; roots point at themselves
+        self.parents = parents
+        self.rank_codes = rank_codes
+        self.rank_names = list(rank_names)
+        self.depth = depth
+        self.tin = tin
+        self.tout = tout
+        # Dense taxid -> row lookup; NCBI taxids are small enough for this
+        self.rows = np.full(int(taxids.max()) + 1, -1, dtype=np.int32)
+        self.rows[taxids] = np.arange(len(taxids), dtype=np.int32)
+        self.preorder = np.argsort(tin).astype(np.int32)
+        self._levels = None
+        self._rank_ancestors = {}
+
+    @classmethod
+    def from_nodes(cls, nodes):
+        taxids = nodes["taxid"].to_numpy(np.int32)
+        rank_codes, rank_names = pd.factorize(nodes["rank"])
+        rows = np.full(int(taxids.max()) + 1, -1, dtype=np.int32)
+        rows[taxids] = np.arange(len(taxids), dtype=np.int32)
+        parent_taxids = nodes["parent_taxid"].to_numpy()
+        known = (parent_taxids >= 0) & (parent_taxids < len(rows))
+        parents = np.full(len(taxids), -1, dtype=np.int32)
+        parents[known] = rows[parent_taxids[known]]
+        roots = parents < 0  # Parent not in the table: treat as a root
+        parents[roots] = np.flatnonzero(roots)
+
+        depth = node_depths(parents)
+        size = subtree_sizes(parents, depth)
+        tin = preorder_numbers(parents, depth, size, taxids)
+        return cls(
+            taxids,
+            parents,
+            rank_codes.astype(np.int16),
+            rank_names,
+            depth,
+            tin,
+            tin + size,
+        )
+
+    @classmethod
+    def load(cls, path=index_path):
+        with np.load(path, allow_pickle=False) as npz:
+            return cls(
+                npz["taxids"],
+                npz["parents"],
+                npz["rank_codes"],
+                npz["rank_names"],
+                npz["depth"],
+                npz["tin"],
+                npz["tout"],
+            )
+
+    def save(self, path=index_path):
+        np.savez(
+            path,
+            taxids=self.taxids,
+            parents=self.parents,
+            rank_codes=self.rank_codes,
+            rank_names=np.array(self.rank_names),
+            depth=self.depth,
+            tin=self.tin,
+            tout=self.tout,
+        )
+
+    def row_of(self, taxids):
+        # Row index for each taxid, -1 for taxids not in the taxonomy
+        taxids = np.asarray(taxids, dtype=np.int64)
+        in_range = (taxids >= 0) & (taxids < len(self.rows))
+        rows = np.full(taxids.shape, -1, dtype=np.int32)
+        rows[in_range] = self.rows[taxids[in_range]]
+        return rows
+
+    def descendants(self, taxid):
+        # All taxids in the subtree rooted at taxid, including taxid itself
+        row = self.row_of([taxid])[0]
+        if row < 0:
+            return np.array([], dtype=self.taxids.dtype)
+        return self.taxids[self.preorder[self.tin[row] : self.tout[row]]]
+
+    def add_descendant_taxids(self, taxids):
+        # Same result as add_descendent_taxids in aux_functions.R
+        parts = [self.descendants(taxid) for taxid in np.unique(taxids)]
+        return np.unique(np.concatenate(parts)) if parts else np.array([], np.int32)
+
+    def is_descendant(self, taxids, ancestor):
+        # Boolean mask: which taxids lie in ancestor's subtree (inclusive)
+        rows = self.row_of(taxids)
+        anc = self.row_of([ancestor])[0]
+        if anc < 0:
+            return np.zeros(rows.shape, dtype=bool)
+        tin = self.tin[rows]
+        return (rows >= 0) & (tin >= self.tin[anc]) & (tin < self.tout[anc])
+
+    def levels(self):
+        if self._levels is None:
+            self._levels = depth_levels(self.depth)
+        return self._levels
+
+    def rank_ancestors(self, rank):
+        # Row of each node's nearest ancestor-or-self at rank, -1 if none
+        if rank not in self._rank_ancestors:
+            if rank in self.rank_names:
+                code = self.rank_names.index(rank)
+                ancestors = np.where(
+                    self.rank_codes == code, np.arange(len(self.taxids)), -1
+                ).astype(np.int32)
+            else:
+                ancestors = np.full(len(self.taxids), -1, dtype=np.int32)
+            for level in self.levels()[1:]:
+                unset = level[ancestors[level] < 0]
+                ancestors[unset] = ancestors[self.parents[unset]]
+            self._rank_ancestors[rank] = ancestors
+        return self._rank_ancestors[rank]
+
+    def ancestor_at_rank(self, taxids, rank):
+        # Taxid of each taxid's ancestor at rank, -1 if it has none
+        rows = self.row_of(taxids)
+        ancestors = np.full(rows.shape, -1, dtype=np.int64)
+        found = rows >= 0
+        anc_rows = self.rank_ancestors(rank)[rows[found]]
+        ancestors[found] = np.where(anc_rows >= 0, self.taxids[anc_rows], -1)
+        return ancestors
+
+    def raise_rank(self, taxids, rank="species"):
+        # Roll taxids up to rank. Taxids already at or above rank, or not in
+        # the taxonomy, are returned unchanged, as in raise_rank in
+        # aux_functions.R.
+        taxids = np.asarray(taxids, dtype=np.int64)
+        ancestors = self.ancestor_at_rank(taxids, rank)
+        return np.where(ancestors >= 0, ancestors, taxids)
+
+
+def node_depths(parents):
+    # Distance to the root by pointer jumping: O(log depth) array passes.
+    # Invariant: depth[i] is the distance from i to jump[i].
+    depth = (parents != np.arange(len(parents))).astype(np.int32)
+    jump = parents.copy()
+    # Jumps double each pass, so this many passes reach the root of any chain
+    for _ in range(len(parents).bit_length() + 1):
+        next_jump = jump[jump]
+        if np.array_equal(next_jump, jump):
+            break
+        depth = depth + depth[jump]
+        jump = next_jump
+    # A node that has not reached a root lies on or below a parent cycle
+    cyclic = parents[jump] != jump
+    if cyclic.any():
+        raise ValueError(
+            f"Taxonomy has a parent cycle: {cyclic.sum()} nodes never reach a root"
+        )
+    return depth
+
+
+def depth_levels(depth):
+    # Row indices grouped by depth, root level first
+    order = np.argsort(depth, kind="stable")
+    bounds = np.searchsorted(depth[order], np.arange(int(depth.max()) + 2))
+    return [order[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def subtree_sizes(parents, depth):
+    size = np.ones(len(parents), dtype=np.int64)
+    for level in reversed(depth_levels(depth)[1:]):
+        np.add.at(size, parents[level], size[level])
+    return size
+
+
+def preorder_numbers(parents, depth, size, taxids):
+    # Children are laid out after their parent in taxid order, each taking a
+    # block as large as its subtree
+    n = len(parents)
+    is_child = parents != np.arange(n)
+    children = np.flatnonzero(is_child)
+    children = children[np.lexsort((taxids[children], parents[children]))]
+    child_sizes = size[children]
+    block_end = np.cumsum(child_sizes)
+    group_start = np.r_[True, parents[children][1:] != parents[children][:-1]]
+    group_offset = np.maximum.accumulate(
+        np.where(group_start, block_end - child_sizes, 0)
+    )
+    offset = np.zeros(n, dtype=np.int64)
+    offset[children] = block_end - child_sizes - group_offset
+
+    # Roots are laid out one after the other
+    tin = np.zeros(n, dtype=np.int64)
+    roots = np.flatnonzero(~is_child)
+    tin[roots] = np.cumsum(size[roots]) - size[roots]
+    for level in depth_levels(depth)[1:]:
+        tin[level] = tin[parents[level]] + 1 + offset[level]
+    return tin
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the taxonomy index")
+    parser.add_argument("nodes", help="nodes.dmp or a taxid/parent_taxid/rank TSV")
+    parser.add_argument("-o", "--output", default=index_path)
+    args = parser.parse_args()
+    try:
+        TaxonomyIndex.from_nodes(read_nodes(args.nodes)).save(args.output)
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+
+# Incremental table update for newly delivered samples.
+#
+# qc_basic_stats.tsv and kraken_reports_merged.tsv(.gz) only ever grow: a
+# delivery appends the new samples' rows (to the gzipped report as a new gzip
+# member). ../tables/.incremental_state.json keeps per-sample partial
+# aggregates (QC rows, domain read counts) and how far each source has been
+# read. An update parses only the bytes added since the last run, checks the
+# samples they touch with input_checks.py, folds them into the state, and
+# appends the new samples' rows to tables S1, S2, BioSample and SRA. A table
+# is rewritten only when rows already in it change. Table 1 is rewritten from
+# the state every time.
+#
+# A source that was rewritten rather than appended to is re-read in full. Rows
+# are built by the functions table_1.py, table_s1.py, table_s2.py,
+# create_biosample_table.py and create_sra_table.py use and written through
+# write_table(), so the tables match theirs, including any TABLE_FORMATS
+# copies. Columns added to a table since it was written (fastq_manifest.py's
+# MD5 checksums in the SRA table) are kept.
+#
+# The new bytes are parsed with the standard library rather than re-loading
+# whole results, so a weekly update takes about a second.
+#
+# Usage (from table_scripts/):
+#   ./update_tables.py
+
+import argparse
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+
+import pandas as pd
+
+from create_biosample_table import bio_sample_rows
+from create_sra_table import sra_rows
+from input_checks import check, clade_count_violations, qc_basic_stats_violations
+from kraken_reports import domain_relative_abundance, read_clade_counts
+from qc_basic_stats import sample_dates, sequencing_machine
+from table_1 import summary_table
+from table_constants import DOMAIN_TAX_IDS
+from table_output import read_table, table_paths, with_extra_columns, write_table
+from table_s1 import table_s1_rows
+from table_s2 import table_s2_rows
+
+# Setting directories
+results_dir = "../data/results"
+table_dir = "../tables"
+state_path = f"{table_dir}/.incremental_state.json"
+
+STATE_VERSION = 2
+# A source counts as appended to if CHECK_BLOCKS blocks spread evenly over
+# the part already read, including its first and last bytes, are unchanged.
+# Use --full after editing a source in place.
+CHECK_BLOCK_SIZE = 4096
+CHECK_BLOCKS = 16
+# Fields of a qc_basic_stats row kept in the state, after the sample
+QC_COLUMNS = ["stage", "n_read_pairs", "n_bases_approx", "percent_gc", "mean_seq_len"]
+
+
+def empty_state():
+    return {
+        "version": STATE_VERSION,
+        "sources": {},
+        "qc_samples": {},
+        "kraken_samples": {},
+    }
+
+
+def load_state(path=state_path):
+    if not os.path.exists(path):
+        return empty_state()
+    with open(path) as inf:
+        state = json.load(inf)
+    if state.get("version") != STATE_VERSION:
+        return empty_state()
+    return state
+
+
+def save_state(state, path=state_path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as outf:
+        json.dump(state, outf, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def prefix_digest(path, offset):
+    # Hash of sample blocks of the first offset bytes of path
+    digest = hashlib.sha256()
+    last_start = max(0, offset - CHECK_BLOCK_SIZE)
+    with open(path, "rb") as inf:
+        for i in range(CHECK_BLOCKS):
+            start = last_start * i // (CHECK_BLOCKS - 1)
+            inf.seek(start)
+            digest.update(inf.read(min(CHECK_BLOCK_SIZE, offset - start)))
+    return digest.hexdigest()
+
+
+def appended_offset(path, source):
+    # Offset to resume reading path from, or 0 if it must be read in full
+    if not source or source["path"] != os.path.abspath(path):
+        return 0
+    offset = source["offset"]
+    if (
+        os.path.getsize(path) < offset
+        or prefix_digest(path, offset) != source["digest"]
+    ):
+        return 0
+    if path.endswith(".gz") and os.path.getsize(path) > offset:
+        # Appended data must start a new gzip member
+        with open(path, "rb") as inf:
+            inf.seek(offset)
+            if inf.read(2) != b"\x1f\x8b":
+                return 0
+    return offset
+
+
+def read_rows(path, offset, header):
+    # Rows added to a TSV after offset, as dicts, plus the header and the
+    # offset reached. header is None when reading from the start.
+    with open(path, "rb") as raw:
+        raw.seek(offset)
+        stream = gzip.GzipFile(fileobj=raw) if path.endswith(".gz") else raw
+        reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8"), delimiter="\t")
+        rows = []
+        for row in reader:
+            if header is None:
+                header = row
+            elif row != header:  # Appended gzip members may repeat the header
+                rows.append(dict(zip(header, row)))
+        end = raw.tell()
+    return rows, header, end
+
+
+def source_record(path, offset, header):
+    return {
+        "path": os.path.abspath(path),
+        "offset": offset,
+        "digest": prefix_digest(path, offset),
+        "header": header,
+    }
+
+
+def update_qc(state, path):
+    # Fold new qc_basic_stats rows into the state. Returns the new samples,
+    # the samples that gained rows, the new cleaned rows' samples, and whether
+    # the file was re-read from the start.
+    source = state["sources"].get("qc")
+    offset = appended_offset(path, source)
+    if offset == 0:
+        state["qc_samples"] = {}
+        source = None
+    rows, header, end = read_rows(path, offset, source and source["header"])
+
+    samples = state["qc_samples"]
+    new_samples, changed_samples, cleaned = [], [], []
+    for row in rows:
+        sample = row["sample"]
+        values = [
+            row["stage"],
+            int(row["n_read_pairs"]),
+            int(row["n_bases_approx"]),
+            float(row["percent_gc"]),
+            # Missing from results written before it was reported
+            float(row["mean_seq_len"]) if "mean_seq_len" in row else None,
+        ]
+        if sample not in samples:
+            samples[sample] = []
+            new_samples.append(sample)
+        elif sample not in new_samples and sample not in changed_samples:
+            changed_samples.append(sample)
+        samples[sample].append(values)
+        if row["stage"] == "cleaned":
+            cleaned.append(sample)
+    state["sources"]["qc"] = source_record(path, end, header)
+    return new_samples, changed_samples, cleaned, offset == 0
+
+
+def read_all_clade_counts(path):
+    # Whole-report read through the chunked pandas reader
+    counts = read_clade_counts(path, tax_ids=list(DOMAIN_TAX_IDS.values()))
+    samples = {}
+    for sample, taxid, n_reads in zip(
+        counts["sample"].astype(str), counts["taxid"], counts["n_reads_clade"]
+    ):
+        samples.setdefault(sample, {})[str(taxid)] = int(n_reads)
+    return samples
+
+
+def update_kraken(state, path):
+    # Fold new Kraken report rows into the per-sample domain counts. Returns
+    # the new samples, the samples whose counts changed, and whether the
+    # report was re-read from the start.
+    source = state["sources"].get("kraken")
+    offset = appended_offset(path, source)
+    if offset == 0:
+        end = os.path.getsize(path)
+        state["kraken_samples"] = read_all_clade_counts(path)
+        with (gzip.open if path.endswith(".gz") else open)(path, "rt") as inf:
+            header = inf.readline().rstrip("\n").split("\t")
+        state["sources"]["kraken"] = source_record(path, end, header)
+        return list(state["kraken_samples"]), [], True
+
+    rows, header, end = read_rows(path, offset, source["header"])
+    tax_ids = {str(tax_id) for tax_id in DOMAIN_TAX_IDS.values()}
+    samples = state["kraken_samples"]
+    new_samples, changed_samples = [], []
+    for row in rows:
+        # Samples without any domain rows get no S2 row, as in table_s2.py
+        if row["taxid"] not in tax_ids:
+            continue
+        sample = row["sample"]
+        if sample not in samples:
+            samples[sample] = {}
+            new_samples.append(sample)
+        elif sample not in new_samples and sample not in changed_samples:
+            changed_samples.append(sample)
+        counts = samples[sample]
+        counts[row["taxid"]] = counts.get(row["taxid"], 0) + int(row["n_reads_clade"])
+    state["sources"]["kraken"] = source_record(path, end, header)
+    return new_samples, changed_samples, False
+
+
+def qc_rows(state, samples):
+    # The state's qc_basic_stats rows of samples, as read from the file
+    basic_stats = pd.DataFrame(
+        [
+            [sample] + values
+            for sample in samples
+            for values in state["qc_samples"][sample]
+        ],
+        columns=["sample"] + QC_COLUMNS,
+    )
+    if basic_stats["mean_seq_len"].isna().all():
+        basic_stats = basic_stats.drop(columns="mean_seq_len")
+    return basic_stats
+
+
+def dated_qc_rows(state, samples):
+    # qc_rows() with the columns load_qc_basic_stats() adds
+    basic_stats = qc_rows(state, samples)
+    basic_stats["date"] = sample_dates(basic_stats["sample"])
+    basic_stats["sequencing_machine"] = sequencing_machine(basic_stats["date"])
+    return basic_stats
+
+
+def clade_rows(state, samples):
+    # The state's domain read counts of samples, as read_clade_counts() rows
+    return pd.DataFrame(
+        [
+            [sample, int(taxid), n_reads]
+            for sample in samples
+            for taxid, n_reads in state["kraken_samples"][sample].items()
+        ],
+        columns=["sample", "taxid", "n_reads_clade"],
+    )
+
+
+def update_table(name, key, rows, samples, new_samples, rewrite):
+    # Append rows(new_samples), or rewrite the whole table as rows(samples)
+    # when asked to or when the new rows' columns are not all in the file.
+    # Columns only the file has are kept, matched on the key column.
+    path = os.path.join(table_dir, name)
+    written = all(os.path.exists(p) for p in table_paths(path).values())
+    if not rewrite and not new_samples and written:
+        return "unchanged"
+    existing = read_table(path) if os.path.exists(path) else None
+    table = None
+    if existing is not None and not rewrite:
+        if not new_samples:
+            # Only a format added to TABLE_FORMATS since the last write is missing
+            table, result = existing, "unchanged"
+        else:
+            new_rows = rows(new_samples)
+            if set(new_rows.columns) <= set(existing.columns):
+                table = pd.concat(
+                    [existing[new_rows.columns], new_rows], ignore_index=True
+                )
+                result = f"{len(new_rows)} rows appended"
+    if table is None:
+        table, result = rows(samples), "rewritten"
+    write_table(with_extra_columns(table, existing, key), path)
+    return result
+
+
+def update_tables(results_dir=results_dir, full=False):
+    os.makedirs(table_dir, exist_ok=True)
+    state = empty_state() if full else load_state()
+    kraken_path = os.path.join(results_dir, "kraken_reports_merged.tsv")
+    if os.path.exists(kraken_path + ".gz"):
+        kraken_path += ".gz"
+
+    qc_path = os.path.join(results_dir, "qc_basic_stats.tsv")
+    qc_new, qc_changed, cleaned, qc_full = update_qc(state, qc_path)
+    kraken_new, kraken_changed, kraken_full = update_kraken(state, kraken_path)
+
+    # Check every sample the new rows touch before anything is written
+    qc_touched = qc_new + qc_changed
+    if qc_touched:
+        check(qc_path, qc_basic_stats_violations(qc_rows(state, qc_touched)))
+    kraken_touched = kraken_new + kraken_changed
+    if kraken_touched:
+        check(kraken_path, clade_count_violations(clade_rows(state, kraken_touched)))
+
+    # Appending keeps the SRA table in date order only if every new cleaned
+    # row is dated on or after the rows already in it
+    cleaned_dates = sample_dates(pd.Series(cleaned, dtype=object))
+    cleaned_dates = cleaned_dates.dt.strftime("%Y-%m-%d").tolist()
+    last_sra_date = None if qc_full else state.get("last_sra_date")
+    sra_append = not cleaned or (
+        last_sra_date is not None and min(cleaned_dates) >= last_sra_date
+    )
+    if cleaned:
+        state["last_sra_date"] = max([last_sra_date or ""] + cleaned_dates)
+
+    def table_1_rows(samples):
+        basic_stats = dated_qc_rows(state, samples)
+        return summary_table(basic_stats[basic_stats["stage"] == "raw_concat"])
+
+    def s2_rows(samples):
+        return table_s2_rows(domain_relative_abundance(clade_rows(state, samples)))
+
+    qc_samples = list(state["qc_samples"])
+    kraken_samples = list(state["kraken_samples"])
+    results = {
+        "table_1.tsv": update_table(
+            "table_1.tsv", "sequencing_machine", table_1_rows, qc_samples, [], True
+        ),
+        "table_s1.tsv": update_table(
+            "table_s1.tsv",
+            "Sample",
+            lambda samples: table_s1_rows(dated_qc_rows(state, samples)),
+            qc_samples,
+            qc_new,
+            qc_full or bool(qc_changed),
+        ),
+        "table_s2.tsv": update_table(
+            "table_s2.tsv",
+            "Sample",
+            s2_rows,
+            kraken_samples,
+            kraken_new,
+            kraken_full or bool(kraken_changed),
+        ),
+        "bio_sample_table.tsv": update_table(
+            "bio_sample_table.tsv",
+            "Sample Name",
+            lambda samples: pd.DataFrame(bio_sample_rows(samples)),
+            qc_samples,
+            qc_new,
+            qc_full,
+        ),
+        "sra_table.tsv": update_table(
+            "sra_table.tsv",
+            "sample_name",
+            lambda samples: sra_rows(dated_qc_rows(state, samples)),
+            qc_samples,
+            cleaned,
+            qc_full or not sra_append,
+        ),
+    }
+    save_state(state)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the tables incrementally")
+    parser.add_argument("--results-dir", default=results_dir)
+    parser.add_argument(
+        "--full", action="store_true", help="re-read every source from the start"
+    )
+    args = parser.parse_args()
+    try:
+        results = update_tables(args.results_dir, args.full)
+    except ValueError as e:
+        sys.exit(str(e))
+    for name, result in results.items():
+        print(f"{name:<22} {result}")
+
+
+if __name__ == "__main__":
+    main()